@@ -1,4 +1,39 @@
-import pint
+import threading
 
-ureg = pint.UnitRegistry()
-ureg.define('gpm = gallons / minutes')
+class _LazyRegistry:
+    '''Stand-in for the package's pint.UnitRegistry.
+
+    Importing pint and building a registry takes a large fraction of a
+    second, so it is put off until the first time a unit is needed.
+    Attribute access and calls are forwarded to the real registry, so
+    `ureg.feet`, `ureg.Quantity` and `ureg('gpm')` behave exactly as
+    they would on a pint.UnitRegistry.
+    '''
+    def __init__(self):
+        self._registry = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        '''Returns the real pint.UnitRegistry, building it on first use.'''
+        if self._registry is None:
+            with self._lock:
+                if self._registry is None:
+                    import pint
+                    registry = pint.UnitRegistry()
+                    registry.define('gpm = gallons / minutes')
+                    # Quantities unpickled in other processes use the
+                    # application registry, so make it this one
+                    pint.set_application_registry(registry)
+                    self._registry = registry
+        return self._registry
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._get()(*args, **kwargs)
+
+    def __dir__(self):
+        return dir(self._get())
+
+ureg = _LazyRegistry()
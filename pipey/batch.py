@@ -0,0 +1,160 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Solving one network topology under many boundary scenarios.
+
+A scenario is a dict that may hold 'outflow', 'inflow' and 'head' keys,
+each mapping node names to pint Quantities, for example
+
+    {'outflow': {'C': 120 * ureg.gpm}, 'head': {'A': 90 * ureg.feet}}
+
+Only values can be overridden: outflows of nodes that have a continuity
+equation and heads of nodes whose head is fixed in the base network.
+'''
+
+import collections
+import concurrent.futures
+import os
+from . import compiled
+
+class ScenarioResult:
+    '''Solution of one scenario.
+
+    flow and head are arrays in SI units ordered like segment_names and
+    node_names of the base compiled.CompiledNetwork.
+    '''
+    success = True
+
+    def __init__(self, index, flow, head):
+        self.index = index
+        self.flow = flow
+        self.head = head
+
+class ScenarioFailure:
+    '''Scenario that couldn't be applied or didn't converge.'''
+    success = False
+
+    def __init__(self, index, message):
+        self.index = index
+        self.message = message
+
+    def __repr__(self):
+        return 'ScenarioFailure({!r}, {!r})'.format(self.index, self.message)
+
+def convert_scenario(base, scenario):
+    '''Returns scenario as a list of (array name, position, SI value).
+
+    Conversion happens in the calling process so that workers never
+    handle pint objects.
+    '''
+    changes = list()
+    for key, sign in (('outflow', 1), ('inflow', -1)):
+        for name, value in scenario.get(key, dict()).items():
+            changes.append(('outflow', base.node_index(name),
+                            sign * compiled._si(value, compiled.FLOW_UNITS)))
+    for name, value in scenario.get('head', dict()).items():
+        changes.append(('head', base.node_index(name),
+                        compiled._si(value, compiled.HEAD_UNITS)))
+    unknown = set(scenario) - {'outflow', 'inflow', 'head'}
+    if unknown:
+        raise KeyError('Unknown scenario keys: {}'.format(sorted(unknown)))
+    return changes
+
+def solve_scenario(base, index, changes):
+    '''Returns ScenarioResult or ScenarioFailure for changes applied to base.'''
+    network = base.copy()
+    for array, i, value in changes:
+        if array == 'outflow' and not network.continuity[i]:
+            return ScenarioFailure(index, 'outflow of node {} is unknown in '
+                                   'the base network'.format(
+                                       network.node_names[i]))
+        if array == 'head' and i in network.head_unknowns:
+            return ScenarioFailure(index, 'head of node {} is unknown in '
+                                   'the base network'.format(
+                                       network.node_names[i]))
+        getattr(network, array)[i] = value
+    try:
+        network.solve()
+    except Warning as err:
+        return ScenarioFailure(index, str(err))
+    except (ArithmeticError, ValueError) as err:
+        return ScenarioFailure(index, '{}: {}'.format(type(err).__name__, err))
+    return ScenarioResult(index, network.flow, network.head)
+
+# Each worker process holds its own copy of the base network
+_worker_base = None
+
+def _init_worker(base):
+    global _worker_base
+    _worker_base = base
+
+def _run_in_worker(index, changes):
+    return solve_scenario(_worker_base, index, changes)
+
+def run_scenarios(network, scenarios, max_workers = None, window = None):
+    '''Yields a result for every scenario in scenarios, in order.
+
+    network is a core.Network or compiled.CompiledNetwork. It is compiled
+    and detached once, and every worker process receives it once when
+    the pool starts; afterwards only the small scenario overrides and
+    result arrays cross between processes. Each scenario starts from
+    the base network's current solution.
+
+    Results are ScenarioResult objects, or ScenarioFailure objects for
+    scenarios that couldn't be applied or didn't converge. scenarios
+    may be any iterable and is consumed lazily: at most window
+    scenarios (4 per worker by default) are in flight at once.
+    max_workers = 0 solves everything in the calling process.
+    '''
+    if not isinstance(network, compiled.CompiledNetwork):
+        network = network.compile()
+    base = network.detach()
+
+    if max_workers == 0:
+        for index, scenario in enumerate(scenarios):
+            yield _solve_converted(base, index, scenario)
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    window = window or 4 * max_workers
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers = max_workers, initializer = _init_worker,
+            initargs = (base,)) as executor:
+        pending = collections.deque()
+        for index, scenario in enumerate(scenarios):
+            try:
+                changes = convert_scenario(base, scenario)
+            except (KeyError, TypeError, ValueError, AttributeError) as err:
+                pending.append(ScenarioFailure(index, str(err)))
+            else:
+                pending.append(executor.submit(_run_in_worker, index, changes))
+            while len(pending) >= window:
+                yield _result(pending.popleft())
+        while pending:
+            yield _result(pending.popleft())
+
+def _solve_converted(base, index, scenario):
+    try:
+        changes = convert_scenario(base, scenario)
+    except (KeyError, TypeError, ValueError, AttributeError) as err:
+        return ScenarioFailure(index, str(err))
+    return solve_scenario(base, index, changes)
+
+def _result(item):
+    if isinstance(item, concurrent.futures.Future):
+        return item.result()
+    return item
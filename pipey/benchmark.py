@@ -0,0 +1,188 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Benchmarks of parsing, residuals, friction factors and solves.
+
+Networks from pipey.generate are written to .pipey files and timed at
+each requested size, with every solver engine run on the same input.
+Run as
+
+    python -m pipey.benchmark --sizes 100 1000 10000 -o results.json
+
+to save the records as JSON. Each record holds the network kind and
+size and, for each measurement, seconds taken; solves also record
+iterations, the final residual norm, evaluation counts and per-phase
+times from their instrument.SolveReport and the peak memory traced
+while solving; parsing records its peak memory too.
+The pint-based Network.get_errors and Network.solve are only timed up
+to --pint-limit segments since they grow far faster than the rest.
+'''
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from . import core
+from . import engines
+from . import generate
+from . import instrument
+from . import utils
+
+KINDS = {
+    'grid': lambda n, seed: generate.grid(*(2 * [max(2, round(n**0.5))])),
+    'tree': lambda n, seed: generate.tree(n, seed),
+    'looped': lambda n, seed: generate.looped(n, max(1, n // 20), seed)}
+PINT_LIMIT = 300
+# Engines that hold a dense Jacobian are skipped above this many unknowns
+DENSE_LIMIT = 3000
+
+def _timed(function, *args):
+    '''Returns (result of function(*args), seconds it took).'''
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def _peak_bytes(function, *args):
+    '''Returns peak memory traced while running function(*args).'''
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _solve_record(network, engine):
+    '''Returns dict of time, solve report and peak memory of a solve.
+
+    Every solve starts from a fresh copy of network, so engines are
+    compared from the same starting point.
+    '''
+    copy = network.copy()
+    # Each engine builds its own patterns and orderings from scratch
+    copy.solver_cache = dict()
+    record = {'engine': engine}
+    with instrument.Recorder():
+        report = instrument.SolveReport(engine)
+        try:
+            _, record['seconds'] = _timed(engines.solve, copy, engine,
+                                          report)
+        except ValueError as err:
+            record['error'] = str(err)
+            return record
+        except instrument.ConvergenceWarning as err:
+            record['error'] = str(err)
+    record.update(iterations = report.iterations,
+                  residual_norm = report.residual_norm,
+                  fallback = report.fallback,
+                  counters = report.counters,
+                  timings = report.timings)
+    if 'error' in record:
+        return record
+
+    # Tracing slows everything down, so memory is measured separately
+    copy = network.copy()
+    copy.solver_cache = dict()
+    record['peak_bytes'] = _peak_bytes(engines.solve, copy, engine)
+    return record
+
+def benchmark(kind, size, directory, engine_names = ('gga', 'newton', 'loop',
+                                                      'hybr'),
+              seed = 0, pint_limit = PINT_LIMIT):
+    '''Returns dict of measurements for one generated network.'''
+    segments = KINDS[kind](size, seed)
+    filename = os.path.join(directory, '{}_{}.pipey'.format(kind, size))
+    generate.write(filename, segments, seed)
+    record = {'kind': kind, 'size': size, 'segments': len(segments)}
+
+    network = core.Network()
+    _, record['parse_seconds'] = _timed(network.load, filename)
+    # Traced on a separate Network, like the solves, since tracing slows
+    # parsing down
+    record['parse_peak_bytes'] = _peak_bytes(core.Network().load, filename)
+    compiled, record['compile_seconds'] = _timed(network.compile)
+    record['unknowns'] = compiled.n_unknowns
+    x = compiled.initial_guess()
+    _, record['residual_seconds'] = _timed(compiled.residuals, x)
+
+    rng = np.random.default_rng(seed)
+    rr = rng.uniform(1e-5, 1e-3, len(segments))
+    re = rng.uniform(1e3, 1e6, len(segments))
+    _, record['friction_seconds'] = _timed(utils.darcy_friction_factors,
+                                           rr, re)
+
+    if len(segments) <= pint_limit:
+        _, record['pint_residual_seconds'] = _timed(
+            network._attempt_solution, network._initial_guess())
+        _, record['colebrook_seconds'] = _timed(
+            lambda: [utils.colebrook(a, b) for a, b in zip(rr, re)])
+        legacy = core.Network()
+        legacy.load(filename)
+        try:
+            _, record['pint_solve_seconds'] = _timed(legacy.solve)
+        except Warning as err:
+            record['pint_solve_error'] = str(err)
+
+    record['solves'] = [_solve_record(compiled, name)
+                        for name in engine_names
+                        if name != 'hybr' or compiled.n_unknowns <= DENSE_LIMIT]
+    return record
+
+def run(kinds = tuple(KINDS), sizes = (100, 1000), directory = None,
+        **kwargs):
+    '''Returns list of benchmark records for every kind at every size.
+
+    Network files are written to directory, or to a temporary directory
+    that is removed afterwards. Other keyword arguments are handed to
+    benchmark.
+    '''
+    if directory is None:
+        with tempfile.TemporaryDirectory() as directory:
+            return run(kinds, sizes, directory, **kwargs)
+    return [benchmark(kind, size, directory, **kwargs)
+            for size in sizes for kind in kinds]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('--sizes', type = int, nargs = '+',
+                        default = [100, 1000])
+    parser.add_argument('--kinds', nargs = '+', choices = sorted(KINDS),
+                        default = sorted(KINDS))
+    parser.add_argument('--engines', nargs = '+',
+                        choices = sorted(engines.ENGINES),
+                        default = ['gga', 'newton', 'loop', 'hybr'])
+    parser.add_argument('--pint-limit', type = int, default = PINT_LIMIT)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--directory', help = 'keep network files here')
+    parser.add_argument('-o', '--output', default = 'benchmark.json')
+    args = parser.parse_args(argv)
+
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.machine(),
+               'records': run(args.kinds, args.sizes, args.directory,
+                              engine_names = tuple(args.engines),
+                              seed = args.seed,
+                              pint_limit = args.pint_limit)}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Binary snapshots of compiled networks kept next to their .pipey source.
+
+A snapshot of network.pipey is written to network.pipeyc. The file
+starts with MAGIC, the length of a JSON header, and the header itself.
+The header records the size, modification time and SHA-256 of the
+source it was built from, the element class of every group by its
+registry name, and the dtype, shape and offset of every array. Arrays
+follow the header, each aligned to ALIGNMENT bytes, so that load can
+memory-map them without reading or copying anything.
+Processes that open the same snapshot share its pages.
+'''
+
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+from . import compiled
+from . import element_classes
+from . import registry
+
+MAGIC = b'PIPEYC\x00\x02'
+ALIGNMENT = 64
+# Classes compiled networks make themselves, which aren't in the registry
+INTERNAL_CLASSES = {'Resistance': element_classes.Resistance}
+
+def cache_filename(source):
+    '''Returns name of the snapshot file for source.'''
+    root, ext = os.path.splitext(source)
+    return root + (ext + 'c' if ext == '.pipey' else ext + '.pipeyc')
+
+def _source_key(source):
+    '''Returns dict identifying the current contents of source.'''
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': _hash_file(source)}
+
+def _hash_file(source):
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _class_name(element_class):
+    '''Returns name element_class is saved under; ValueError if none.'''
+    for name, internal in INTERNAL_CLASSES.items():
+        if internal is element_class:
+            return name
+    try:
+        return registry.name_of(element_class)
+    except KeyError as err:
+        raise ValueError("Networks with unregistered elements can't be "
+                         'cached') from err
+
+def _element_class(name):
+    '''Returns class saved as name; KeyError if it isn't known.
+
+    Only internal classes and names in the element registry are
+    resolved, so a snapshot can never make anything else be imported.
+    '''
+    if name in INTERNAL_CLASSES:
+        return INTERNAL_CLASSES[name]
+    return registry.element_class(name)
+
+def save(network, source):
+    '''Writes compiled.CompiledNetwork network as the snapshot of source.
+
+    Raises ValueError if some elements don't provide batch_loss, since
+    those can only be evaluated through their Python objects, or aren't
+    in the element registry, since they couldn't be found again. The file
+    is written under a temporary name and moved into place, so readers
+    never see a partial snapshot.
+    '''
+    if any(not isinstance(g, compiled.BatchGroup) for g in network.groups):
+        raise ValueError('Networks with elements lacking batch_loss '
+                         "can't be cached")
+
+    arrays = [(name, getattr(network, name))
+              for name in compiled.CompiledNetwork.ARRAYS]
+    groups = list()
+    for i, group in enumerate(network.groups):
+        groups.append(_class_name(group.element_class))
+        arrays.append(('group{}_index'.format(i), group.segment_index))
+        arrays.append(('group{}_params'.format(i), group.params))
+
+    entries = dict()
+    offset = 0
+    for name, array in arrays:
+        array = np.ascontiguousarray(array)
+        if array.dtype == object:
+            array = array.astype(str)
+        entries[name] = {'dtype': array.dtype.str, 'shape': array.shape,
+                         'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({'source': _source_key(source), 'groups': groups,
+                         'arrays': entries}).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    filename = cache_filename(source)
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays:
+            f.seek(data_start + entries[name]['offset'])
+            f.write(np.ascontiguousarray(array, dtype =
+                                         entries[name]['dtype']).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(temporary, filename)
+
+def _read_header(filename):
+    '''Returns (header dict, data start offset) or None if not a snapshot.'''
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+
+def is_fresh(source, key):
+    '''Returns True if the source key stored in a snapshot matches source.
+
+    The size and modification time are compared first; the file is
+    only hashed when the size matches but the time doesn't, so a
+    touched but unchanged source is still recognised. When both match
+    the hash is skipped to keep opening a snapshot cheap, which trusts
+    that nothing rewrote the source to the same size and then set its
+    modification time back. Delete the snapshot if something might.
+    '''
+    stat = os.stat(source)
+    if stat.st_size != key['size']:
+        return False
+    if stat.st_mtime_ns == key['mtime_ns']:
+        return True
+    return _hash_file(source) == key['sha256']
+
+def load(source):
+    '''Returns memory-mapped compiled.CompiledNetwork snapshot of source.
+
+    None is returned if there is no snapshot, it was built from a
+    different version of source, or it names an element class that
+    isn't in the registry.
+    '''
+    filename = cache_filename(source)
+    try:
+        found = _read_header(filename)
+    except (OSError, ValueError):
+        return None
+    if found is None:
+        return None
+    header, data_start = found
+    if not is_fresh(source, header['source']):
+        return None
+
+    arrays = dict()
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=data_start + entry['offset'],
+                                     shape=shape)
+    try:
+        classes = [_element_class(name) for name in header['groups']]
+    except KeyError:
+        return None
+    groups = [compiled.BatchGroup(element_class,
+                                  arrays['group{}_index'.format(i)],
+                                  arrays['group{}_params'.format(i)])
+              for i, element_class in enumerate(classes)]
+    return compiled.CompiledNetwork.from_arrays(arrays, groups)
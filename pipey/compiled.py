@@ -0,0 +1,716 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit-free, array-backed representation of a Network.
+
+A CompiledNetwork is built once from a core.Network. Everything inside
+it is a NumPy array in SI units (flow in m**3/s, head in m), so residuals
+and Jacobians can be evaluated without creating any pint objects. Pint
+is only used when converting the Network in and when writing a solution
+back out.
+'''
+
+import collections.abc
+import copy
+import numpy as np
+from scipy import sparse
+from . import element_classes
+from . import instrument
+from . import ureg
+from . import utils
+
+FLOW_UNITS = 'meter**3 / second'
+HEAD_UNITS = 'meter'
+DENSITY_UNITS = 'kilogram / meter**3'
+VISCOSITY_UNITS = 'pascal * second'
+
+def _si(value, units):
+    '''Returns magnitude of pint Quantity value in units.
+
+    None is returned as NaN and plain numbers are assumed to already be
+    in units.
+    '''
+    if value is None:
+        return np.nan
+    if isinstance(value, ureg.Quantity):
+        return value.to(units).magnitude
+    return float(value)
+
+class BatchGroup:
+    '''All elements of one class that provide batch_loss.
+
+    The element class evaluates every element in the group with a
+    single call over arrays of flows.
+    '''
+    def __init__(self, element_class, segment_index, params, elements = None):
+        self.element_class = element_class
+        self.elements = elements # kept so update_segment can re-read them
+        self.segment_index = np.asarray(segment_index, dtype=np.intp)
+        self.params = np.asarray(params, dtype=float).reshape(
+            len(self.segment_index), -1)
+        self.has_derivative = hasattr(element_class, 'batch_derivative')
+
+    def loss(self, flow, density, viscosity):
+        i = self.segment_index
+        return self.element_class.batch_loss(self.params, flow[i],
+                                             density[i], viscosity[i])
+
+    def derivative(self, flow, density, viscosity):
+        i = self.segment_index
+        return self.element_class.batch_derivative(self.params, flow[i],
+                                                   density[i], viscosity[i])
+
+    def subset(self, rows, segment_index):
+        '''Returns BatchGroup of only rows, on segments segment_index.'''
+        elements = self.elements
+        if elements is not None:
+            elements = [elements[r] for r in rows]
+        return BatchGroup(self.element_class, segment_index,
+                          self.params[rows], elements)
+
+class ScalarGroup:
+    '''Elements without batch_loss, evaluated one at a time through pint.
+
+    This keeps custom elements working in compiled mode, although they
+    don't get any of its speed.
+    '''
+    def __init__(self, element_class, segment_index, elements):
+        self.element_class = element_class
+        self.segment_index = np.asarray(segment_index, dtype=np.intp)
+        self.elements = list(elements)
+        self.has_derivative = all(hasattr(e, 'calculate_derivative')
+                                  for e in self.elements)
+        self._flow_units = ureg.parse_units(FLOW_UNITS)
+        self._deriv_units = ureg.parse_units(HEAD_UNITS) / self._flow_units
+
+    def loss(self, flow, density, viscosity):
+        flow = flow[self.segment_index]
+        return np.array([_si(e.calculate_loss(q * self._flow_units),
+                             HEAD_UNITS)
+                         for e, q in zip(self.elements, flow)], dtype=float)
+
+    def derivative(self, flow, density, viscosity):
+        flow = flow[self.segment_index]
+        return np.array([_si(e.calculate_derivative(q * self._flow_units),
+                             self._deriv_units)
+                         for e, q in zip(self.elements, flow)], dtype=float)
+
+    def subset(self, rows, segment_index):
+        '''Returns ScalarGroup of only rows, on segments segment_index.'''
+        return ScalarGroup(self.element_class, segment_index,
+                           [self.elements[r] for r in rows])
+
+class FoldedRows(collections.abc.Sequence):
+    '''Sequence of the folded constant-K elements of some segments.
+
+    Item i is an element_classes.Resistance of the elements with
+    loss_coefficient in segments[index[i]], rebuilt on access so that
+    update_segment sees changes made through set_element.
+    '''
+    def __init__(self, segments, index):
+        self.segments = segments
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        elements = self.segments[self.index[i]].elements
+        return element_classes.Resistance(
+            [e for e in elements if hasattr(e, 'loss_coefficient')])
+
+def _folded_group(segments, index, coefficients):
+    '''Returns BatchGroup of one Resistance per segment, or None if empty.
+
+    index and coefficients give the segment and loss_coefficient of
+    each constant-K element; those on the same segment are summed.
+    '''
+    if not len(index):
+        return None
+    total = np.bincount(index, weights=coefficients,
+                        minlength=len(segments))
+    folded = np.unique(index)
+    return BatchGroup(element_classes.Resistance, folded, total[folded],
+                      FoldedRows(segments, folded))
+
+class CompiledNetwork:
+    '''Array snapshot of a Network's topology, elements and boundaries.
+
+    Unknowns are taken from network.unknowns (running
+    network._find_unknowns if needed) and are ordered the same way, and
+    residuals are ordered the same way as Network.get_errors, so the two
+    representations can be used interchangeably by a solver. All values
+    are in SI units.
+    '''
+    def __init__(self, network):
+        started = instrument.start()
+        if not hasattr(network, 'unknowns'):
+            network._find_unknowns()
+        if getattr(network, 'store', None) is not None:
+            self._read_store(network)
+            instrument.stop('setup', started)
+            return
+
+        self.segments = list(network.segments.values())
+        self.nodes = list(network.nodes.values())
+        self.segment_names = list(network.segments)
+        self.node_names = list(network.nodes)
+
+        node_index = {id(node): i for i, node in enumerate(self.nodes)}
+        self.start = np.array([node_index[id(seg.start)]
+                               for seg in self.segments], dtype=np.intp)
+        self.end = np.array([node_index[id(seg.end)]
+                             for seg in self.segments], dtype=np.intp)
+
+        # Boundary conditions and current values
+        self.flow = np.array([_si(seg.flow, FLOW_UNITS)
+                              for seg in self.segments], dtype=float)
+        self.head = np.array([_si(node.head, HEAD_UNITS)
+                              for node in self.nodes], dtype=float)
+        self.continuity = np.array([node.outflow is not None
+                                    for node in self.nodes], dtype=bool)
+        self.outflow = np.array([_si(node.outflow, FLOW_UNITS)
+                                 for node in self.nodes], dtype=float)
+
+        owners = [id(method.__self__) for method in network.unknowns]
+        seg_index = {id(seg): i for i, seg in enumerate(self.segments)}
+        self.flow_unknowns = np.array([seg_index[o] for o in owners
+                                       if o in seg_index], dtype=np.intp)
+        self.head_unknowns = np.array([node_index[o] for o in owners
+                                       if o in node_index], dtype=np.intp)
+        # Unknowns that were never set start from zero; ones left over
+        # from an earlier solve are kept as a starting point
+        for values, unknowns in ((self.flow, self.flow_unknowns),
+                                 (self.head, self.head_unknowns)):
+            values[unknowns] = np.nan_to_num(values[unknowns])
+
+        n_segs = len(self.segments)
+        self.density = np.full(n_segs, _si(network.fluid.density,
+                                           DENSITY_UNITS))
+        self.viscosity = np.full(n_segs, _si(network.fluid.viscosity,
+                                             VISCOSITY_UNITS))
+
+        self.groups = self._group_elements()
+        self._setup()
+        instrument.stop('setup', started)
+
+    @classmethod
+    def from_arrays(cls, arrays, groups):
+        '''Returns CompiledNetwork rebuilt from arrays without a Network.
+
+        arrays is a dict holding every array attribute listed in ARRAYS
+        and groups is a list of BatchGroup objects. This is how cached
+        snapshots are reopened; since there are no PipeSegment or Node
+        objects, store only updates the flow and head arrays.
+        '''
+        snapshot = cls.__new__(cls)
+        snapshot.segments = None
+        snapshot.nodes = None
+        for name in cls.ARRAYS:
+            setattr(snapshot, name, arrays[name])
+        snapshot.groups = list(groups)
+        snapshot._setup()
+        return snapshot
+
+    # Array attributes that fully describe a CompiledNetwork along with
+    # its BatchGroups
+    ARRAYS = ('segment_names', 'node_names', 'start', 'end', 'flow', 'head',
+              'continuity', 'outflow', 'flow_unknowns', 'head_unknowns',
+              'density', 'viscosity')
+
+    def _setup(self):
+        '''Builds everything that is derived from the array attributes.'''
+        self.n_segs = n_segs = len(self.start)
+        self.n_nodes = n_nodes = len(self.node_names)
+
+        # incidence[node, seg] is +1 where the segment flows into the node
+        # and -1 where it flows out of it
+        seg_range = np.arange(n_segs)
+        self.incidence = sparse.coo_matrix(
+            (np.concatenate((np.ones(n_segs), -np.ones(n_segs))),
+             (np.concatenate((self.end, self.start)),
+              np.concatenate((seg_range, seg_range)))),
+            shape = (n_nodes, n_segs)).tocsr()
+
+        self.has_derivatives = all(g.has_derivative for g in self.groups)
+        # Topology-dependent data that solver engines keep between solves;
+        # copies share it since they share the topology
+        self.solver_cache = dict()
+        self._node_index = None
+        self._segment_index = None
+
+        self._gpm = (1 * ureg.gpm).to(FLOW_UNITS).magnitude
+        self._foot = (1 * ureg.feet).to(HEAD_UNITS).magnitude
+
+        # SI flows and heads differ by orders of magnitude, which upsets
+        # MINPACK's step control. Solvers that care can work in the same
+        # gpm and feet the pint-based solve uses.
+        self.x_scale = np.concatenate(
+            (np.full(len(self.flow_unknowns), self._gpm),
+             np.full(len(self.head_unknowns), self._foot)))
+        self.r_scale = np.concatenate(
+            (np.full(n_segs, self._foot),
+             np.full(self.continuity.sum(), self._gpm)))
+
+    def _read_store(self, network):
+        '''Fills in the arrays straight from the columns of network.store.
+
+        This is how compact Networks are compiled; nothing is read
+        through the segment and node views except which are unknown.
+        '''
+        from . import store
+        backing = network.store
+        columns = backing.columns()
+        self.segments = backing.segment_list()
+        self.nodes = backing.node_list()
+        self.segment_names = list(backing.segment_index)
+        self.node_names = list(backing.node_index)
+        self.start, self.end = columns['start'], columns['end']
+
+        gpm = _si(1 * ureg.gpm, FLOW_UNITS)
+        foot = _si(1 * ureg.feet, HEAD_UNITS)
+        self.flow = columns['flow'] * gpm
+        self.head = columns['head'] * foot
+        self.outflow = columns['outflow'] * gpm
+        self.continuity = ~np.isnan(self.outflow)
+        owners = [method.__self__ for method in network.unknowns]
+        self.flow_unknowns = np.array(
+            [o._index for o in owners if isinstance(o, store.SegmentView)],
+            dtype=np.intp)
+        self.head_unknowns = np.array(
+            [o._index for o in owners if isinstance(o, store.NodeView)],
+            dtype=np.intp)
+        for values, unknowns in ((self.flow, self.flow_unknowns),
+                                 (self.head, self.head_unknowns)):
+            values[unknowns] = np.nan_to_num(values[unknowns])
+
+        n_segs = len(self.start)
+        self.density = np.full(n_segs, _si(network.fluid.density,
+                                           DENSITY_UNITS))
+        self.viscosity = np.full(n_segs, _si(network.fluid.viscosity,
+                                             VISCOSITY_UNITS))
+
+        self.groups = list()
+        fold_index, fold_coefficients = list(), list()
+        for kind, table in enumerate(backing.tables):
+            index = columns['element_segment'][columns['element_kind'] == kind]
+            # Elements of replaced segments are left behind at -1
+            rows = np.flatnonzero(index >= 0)
+            index = index[rows]
+            if hasattr(table.element_class, 'loss_coefficient'):
+                fold_index.append(index)
+                if table.tabled and hasattr(table.element_class,
+                                            'batch_coefficients'):
+                    fold_coefficients.append(
+                        table.element_class.batch_coefficients(
+                            table.parameters()[rows]))
+                else:
+                    fold_coefficients.append(
+                        [table.values[r].loss_coefficient() for r in rows])
+            elif table.tabled:
+                self.groups.append(BatchGroup(
+                    table.element_class, index, table.parameters()[rows],
+                    store.TableRows(table, backing.fluid, rows)))
+            elif hasattr(table.element_class, 'batch_loss'):
+                elements = [table.values[r] for r in rows]
+                self.groups.append(BatchGroup(
+                    table.element_class, index,
+                    [e.batch_parameters() for e in elements], elements))
+            else:
+                self.groups.append(ScalarGroup(
+                    table.element_class, index,
+                    [table.values[r] for r in rows]))
+        if fold_index:
+            folded = _folded_group(self.segments, np.concatenate(fold_index),
+                                   np.concatenate(fold_coefficients))
+            if folded is not None:
+                self.groups.append(folded)
+        self._setup()
+
+    def _group_elements(self):
+        '''Returns list of BatchGroup and ScalarGroup objects for all elements.'''
+        by_class = dict()
+        # Constant-K elements are summed into one Resistance per segment
+        fold_index, fold_coefficients = list(), list()
+        for i, seg in enumerate(self.segments):
+            for element in seg.elements:
+                if hasattr(element, 'loss_coefficient'):
+                    fold_index.append(i)
+                    fold_coefficients.append(element.loss_coefficient())
+                    continue
+                index, elements = by_class.setdefault(type(element),
+                                                      (list(), list()))
+                index.append(i)
+                elements.append(element)
+
+        groups = list()
+        for element_class, (index, elements) in by_class.items():
+            if hasattr(element_class, 'batch_loss'):
+                params = [e.batch_parameters() for e in elements]
+                groups.append(BatchGroup(element_class, index, params,
+                                         elements))
+            else:
+                groups.append(ScalarGroup(element_class, index, elements))
+        folded = _folded_group(self.segments,
+                               np.array(fold_index, dtype=np.intp),
+                               np.array(fold_coefficients, dtype=float))
+        if folded is not None:
+            groups.append(folded)
+        return groups
+
+    @property
+    def n_unknowns(self):
+        return len(self.flow_unknowns) + len(self.head_unknowns)
+
+    def initial_guess(self):
+        '''Returns the current values of the unknowns as an array.'''
+        return np.concatenate((self.flow[self.flow_unknowns],
+                               self.head[self.head_unknowns]))
+
+    def expand(self, x):
+        '''Returns full (flow, head) arrays with the unknowns set to x.'''
+        n_flows = len(self.flow_unknowns)
+        flow = self.flow.copy()
+        head = self.head.copy()
+        flow[self.flow_unknowns] = x[:n_flows]
+        head[self.head_unknowns] = x[n_flows:]
+        return flow, head
+
+    def losses(self, flow):
+        '''Returns array of head loss across every segment.'''
+        instrument.count('losses')
+        started = instrument.start()
+        loss = np.zeros(self.n_segs)
+        for group in self.groups:
+            np.add.at(loss, group.segment_index,
+                      group.loss(flow, self.density, self.viscosity))
+        instrument.stop('losses', started)
+        return loss
+
+    def loss_derivatives(self, flow):
+        '''Returns array of d(head loss)/d(flow) for every segment.'''
+        instrument.count('loss_derivatives')
+        started = instrument.start()
+        deriv = np.zeros(self.n_segs)
+        for group in self.groups:
+            np.add.at(deriv, group.segment_index,
+                      group.derivative(flow, self.density, self.viscosity))
+        instrument.stop('losses', started)
+        return deriv
+
+    def loss_slopes(self, flow, loss = None):
+        '''Returns d(head loss)/d(flow) per segment, by differences if needed.
+
+        Every segment's loss depends on its own flow only, so without
+        analytic derivatives every flow can be perturbed at once (a
+        single colour in Curtis-Powell-Reid terms) and one extra
+        evaluation of losses gives them all. loss, the losses at flow,
+        saves an evaluation when it is already known.
+        '''
+        if self.has_derivatives:
+            return self.loss_derivatives(flow)
+        if loss is None:
+            loss = self.losses(flow)
+        step = 1e-6 * np.maximum(abs(flow), self._gpm)
+        return (self.losses(flow + step) - loss) / step
+
+    def residuals(self, x):
+        '''Returns array of errors in head loss and continuity equations.
+
+        Segment errors come first, followed by the continuity errors of
+        every node with a known outflow, matching Network.get_errors.
+        '''
+        instrument.count('residuals')
+        flow, head = self.expand(x)
+        seg_errors = head[self.end] + self.losses(flow) - head[self.start]
+        node_errors = self.incidence @ flow - self.outflow
+        return np.concatenate((seg_errors, node_errors[self.continuity]))
+
+    def jacobian(self, x):
+        '''Returns sparse CSR Jacobian of residuals with respect to x.
+
+        Loss slopes are taken by differences from loss_slopes when some
+        elements have no derivative; the rest of the matrix is exact.
+        '''
+        instrument.count('jacobians')
+        flow, head = self.expand(x)
+        n_segs = self.n_segs
+        deriv = self.loss_slopes(flow)
+
+        # Columns of the full system: all flows then all heads
+        seg_rows = sparse.coo_matrix(
+            (np.concatenate((deriv, np.ones(n_segs), -np.ones(n_segs))),
+             (np.tile(np.arange(n_segs), 3),
+              np.concatenate((np.arange(n_segs),
+                              n_segs + self.end, n_segs + self.start)))),
+            shape = (n_segs, n_segs + self.n_nodes))
+        node_rows = sparse.hstack((self.incidence[self.continuity],
+                                   sparse.csr_matrix((self.continuity.sum(),
+                                                      self.n_nodes))))
+        full = sparse.vstack((seg_rows, node_rows)).tocsc()
+        columns = np.concatenate((self.flow_unknowns,
+                                  n_segs + self.head_unknowns))
+        return full[:, columns].tocsr()
+
+    def scaled_residuals(self, z):
+        '''Returns residuals in feet and gpm for unknowns z in feet and gpm.'''
+        return self.residuals(z * self.x_scale) / self.r_scale
+
+    def scaled_jacobian(self, z):
+        '''Returns sparse Jacobian of scaled_residuals with respect to z.'''
+        jac = self.jacobian(z * self.x_scale)
+        return (sparse.diags(1 / self.r_scale) @ jac
+                @ sparse.diags(self.x_scale)).tocsr()
+
+    def detach(self):
+        '''Returns copy of the snapshot that holds nothing but arrays.
+
+        The copy has no PipeSegment, Node or element objects, so it is
+        cheap to pickle and send to other processes. Raises ValueError
+        if some elements can only be evaluated through their objects.
+        '''
+        if any(not isinstance(g, BatchGroup) for g in self.groups):
+            raise ValueError('elements without batch_loss need their '
+                             'Network')
+        groups = [BatchGroup(g.element_class, g.segment_index, g.params)
+                  for g in self.groups]
+        return CompiledNetwork.from_arrays(
+            {name: getattr(self, name) for name in self.ARRAYS}, groups)
+
+    def copy(self):
+        '''Returns copy sharing topology and elements but not boundary values.
+
+        flow, head and outflow are copied, so the copy can be given
+        different boundary conditions and solved without affecting self.
+        '''
+        other = copy.copy(self)
+        other.flow = np.array(self.flow)
+        other.head = np.array(self.head)
+        other.outflow = np.array(self.outflow)
+        return other
+
+    def node_index(self, name):
+        '''Returns position of node name in the node arrays.'''
+        if self._node_index is None:
+            self._node_index = {n: i for i, n in enumerate(self.node_names)}
+        return self._node_index[name]
+
+    def segment_index(self, name):
+        '''Returns position of segment name in the segment arrays.'''
+        if self._segment_index is None:
+            self._segment_index = {n: i for i, n
+                                   in enumerate(self.segment_names)}
+        return self._segment_index[name]
+
+    def components(self):
+        '''Returns list of segment index arrays, one per independent piece.
+
+        A node with a known head and no continuity equation, such as a
+        reservoir, passes nothing between the segments that meet at it,
+        so the network is cut apart at those nodes as well as between
+        disconnected systems. Segments are linked only through nodes
+        with an unknown head or a continuity equation.
+        '''
+        from scipy.sparse import csgraph
+        coupling = self.continuity.copy()
+        coupling[self.head_unknowns] = True
+        # Built from start and end rather than incidence, whose entries
+        # cancel for a segment that starts and ends at the same node
+        seg_range = np.arange(self.n_segs)
+        links = sparse.coo_matrix(
+            (np.ones(2 * self.n_segs),
+             (np.concatenate((self.start, self.end)),
+              np.concatenate((seg_range, seg_range)))),
+            shape = (self.n_nodes, self.n_segs)).tocsr()[coupling]
+        n_pieces, labels = csgraph.connected_components(
+            (links.T @ links).tocsr(), directed = False)
+        order = np.argsort(labels, kind = 'stable')
+        return np.split(order, np.cumsum(np.bincount(labels))[:-1])
+
+    def subnetwork(self, segments):
+        '''Returns (CompiledNetwork, node indices) for only segments.
+
+        The piece holds segments, in the order given, and every node at
+        either end of them. Unknowns and residuals of the piece are
+        those of the full network restricted to it, so solving a piece
+        from components gives the same values as solving the whole.
+        '''
+        segments = np.asarray(segments, dtype=np.intp)
+        nodes, ends = np.unique(np.concatenate((self.start[segments],
+                                                self.end[segments])),
+                                return_inverse = True)
+        seg_map = np.full(self.n_segs, -1, dtype=np.intp)
+        seg_map[segments] = np.arange(len(segments))
+        node_map = np.full(self.n_nodes, -1, dtype=np.intp)
+        node_map[nodes] = np.arange(len(nodes))
+
+        flow_unknowns = seg_map[self.flow_unknowns]
+        head_unknowns = node_map[self.head_unknowns]
+        arrays = {
+            'segment_names': [self.segment_names[i] for i in segments],
+            'node_names': [self.node_names[i] for i in nodes],
+            'start': ends[:len(segments)],
+            'end': ends[len(segments):],
+            'flow': self.flow[segments],
+            'head': self.head[nodes],
+            'continuity': self.continuity[nodes],
+            'outflow': self.outflow[nodes],
+            'flow_unknowns': flow_unknowns[flow_unknowns >= 0],
+            'head_unknowns': head_unknowns[head_unknowns >= 0],
+            'density': self.density[segments],
+            'viscosity': self.viscosity[segments]}
+
+        groups = list()
+        for group in self.groups:
+            rows = np.flatnonzero(seg_map[group.segment_index] >= 0)
+            if len(rows):
+                groups.append(group.subset(
+                    rows, seg_map[group.segment_index[rows]]))
+        return CompiledNetwork.from_arrays(arrays, groups), nodes
+
+    def update_node(self, i):
+        '''Re-reads the outflow and, if known, the head of node i.
+
+        Only values can be patched this way; if the node's head or
+        outflow changed between known and unknown, compile again.
+        '''
+        node = self.nodes[i]
+        if self.continuity[i]:
+            self.outflow[i] = _si(node.outflow, FLOW_UNITS)
+        if i not in self.head_unknowns:
+            self.head[i] = _si(node.head, HEAD_UNITS)
+
+    def update_segment(self, i):
+        '''Re-reads the parameters of every element of segment i.'''
+        # ScalarGroups read their elements on every call already
+        for group in self.groups:
+            if isinstance(group, BatchGroup):
+                for row in np.flatnonzero(group.segment_index == i):
+                    group.params[row] = group.elements[row].batch_parameters()
+
+    def set_fluid(self, fluid, temperature = None):
+        '''Sets density and viscosity of every segment from core.Fluid fluid.
+
+        temperature is a pint Quantity holding one value or one per
+        segment, all looked up in fluid's table at once; without it the
+        fluid's current density and viscosity are used. New arrays are
+        made, so copies of this network keep their old properties.
+        '''
+        n_segs = len(self.density)
+        if temperature is None:
+            density = _si(fluid.density, DENSITY_UNITS)
+            viscosity = _si(fluid.viscosity, VISCOSITY_UNITS)
+        else:
+            density, viscosity = fluid.properties(temperature)
+        self.density = np.broadcast_to(density, n_segs).astype(float)
+        self.viscosity = np.broadcast_to(viscosity, n_segs).astype(float)
+
+    def solve(self, engine = None, callback = None):
+        '''Solves for the unknowns, stores the result and returns a report.
+
+        engine names the solver in engines.ENGINES, by default the one
+        engines.default_engine picks; other engines fall back to hybr if
+        they don't converge. Solvers start from
+        initial_guess, so a snapshot that already holds a solution is
+        re-solved from it. callback is called after every solver step
+        (see instrument.SolveReport.step), and the finished
+        instrument.SolveReport is returned.
+        '''
+        from . import engines
+        if engine is None:
+            engine = engines.default_engine(self)
+        report = instrument.SolveReport(engine, callback)
+        self.store(engines.solve(self, engine, report))
+        return report
+
+    def solve_split(self, max_workers = None, processes = False,
+                    engine = None, callback = None):
+        '''Solves each piece from components separately and stores the result.
+
+        Pieces are independent, so they are solved concurrently on a
+        thread pool, or on a process pool if processes is True (which
+        needs every element to provide batch_loss, as for detach).
+        max_workers is handed to the pool; 0 solves the pieces one
+        after another in this thread. Each piece is solved with engine
+        and callback, except that callback isn't passed to other
+        processes. Nothing is stored unless every piece converges;
+        otherwise Warning is raised with the first failure.
+
+        Returns an instrument.SolveReport summing those of the pieces,
+        which are kept in its pieces attribute. Without engine, the one
+        engines.default_engine picks for the whole network is used.
+        '''
+        from . import engines
+        if engine is None:
+            engine = engines.default_engine(self)
+        report = instrument.SolveReport(engine)
+        pieces = [self.subnetwork(segs) + (segs,)
+                  for segs in self.components()]
+        if processes:
+            jobs = [(piece.detach(), engine, None) for piece, _, _ in pieces]
+        else:
+            jobs = [(piece, engine, callback) for piece, _, _ in pieces]
+
+        if max_workers == 0 or len(jobs) == 1:
+            results = map(_solve_piece, jobs)
+        else:
+            from concurrent import futures
+            if processes:
+                pool = futures.ProcessPoolExecutor(max_workers)
+            else:
+                pool = futures.ThreadPoolExecutor(max_workers)
+            with pool:
+                results = list(pool.map(_solve_piece, jobs))
+
+        flow = self.flow.copy()
+        head = self.head.copy()
+        reports = list()
+        for (_, nodes, segs), (piece_flow, piece_head, piece_report) in zip(
+                pieces, results):
+            flow[segs] = piece_flow
+            head[nodes] = piece_head
+            reports.append(piece_report)
+        self.flow, self.head = flow, head
+        self.store(self.initial_guess())
+        return report.combine(reports)
+
+    def store(self, x):
+        '''Stores solution x in self.flow and self.head.
+
+        If the snapshot was compiled from a Network, x is also written
+        back to its segments and nodes. Values are handed to set_val, so
+        they come back in the same units a non-compiled solve would
+        produce.
+        '''
+        self.flow, self.head = self.expand(x)
+        if self.segments is None:
+            return
+        for i in self.flow_unknowns:
+            self.segments[i].set_val(self.flow[i] / self._gpm)
+        for i in self.head_unknowns:
+            self.nodes[i].set_val(self.head[i] / self._foot)
+
+    def save(self, source):
+        '''Saves a binary snapshot next to source with cache.save.'''
+        from . import cache
+        cache.save(self, source)
+
+def _solve_piece(job):
+    '''Returns (flow, head, report) of CompiledNetwork piece once solved.'''
+    piece, engine, callback = job
+    report = piece.solve(engine, callback)
+    return piece.flow, piece.head, report
@@ -16,67 +16,179 @@
 # with Pipey.  If not, see <http://www.gnu.org/licenses/>.
 
 from . import element_classes
+from . import fluids
+from . import instrument
+from . import registry
 from . import utils
 from . import ureg # pint.UnitRegistry shared with rest of package
-from scipy import optimize
+
+# scipy and compiled (which needs scipy) are imported where they are used,
+# so that importing pipey stays cheap for short-lived processes.
+
+# Element lines parse builds together, so that elements of one class
+# share their table lookups (see registry.build_many)
+ELEMENT_BATCH = 4096
+# Errors building an object from a line that parse reports as
+# utils.FormattingError
+PARSE_ERRORS = (ValueError, KeyError, TypeError, AttributeError, IndexError)
+
+# Relative step of the finite differences in coloured_jacobian, on
+# values in gpm and feet
+FD_STEP = 1e-7
+
+def _magnitude(value, units):
+    '''Returns magnitude of value in units.
+
+    Plain numbers are assumed to already be in units and are returned
+    unchanged, so that solver internals stay free of pint objects.
+    '''
+    if isinstance(value, ureg.Quantity):
+        return value.to(units).magnitude
+    return value
 
 class Network:
     '''The entire network of pipes'''
 
-    def __init__(self):
-        self.segments = dict() #this will hold all PipeSegments in the Network
-        self.nodes = dict() #this will hold all Nodes in the Network
+    def __init__(self, compact = False):
         self.fluid = Fluid()
+        if compact:
+            # Segments and nodes are views over the columns of a
+            # store.NetworkStore rather than objects of their own
+            from . import store
+            self.store = store.NetworkStore(self.fluid)
+            self.segments = self.store.segments
+            self.nodes = self.store.nodes
+        else:
+            self.store = None
+            self.segments = dict() #this will hold all PipeSegments in the Network
+            self.nodes = dict() #this will hold all Nodes in the Network
+        # State kept between solves by resolve
+        self._compiled = None
+        self._changed_nodes = set()
+        self._changed_segments = set()
+        self._structure_changed = False
 
     def load(self, filename):
-        '''Reads in the contents of filename and converts them into a
-        list-like object'''
+        '''Reads in the contents of filename and adds them to the Network.
 
+        The file is streamed: each line is checked by
+        utils.check_formatting and turned into segments, nodes and
+        elements as it is read, so the raw text is never held in memory.
+        '''
         with open(filename, 'r') as f:
-            file_list = [i.strip().split(sep=' ') for i in f]
+            self.parse(utils.check_formatting(utils.read_lines(f)))
 
-        #This script checks that the input is formatted according to the rules.
-        utils.check_formatting(file_list)
+    def load_compiled(self, filename):
+        '''Returns compiled.CompiledNetwork for filename, using its snapshot.
 
-        self.parse(file_list)
+        If a snapshot written by cache.save exists next to filename and
+        was built from the file's current contents, it is memory-mapped
+        and returned without parsing anything (and without adding
+        anything to this Network). Otherwise filename is loaded into this
+        Network, compiled, and the snapshot is (re)written when every
+        element supports it.
+        '''
+        from . import cache
+        snapshot = cache.load(filename)
+        if snapshot is None:
+            self.load(filename)
+            snapshot = self.compile()
+            try:
+                cache.save(snapshot, filename)
+            except ValueError:
+                pass # elements without batch_loss can't be cached
+        return snapshot
 
     def parse(self, input_list):
         '''Populates self.nodes and self.segments from list-like object.
         
-        Given a list-like object generated by the load method, parse attempts
-        to populate self.segments and self.nodes with the parameters specified
-        in the input file. The results of this parsing will be appended to
-        self.segments and self.nodes.
+        Given an iterable of token lists such as the one streamed by the
+        load method, parse attempts to populate self.segments and
+        self.nodes with the parameters specified in the input file. The
+        results of this parsing will be appended to self.segments and
+        self.nodes. Element lines are built ELEMENT_BATCH at a time by
+        registry.build_many, so that their table lookups are shared.
+        Errors building an object are re-raised as
+        utils.FormattingError with the offending line number.
         '''
+        current_focus = None
+        started = instrument.start()
+        # Element lines waiting to be built, as (segment, line number,
+        # tokens)
+        pending = list()
         # Iterate through entire list to make sure all file contents added to
         # object.
-        for line_args in input_list:
-            # Since the input was already validated, we don't need to worry
-            # about invalid input here.
-            if not line_args[0]: # Checks for empty line in input current_focus
-                = None elif line_args[0] == 'segment': current_focus =
-                self.add_seg(line_args) elif line_args[0] == 'node':
-                    current_focus = self.add_node(line_args) elif line_args[0]
-                    == 'fluid': current_focus = self.fluid else:
-                # Can't have the add_details method on focus method because
-                # adding start and end nodes to PipeSegments requires
-                # referencing Network.nodes
-                self.add_details(current_focus, line_args)
+        for line_number, line_args in enumerate(input_list, 1):
+            # Input from load has already been validated line by line;
+            # anything check_formatting can't know about (such as unknown
+            # elements or units) is reported with its line number below.
+            try:
+                if not line_args[0]: # Checks for empty line in input
+                    current_focus = None
+                elif line_args[0] == 'segment':
+                    current_focus = self.add_seg(line_args)
+                elif line_args[0] == 'node':
+                    current_focus = self.add_node(line_args)
+                elif line_args[0] == 'fluid':
+                    current_focus = self.fluid
+                elif (isinstance(current_focus, PipeSegment)
+                      and line_args[0][0].isupper()):
+                    pending.append((current_focus, line_number, line_args))
+                    if len(pending) >= ELEMENT_BATCH:
+                        self._add_elements(pending)
+                        pending = list()
+                else:
+                    # Can't have the add_details method on focus method because
+                    # adding start and end nodes to PipeSegments requires
+                    # referencing Network.nodes
+                    self.add_details(current_focus, line_args)
+            except PARSE_ERRORS as err:
+                if isinstance(err, utils.FormattingError):
+                    raise
+                raise utils.FormattingError(line_number, err) from err
+        self._add_elements(pending)
+        instrument.stop('parse', started)
+
+    def _add_elements(self, pending):
+        '''Builds the (segment, line number, tokens) of pending together.
+
+        If building them all at once fails, they are built one at a time
+        to find the line to blame in the FormattingError.
+        '''
+        try:
+            elements = registry.build_many([line[2] for line in pending])
+        except PARSE_ERRORS:
+            for segment, line_number, line_args in pending:
+                try:
+                    registry.build(line_args)
+                except PARSE_ERRORS as err:
+                    raise utils.FormattingError(line_number, err) from err
+            raise
+        for (segment, _, _), element in zip(pending, elements):
+            segment.add_element(element)
 
     def add_seg(self, args):
         '''Adds piping segment to Network object.
 
         As specified by arguments contained in args.
-        ''' 
-        self.segments[args[1]]
-        = PipeSegment() return self.segments[args[1]]
+        '''
+        if self.store is not None:
+            return self.store.add_segment(args[1])
+        self.segments[args[1]] = PipeSegment()
+        self.segments[args[1]].fluid = self.fluid
+        return self.segments[args[1]]
 
     def add_node(self, args):
         '''Adds node between pipe intersections.
         
-        As specified by arguments contained in args.
+        As specified by arguments contained in args. If a segment has
+        already referenced the node, the existing Node is reused so that
+        its inputs and outputs are kept.
         '''
-        self.nodes[args[1]] = Node()
+        if self.store is not None:
+            return self.store.add_node(args[1])
+        if args[1] not in self.nodes:
+            self.nodes[args[1]] = Node()
         return self.nodes[args[1]]
 
     def add_details(self, focus, line_args):
@@ -90,39 +202,226 @@ class Network:
             # handled outside of the PipeSegment class
             if line_args[0] == 'start':
                 # Instantiate Node object if not yet created
-                if line_args[1] not in self.nodes:
-                    self.nodes[line_args[1]] = Node()
-                focus.start = self.nodes[line_args[1]]
+                node = self.add_node(line_args)
+                focus.start = node
                 # Must keep node inputs and outputs separate so that the
-                # dimensionality of flow has meaning
-                self.nodes[line_args[1]].outputs.append(focus)
+                # dimensionality of flow has meaning. A compact network
+                # works them out from start and end instead.
+                if self.store is None:
+                    node.outputs.append(focus)
 
             elif line_args[0] == 'end':
                 # Instantiate Node object if not yet created
-                if line_args[1] not in self.nodes:
-                    self.nodes[line_args[1]] = Node()
-                focus.end = self.nodes[line_args[1]]
-                # Must keep node inputs and outputs separate so that the
-                # dimensionality of flow has meaning
-                self.nodes[line_args[1]].inputs.append(focus)
+                node = self.add_node(line_args)
+                focus.end = node
+                if self.store is None:
+                    node.inputs.append(focus)
             else:
                 focus.add_ele(line_args)
 
         else: # Both Nodes and Fluids have add_details method
             focus.add_details(line_args)
 
-    def solve(self):
+    def compile(self):
+        '''Returns a compiled.CompiledNetwork snapshot of this Network.
+
+        The snapshot holds the topology, element parameters and boundary
+        conditions as NumPy arrays in SI units, and evaluates residuals
+        without any pint arithmetic.
+        '''
+        from . import compiled
+        return compiled.CompiledNetwork(self)
+
+    def solve(self, compiled = None, split = False, max_workers = None,
+              reduce = False, engine = None, callback = None):
         '''Changes values of flow and head to make all segments and nodes agree.
         
         Solves flows and heads for network of PipeSegments and Nodes.
-        Method doesn't return anything but sets all PipeSegment.flow
-        values and Node.head values to their correct value.
+        Method sets all PipeSegment.flow values and Node.head values to
+        their correct value and returns an instrument.SolveReport saying
+        how it got there. If the solve fails,
+        instrument.ConvergenceWarning is raised carrying the report.
+
+        callback, if given, is called as callback(report, residual_norm,
+        step_size) after every step of the solver.
+
+        If compiled is True, the Network is first converted with
+        self.compile and the residuals are evaluated on arrays instead
+        of through get_errors. If it is None, as by default, that is
+        done whenever every unknown is a flow or head, which is the case
+        for networks read from files.
+
+        If compiled is False, MINPACK's hybrid method works on
+        get_errors directly. If every element in the network supplies
+        calculate_derivative, the exact Jacobian from get_jacobian is
+        handed to it. Otherwise it is estimated by coloured finite
+        differences (see coloured_jacobian), on a pool of max_workers
+        threads if max_workers is given. Either way hybrd only takes a
+        dense Jacobian, so every step costs time growing as the cube of
+        the unknowns: a 2000 segment network takes minutes this way and
+        about a second compiled.
+
+        If split is True, the compiled network is also cut into
+        independent pieces at reservoirs and between disconnected
+        systems, and the pieces are solved concurrently on a thread pool
+        of max_workers threads (see CompiledNetwork.solve_split).
+
+        If reduce is True, tree branches and series chains are taken out
+        of the compiled network first (see reduction.ReducedNetwork) and
+        only the looped core that is left goes to the root finder.
+
+        engine names a solver from engines.ENGINES, such as 'gga' for
+        the Global Gradient Algorithm, and implies compiled. Compiled,
+        split and reduced solves without one use the engine that
+        engines.default_engine picks, with hybr only as its fallback.
         '''
-        sol = optimize.root(self._attempt_solution, [0]*len(self.unknowns), method = 'hybr')
-        if sol.success:
+        if engine is not None:
+            compiled = True
+        elif compiled is None:
+            if not hasattr(self, 'unknowns'):
+                self._find_unknowns()
+            compiled = self._plain_unknowns()
+        if reduce:
+            from . import reduction
+            return reduction.ReducedNetwork(self.compile()).solve(
+                split, max_workers, engine, callback)
+        if split:
+            return self.compile().solve_split(max_workers, engine = engine,
+                                              callback = callback)
+        if compiled:
+            return self._solve_compiled(engine, callback)
+        from scipy import optimize
+        from . import engines
+        report = instrument.SolveReport('hybr', callback)
+        if not hasattr(self, 'unknowns'):
+            self._find_unknowns()
+        if self._has_derivatives():
+            jac = self._attempt_jacobian
+        elif self._plain_unknowns():
+            jac = lambda new_vals: self.coloured_jacobian(
+                new_vals, max_workers).toarray()
+        else:
+            jac = None
+        sol = optimize.root(engines.watch(self._attempt_solution, report),
+                            self._initial_guess(), jac = jac, method = 'hybr')
+        report.residual_norm = float((sol.fun**2).sum()**0.5)
+        if sol.success or utils.converged(sol.fun):
             self._set_unknowns(sol.x)
+            return report.finish(True, message = sol.message)
+        report.finish(False, message = sol.message)
+        raise instrument.ConvergenceWarning(sol.message, report)
+
+    def _solve_compiled(self, engine = None, callback = None):
+        '''Solves the Network through a compiled.CompiledNetwork.'''
+        return self.compile().solve(engine, callback)
+
+    def _initial_guess(self):
+        '''Returns current values of self.unknowns in gpm and feet.
+
+        Unknowns that have a value from an earlier solve start from it;
+        the rest start from zero. If none of them has a value, the
+        start is engines.linear_guess of the compiled Network instead,
+        unless the Network can't be linearized.
+        '''
+        guess = list()
+        for method in self.unknowns:
+            owner = getattr(method, '__self__', None)
+            if isinstance(owner, PipeSegment) and owner.flow is not None:
+                guess.append(_magnitude(owner.flow, ureg.gpm))
+            elif isinstance(owner, Node) and owner.head is not None:
+                guess.append(_magnitude(owner.head, ureg.feet))
+            else:
+                guess.append(0)
+        if not any(guess) and self._plain_unknowns():
+            from . import engines
+            try:
+                network = self.compile()
+                guess = list(engines.linear_guess(network) / network.x_scale)
+            except (ArithmeticError, TypeError, ValueError, Warning):
+                pass
+        return guess
+
+    def _plain_unknowns(self):
+        '''Returns True if every unknown is set_val of a PipeSegment or Node.'''
+        return all(isinstance(getattr(method, '__self__', None),
+                              (PipeSegment, Node))
+                   for method in self.unknowns)
+
+    def resolve(self):
+        '''Solves the Network again after edits, starting from the last solution.
+
+        The compiled.CompiledNetwork from the previous resolve is kept.
+        Nodes and segments changed through set_outflow, set_head and
+        update_element since then are patched into its arrays in place,
+        and the solve starts from the previous flows and heads. Only
+        edits that change which equations or unknowns exist (a head
+        becoming known or unknown, an outflow becoming unknown) make it
+        compile the Network again, and even then the previous solution
+        is used as the starting point. Returns the solve's
+        instrument.SolveReport.
+        '''
+        if self._compiled is None or self._structure_changed:
+            self._compiled = self.compile()
         else:
-            raise Warning
+            for name in self._changed_nodes:
+                self._compiled.update_node(self._compiled.node_index(name))
+            for name in self._changed_segments:
+                self._compiled.update_segment(
+                    self._compiled.segment_index(name))
+        self._changed_nodes.clear()
+        self._changed_segments.clear()
+        self._structure_changed = False
+        return self._compiled.solve()
+
+    def set_outflow(self, node_name, outflow):
+        '''Sets outflow of node_name (None for unknown) for the next resolve.'''
+        node = self.nodes[node_name]
+        if (outflow is None) != (node.outflow is None):
+            self._structure_changed = True
+        node.outflow = outflow
+        self._changed_nodes.add(node_name)
+
+    def set_head(self, node_name, head):
+        '''Fixes head of node_name, or frees it if head is None.
+
+        self.unknowns is updated to match, so this may be used after a
+        solve, unlike assigning Node.head directly.
+        '''
+        if not hasattr(self, 'unknowns'):
+            self._find_unknowns()
+        node = self.nodes[node_name]
+        if head is None and node.set_val not in self.unknowns:
+            self.unknowns.append(node.set_val)
+            self._structure_changed = True
+        elif head is not None and node.set_val in self.unknowns:
+            self.unknowns.remove(node.set_val)
+            self._structure_changed = True
+        node.head = head
+        self._changed_nodes.add(node_name)
+
+    def update_element(self, segment_name, index, **attributes):
+        '''Sets attributes of element index of segment_name in place.
+
+        For example update_element('1', 0, diameter = 3 * ureg.inch).
+        '''
+        segment = self.segments[segment_name]
+        element = segment.elements[index]
+        for name, value in attributes.items():
+            setattr(element, name, value)
+        segment.set_element(index, element)
+        self._changed_segments.add(segment_name)
+
+    def set_temperature(self, temperature):
+        '''Sets operating temperature of the fluid for the next resolve.
+
+        The fluid's density and viscosity are looked up in its table
+        (water's if it was never given a type) and patched into the
+        compiled network kept by resolve, so sweeping temperatures
+        doesn't compile the Network again.
+        '''
+        self.fluid.set_temperature(temperature)
+        if self._compiled is not None:
+            self._compiled.set_fluid(self.fluid)
 
     def _find_unknowns(self):
         '''Stores associated methods for nodes and head with unset head and flow.
@@ -133,7 +432,8 @@ class Network:
         
         This method should only be called once for a given Network
         object. If called a second time, self.unknowns will be set to
-        an empty list and Network will be unable to be solved.
+        an empty list and Network will be unable to be solved. After
+        the first solve, use set_head to change which heads are unknown.
         '''
         self.unknowns = list()
 
@@ -160,24 +460,55 @@ class Network:
         Returns a list-like object with all errors in pressure drop equations
         and continuity equations (in that order).
         '''
+        return self._errors(dict())
+
+    def _errors(self, values):
+        '''Returns get_errors with some flows and heads replaced.
+
+        values maps the id of a PipeSegment to a flow in gpm or of a
+        Node to a head in feet, used in place of its own. Nothing is set
+        on the objects, so several calls can run on threads at once.
+        '''
+        instrument.count('residuals')
+        started = instrument.start()
+        gpm = ureg.gallons / ureg.minutes
+
+        def flow(seg):
+            return values[id(seg)] * gpm if id(seg) in values else seg.flow
+
+        def head(node):
+            return (values[id(node)] * ureg.feet if id(node) in values
+                    else node.head)
+
+        def loss(seg):
+            if id(seg) in values:
+                return seg.calculate_loss(flow(seg))
+            return seg.calculate_loss()
+
         # Error for a segment is the difference between the node head
         # difference and its own pressure drop
-        seg_errors = [self.segments[i].end.head 
-                      + self.segments[i].calculate_loss() 
-                      - self.segments[i].start.head 
-                      for i in self.segments]
+        seg_errors = [_magnitude(head(seg.end) + loss(seg) - head(seg.start),
+                                 ureg.feet)
+                      for seg in self.segments.values()]
 
         # Error for a node is the difference between the node's inputs
-        # and outputs (including inflows and outflows)
-        node_errors = [0]*len(self.nodes)
-        for i,n in enumerate(self.nodes):
-            n = self.nodes[n]
-            inputs = sum((pipe.flow for pipe in n.inputs))
-            outputs = sum((pipe.flow for pipe in n.outputs))
-            node_errors[i] = inputs - outputs - n.outflow
-
+        # and outputs (including inflows and outflows). Nodes with an
+        # unknown outflow (such as tanks or reservoirs) balance
+        # themselves and have no continuity equation.
+        node_errors = list()
+        for n in self._continuity_nodes():
+            inputs = sum((flow(pipe) for pipe in n.inputs))
+            outputs = sum((flow(pipe) for pipe in n.outputs))
+            node_errors.append(_magnitude(inputs - outputs - n.outflow,
+                                          ureg.gpm))
+
+        instrument.stop('losses', started)
         return seg_errors + node_errors
 
+    def _continuity_nodes(self):
+        '''Returns list of nodes that have a continuity equation.'''
+        return [n for n in self.nodes.values() if n.outflow is not None]
+
     def _attempt_solution(self, new_vals):
         '''Calls self._set_unknowns and returns get_errors.
         
@@ -187,13 +518,175 @@ class Network:
         self._set_unknowns(new_vals)
         return self.get_errors()
 
+    def _has_derivatives(self):
+        '''Returns True if every element in the network has calculate_derivative.'''
+        return all(hasattr(element, 'calculate_derivative')
+                   for seg in self.segments.values()
+                   for element in seg.elements)
+
+    def get_jacobian(self):
+        '''Returns the Jacobian of get_errors with respect to self.unknowns.
+
+        Rows are in the same order as the output of get_errors and
+        columns are in the same order as self.unknowns. A segment's
+        flow only appears in its own head loss equation and in the
+        continuity equations of its start and end nodes, and a node's
+        head only appears in the equations of segments attached to it,
+        so the matrix is returned in scipy.sparse CSR format.
+        '''
+        from scipy import sparse
+        instrument.count('jacobians')
+        # Each unknown is stored as the set_val method of its owner
+        columns = {id(method.__self__): j
+                   for j, method in enumerate(self.unknowns)}
+        n_segs = len(self.segments)
+        rows, cols, vals = list(), list(), list()
+
+        def add(row, owner, val):
+            if id(owner) in columns:
+                rows.append(row)
+                cols.append(columns[id(owner)])
+                vals.append(val)
+
+        for i, seg in enumerate(self.segments.values()):
+            # Segment rows are in feet of head; unknown flows are in gpm
+            add(i, seg, _magnitude(seg.calculate_derivative(),
+                                   ureg.feet / ureg.gpm))
+            add(i, seg.end, 1.0)
+            add(i, seg.start, -1.0)
+
+        continuity_nodes = self._continuity_nodes()
+        for i, node in enumerate(continuity_nodes, n_segs):
+            for pipe in node.inputs:
+                add(i, pipe, 1.0)
+            for pipe in node.outputs:
+                add(i, pipe, -1.0)
+
+        return sparse.coo_matrix((vals, (rows, cols)),
+                                 shape = (n_segs + len(continuity_nodes),
+                                          len(self.unknowns))).tocsr()
+
+    def _colouring(self):
+        '''Returns (colour of each unknown, Jacobian sparsity pattern).
+
+        Two unknowns get different colours if they appear in a common
+        equation, so all the unknowns of one colour can be perturbed
+        together (Curtis-Powell-Reid). The pattern comes from the
+        topology alone: a segment's flow appears in its own equation and
+        the continuity equations of its ends, a node's head in the
+        equations of its segments. Colours are assigned greedily and
+        kept until the unknowns or continuity equations change.
+        '''
+        import numpy as np
+        from scipy import sparse
+        continuity_nodes = self._continuity_nodes()
+        key = (tuple(id(method.__self__) for method in self.unknowns),
+               tuple(id(node) for node in continuity_nodes),
+               len(self.segments))
+        cached = getattr(self, '_coloured', None)
+        if cached is not None and cached[0] == key:
+            return cached[1:]
+
+        columns = {owner: j for j, owner in enumerate(key[0])}
+        n_segs = len(self.segments)
+        rows, cols = list(), list()
+        for i, seg in enumerate(self.segments.values()):
+            for owner in (seg, seg.end, seg.start):
+                if id(owner) in columns:
+                    rows.append(i)
+                    cols.append(columns[id(owner)])
+        for i, node in enumerate(continuity_nodes, n_segs):
+            for pipe in node.inputs + node.outputs:
+                if id(pipe) in columns:
+                    rows.append(i)
+                    cols.append(columns[id(pipe)])
+        pattern = sparse.csc_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape = (n_segs + len(continuity_nodes), len(self.unknowns)))
+        by_row = pattern.tocsr()
+
+        colours = np.full(len(self.unknowns), -1, dtype=np.intp)
+        for j in range(len(colours)):
+            neighbours = set()
+            for i in pattern.indices[pattern.indptr[j]:pattern.indptr[j + 1]]:
+                neighbours.update(colours[
+                    by_row.indices[by_row.indptr[i]:by_row.indptr[i + 1]]])
+            colour = 0
+            while colour in neighbours:
+                colour += 1
+            colours[j] = colour
+        self._coloured = (key, colours, pattern)
+        return colours, pattern
+
+    def coloured_jacobian(self, new_vals, max_workers = None):
+        '''Returns Jacobian of get_errors at new_vals by finite differences.
+
+        The unknowns are set to new_vals. Instead of one evaluation of
+        get_errors per unknown, every group of unknowns from _colouring
+        is perturbed at once, so the whole Jacobian costs one
+        evaluation per colour (a handful, however large the Network).
+        If max_workers is given, the colours are evaluated on a pool of
+        that many threads. Returns a CSR matrix like get_jacobian.
+        '''
+        import numpy as np
+        from scipy import sparse
+        instrument.count('jacobians')
+        colours, pattern = self._colouring()
+        x = np.asarray(new_vals, dtype=float)
+        self._set_unknowns(x)
+        base = np.array(self._errors(dict()))
+        owners = [id(method.__self__) for method in self.unknowns]
+        step = FD_STEP * np.maximum(np.abs(x), 1)
+
+        def differences(colour):
+            group = np.flatnonzero(colours == colour)
+            values = {owners[j]: x[j] + step[j] for j in group}
+            return np.array(self._errors(values)) - base
+
+        n_colours = int(colours.max()) + 1 if len(colours) else 0
+        if max_workers is None:
+            diffs = list(map(differences, range(n_colours)))
+        else:
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers = max_workers) as executor:
+                diffs = list(executor.map(differences, range(n_colours)))
+
+        coo = pattern.tocoo()
+        diffs = np.array(diffs).reshape(n_colours, pattern.shape[0])
+        values = diffs[colours[coo.col], coo.row] / step[coo.col]
+        return sparse.coo_matrix((values, (coo.row, coo.col)),
+                                 shape = pattern.shape).tocsr()
+
+    def _attempt_jacobian(self, new_vals):
+        '''Calls self._set_unknowns and returns get_jacobian as a dense array.
+
+        MINPACK's hybrd only accepts dense Jacobians, so the sparse
+        matrix is expanded here at the boundary.
+        '''
+        self._set_unknowns(new_vals)
+        return self.get_jacobian().toarray()
+
 class PipeSegment:
-    '''A piping segment running between nodes.'''
+    '''A piping segment running between nodes.
+
+    Elements with a loss_coefficient (see element_classes.Element) are
+    folded into a single coefficient the first time the segment's loss
+    is needed, and only the other elements are evaluated one by one.
+    The folded coefficient is worked out again whenever elements are
+    added, replaced through set_element or the list is swapped for
+    another, but not when an element's attributes are changed directly;
+    use Network.update_element for that.
+    '''
+    __slots__ = ('elements', 'start', 'end', 'flow', 'fluid', '_folded')
+
     def __init__(self):
         self.elements = list() #holds all elements of the segment
         self.start = None
         self.end = None
         self.flow = None
+        self.fluid = None # set by Network.add_seg
+        self._folded = None
 
     # This method exists so that PipeSegment and Node can be treated the
     # same way by Network._find_unknowns and Network._set_unknowns
@@ -206,18 +699,68 @@ class PipeSegment:
 
         General method for instantiating element objects in the segment.
         `attributes` is a list-like object containing [0] the name of the
-        element and [1+] parameters for the given element.
+        element, looked up in the registry, and [1+] parameters for the
+        given element.
         '''
-        self.elements.append(getattr(element_classes, attributes[0])(attributes[1:]))
-
-    def calculate_loss(self):
-        '''Calculates the head loss across the segment for a given flowrate.'''
-        return sum([element.calculate_loss(self.flow) 
-                    for element in self.elements])
+        self.add_element(registry.build(attributes))
+
+    def add_element(self, element):
+        '''Adds element that has already been built.'''
+        element.fluid = self.fluid
+        self.elements.append(element)
+
+    def set_element(self, index, element):
+        '''Replaces element index of the segment with element.'''
+        self.elements[index] = element
+        self._folded = None
+
+    def _fold(self):
+        '''Returns (folded loss coefficient or None, other elements).'''
+        elements = self.elements
+        folded = getattr(self, '_folded', None)
+        # Keeping the list itself, not its id, means a new list can never
+        # be mistaken for the one that was folded
+        if (folded is None or folded[0] is not elements
+                or folded[1] != len(elements)):
+            folded = self._folded = ((elements, len(elements))
+                                     + _fold_elements(elements))
+        return folded[2:]
+
+    def calculate_loss(self, flow = None):
+        '''Calculates the head loss across the segment at flow (self.flow).'''
+        if flow is None:
+            flow = self.flow
+        coefficient, others = self._fold()
+        loss = sum([element.calculate_loss(flow) for element in others])
+        if coefficient is not None:
+            loss = loss + element_classes.quadratic_loss(coefficient, flow)
+        return loss
+
+    def calculate_derivative(self, flow = None):
+        '''Calculates d(head loss)/d(flow) across the segment at flow.'''
+        if flow is None:
+            flow = self.flow
+        coefficient, others = self._fold()
+        deriv = sum([element.calculate_derivative(flow)
+                     for element in others])
+        if coefficient is not None:
+            deriv = deriv + element_classes.quadratic_derivative(
+                coefficient, flow)
+        return deriv
+
+def _fold_elements(elements):
+    '''Returns (summed loss_coefficient or None, other elements) of elements.'''
+    constant = [e for e in elements if hasattr(e, 'loss_coefficient')]
+    others = [e for e in elements if not hasattr(e, 'loss_coefficient')]
+    if not constant:
+        return None, others
+    return sum(e.loss_coefficient() for e in constant), others
 
 
 class Node:
     '''The point at which PipeSegments connect.'''
+    __slots__ = ('inputs', 'outputs', 'head', 'outflow')
+
     def __init__(self):
         self.inputs = list() #holds all segments that flow into Node
         self.outputs = list() #holds all segments that flow out of Node
@@ -233,24 +776,89 @@ class Node:
     def add_details(self, attributes):
         '''General method for adding attributes of the node'''
         if attributes[0] == 'head':
-            self.head = float(attributes[1]) * ureg.parse_expression(attributes[2])
+            self.head = float(attributes[1]) * utils.parse_units(attributes[2])
         elif attributes[0] == 'outflow':
-            self.outflow = float(attributes[1]) * ureg.parse_expression(attributes[2])
+            self.outflow = float(attributes[1]) * utils.parse_units(attributes[2])
         elif attributes[0] == 'inflow':
-            self.outflow = -float(attributes[1]) * ureg.parse_expression(attributes[2])
+            self.outflow = -float(attributes[1]) * utils.parse_units(attributes[2])
+        elif attributes[0] == 'unknown' and attributes[1] == 'outflow':
+            self.outflow = None
 
 class Fluid:
     '''Class to hold details about the fluid in the pipe network.
     
     Fluid class contains the properties of the fluid such as density and
     viscosity. The fluid may return different properties given different base
-    states.
+    states: once given a type, density and viscosity are those of its
+    fluids.FluidTable at temperature.
     '''
+    __slots__ = ('density', 'viscosity', 'table', 'temperature')
+
     def __init__(self):
-        self.density = None
-        self.viscosity = None
+        # Water at 60 degF until told otherwise
+        self.density = 999.0 * ureg.kg / ureg.m**3
+        self.viscosity = 1.12 * ureg.centipoise
+        self.table = None
+        self.temperature = None
 
     def add_details(self, args):
-        '''Setter class for fluid details.'''
-        pass
+        '''Sets a property of the fluid from a line of the fluid block.
+
+        "type" names one of fluids.FLUIDS or a CSV file of properties,
+        "temperature" sets the operating temperature, and "density" and
+        "viscosity" set those properties directly until the next type or
+        temperature line.
+        '''
+        if args[0] == 'type':
+            self.set_type(args[1])
+        elif args[0] == 'temperature':
+            self.set_temperature(ureg.Quantity(float(args[1]),
+                                               utils.parse_units(args[2])))
+        elif args[0] in ('density', 'viscosity'):
+            setattr(self, args[0],
+                    float(args[1]) * utils.parse_units(args[2]))
+        else:
+            raise ValueError('unknown fluid property "{}"'.format(args[0]))
+
+    def set_type(self, name):
+        '''Takes properties from the table for name from now on.
+
+        The temperature stays as it was, or is 60 degF if it was never
+        set. Raises KeyError if there is no such table.
+        '''
+        self.table = fluids.get_table(name)
+        if self.temperature is None:
+            self.temperature = ureg.Quantity(60.0, ureg.degF)
+        self._update()
+
+    def set_temperature(self, temperature):
+        '''Sets operating temperature, a pint Quantity, of the fluid.
+
+        A fluid that was never given a type is taken to be water.
+        '''
+        if self.table is None:
+            self.table = fluids.get_table('water')
+        self.temperature = temperature
+        self._update()
+
+    def properties(self, temperature):
+        '''Returns (density, viscosity) SI arrays of the fluid at temperature.
+
+        temperature is a pint Quantity holding one value or an array of
+        them, for example one per segment or scenario, which is looked
+        up in the table all at once.
+        '''
+        import numpy as np
+        if self.table is None:
+            density, viscosity = np.broadcast_arrays(
+                self.density.to('kg/m**3').m,
+                self.viscosity.to('Pa*s').m,
+                np.asarray(temperature.magnitude))[:2]
+            return density.astype(float), viscosity.astype(float)
+        return self.table.properties(temperature.to('K').m)
+
+    def _update(self):
+        density, viscosity = self.properties(self.temperature)
+        self.density = float(density) * ureg.kg / ureg.m**3
+        self.viscosity = float(viscosity) * ureg.pascal * ureg.second
 
@@ -15,15 +15,110 @@
 # You should have received a copy of the GNU General Public License along
 # with Pipey.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
+import abc
+import functools
 import math
+import numpy as np
+from . import fittings
+from . import pipe_sizes
+from . import utils
 from . import ureg
 
+# Standard gravity in m/s**2
+GRAVITY = 9.80665
+
+# Elements that can be named in input files (see registry)
+ELEMENTS = ('Null_Element', 'Pipe', 'Fitting', 'Elbow', 'Tee', 'Valve',
+            'Entrance', 'Exit', 'Reducer')
+
+@functools.lru_cache()
+def default_roughness():
+    '''Returns roughness of commercial steel, one Quantity shared by all Pipes.'''
+    return 0.00015 * ureg.feet
+
+def parse_options(attributes):
+    '''Returns dict mapping each "-x" tag in attributes to the tokens after it.
+
+    For example ['-s', '40', '-d', '2', 'in'] gives
+    {'-s': ['40'], '-d': ['2', 'in']}.
+    '''
+    options = dict()
+    tokens = None
+    for token in attributes:
+        if len(token) > 1 and token[0] == '-' and token[1].isalpha():
+            tokens = options[token] = list()
+        elif tokens is not None:
+            tokens.append(token)
+    return options
+
+def parse_quantity(tokens):
+    '''Returns pint Quantity from a [value, units] pair of tokens.'''
+    return float(tokens[0]) * utils.parse_units(tokens[1])
+
+def parse_diameter(options):
+    '''Returns inner diameter from the "-D", or "-d" and "-s", options.
+
+    "-d" is a nominal diameter looked up in pipe_sizes for schedule "-s"
+    (40 if not given).
+    '''
+    return float(parse_diameters([options])[0]) * ureg.inch
+
+def parse_diameters(options):
+    '''Returns array of inner diameters in inches, as parse_diameter.
+
+    options is a list of parsed tags. Every nominal diameter in it is
+    looked up with one call to pipe_sizes.inner_diameters. Raises
+    KeyError for a size that isn't made in its schedule.
+    '''
+    inch = utils.parse_units('inch')
+    inner = np.empty(len(options))
+    nominal, schedules, rows = list(), list(), list()
+    for i, tags in enumerate(options):
+        if '-D' in tags:
+            inner[i] = parse_quantity(tags['-D']).to(inch).m
+        else:
+            rows.append(i)
+            nominal.append(parse_quantity(tags['-d']).to(inch).m)
+            schedules.append(tags['-s'][0] if '-s' in tags else '40')
+    if rows:
+        inner[rows] = pipe_sizes.inner_diameters(nominal, schedules)
+        missing = np.flatnonzero(np.isnan(inner[rows]))
+        if len(missing):
+            raise KeyError('NPS {:g} is not made in schedule {}'.format(
+                nominal[missing[0]], schedules[missing[0]]))
+    return inner
+
+def quadratic_loss(coefficient, flow):
+    '''Returns head loss coefficient * flow * |flow| as a Quantity.
+
+    coefficient is in s**2/m**5, the SI units of head per flow squared.
+    '''
+    q = flow.to('m**3/s').m
+    return coefficient * q * abs(q) * ureg.meter
+
+def quadratic_derivative(coefficient, flow):
+    '''Returns d(quadratic_loss)/d(flow) as a Quantity.'''
+    return (2 * coefficient * abs(flow.to('m**3/s').m)
+            * ureg.meter / (ureg.meter**3 / ureg.second))
+
 class Element:
-    '''General class for pipe elements to inherit from'''
+    '''General class for pipe elements to inherit from
+
+    Subclasses list their attributes in __slots__ (including fluid, set
+    by PipeSegment.add_ele) so that large networks don't carry a
+    __dict__ per element; the class attributes below are defaults.
+
+    An element whose head loss is always a constant times flow * |flow|
+    can say so with a loss_coefficient method returning that constant
+    in s**2/m**5. PipeSegment and compiled.CompiledNetwork then fold
+    all such elements of a segment into one Resistance instead of
+    evaluating each of them.
+    '''
+    __slots__ = ()
 
     units = 0
     diameter = 1
+    fluid = None # set by PipeSegment.add_ele
 
 class Null_Element(Element):
     '''Special class that puts all input into stuff attribute.
@@ -31,35 +126,372 @@ class Null_Element(Element):
     This class is useful for testing purposes but should not be called
     at any point in the package's actual codebase.
     '''
+    __slots__ = ('fluid', 'stuff')
+
     def __init__(self, attributes):
+        self.fluid = None
         self.stuff = attributes
 
-class Pipe(Element):
-    '''Total of all piping runs in segment'''
+class BatchElement(Element):
+    '''Element evaluated over arrays, by class, in compiled networks
 
-    def __init__(self, attributes):
-        self.length = attributes[0]
-        self.diameter = calculate_diameter(attributes[1:3])
+    Subclasses provide:
+
+    * batch_parameters(), the element as a tuple of numbers in SI units;
+    * classmethod batch_loss(params, flow, density, viscosity), the
+      head loss in m of every row of the 2-D array params at the flows
+      in m**3/s, densities in kg/m**3 and viscosities in Pa*s of the
+      1-D arrays that follow;
+    * optionally classmethod batch_derivative, with the same arguments,
+      giving d(head loss)/d(flow) in s/m**2;
+    * optionally classmethod from_batch_parameters(params), rebuilding
+      an element from one row, so that compact networks can hold it as
+      a row of numbers.
+
+    calculate_loss, and calculate_derivative when there is a
+    batch_derivative, are worked out from these one element at a time.
+    '''
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Without batch_derivative there mustn't be calculate_derivative
+        # either, so that solvers know to difference the losses
+        if (hasattr(cls, 'batch_derivative')
+                and not hasattr(cls, 'calculate_derivative')):
+            cls.calculate_derivative = cls._calculate_derivative
+
+    def _fluid_properties(self):
+        return (np.array([self.fluid.density.to('kg/m**3').m]),
+                np.array([self.fluid.viscosity.to('Pa*s').m]))
 
-    #need to review code to see how information about density and viscosity best passed
-    def calculate_loss(self, flow, density, viscosity):
+    def calculate_loss(self, flow):
         '''calculates the head loss for a given flowrate'''
-        #flow in gpm, diameter in inches output in ft/sec
-        velocity = 60*0.13368*flow/((self.diameter/24)**2*math.pi())
-        #diameter in inches, velocity in ft/sec, density in lb/ft3, viscosity in cP
-        #validate the unit conversions in this formula!
-        reynolds = (self.diameter*velocity*density/viscosity)/12/6.8948/144
-        
+        density, viscosity = self._fluid_properties()
+        loss = self.batch_loss(np.array([self.batch_parameters()]),
+                               np.array([flow.to('m**3/s').m]),
+                               density, viscosity)
+        return float(loss[0]) * ureg.meter
+
+    def _calculate_derivative(self, flow):
+        '''calculates d(head loss)/d(flow) for a given flowrate'''
+        density, viscosity = self._fluid_properties()
+        deriv = self.batch_derivative(np.array([self.batch_parameters()]),
+                                      np.array([flow.to('m**3/s').m]),
+                                      density, viscosity)
+        return float(deriv[0]) * ureg.meter / (ureg.meter**3 / ureg.second)
+
+class SizedElement(BatchElement):
+    '''BatchElement whose dimensions are looked up in tables
+
+    Subclasses provide classmethod _resolve(options), returning arrays
+    of the looked-up values (such as inner diameters) for a list of
+    parsed tags, and _set(options, *values), which fills in one element
+    from its tags and its share of those values. build_many then builds
+    many elements with one lookup per table instead of one per element.
+    '''
+    __slots__ = ()
+
+    def __init__(self, attributes):
+        options = parse_options(attributes)
+        resolved = self._resolve([options])
+        self._set(options, *(float(values[0]) for values in resolved))
+
+    @classmethod
+    def build_many(cls, attribute_lists):
+        '''Returns an element for each list of tags, in the same order.'''
+        options = [parse_options(attributes) for attributes in attribute_lists]
+        resolved = [values.tolist() for values in cls._resolve(options)]
+        elements = list()
+        for i, tags in enumerate(options):
+            element = cls.__new__(cls)
+            element._set(tags, *(values[i] for values in resolved))
+            elements.append(element)
+        return elements
+
+class Pipe(SizedElement):
+    '''Total of all piping runs in segment
+
+    Built from the tags described in the README: "-l" length, "-s"
+    schedule (40 if not given), and either "-d" nominal diameter, which
+    is looked up in pipe_sizes, or "-D" inner diameter.
+    '''
+    __slots__ = ('fluid', 'roughness', 'length', 'diameter', 'schedule')
+
+    @classmethod
+    def _resolve(cls, options):
+        return (parse_diameters(options),)
+
+    def _set(self, options, diameter):
+        self.fluid = None
+        self.roughness = default_roughness()
+        self.length = parse_quantity(options['-l'])
+        self.schedule = options['-s'][0] if '-s' in options else '40'
+        self.diameter = diameter * utils.parse_units('inch')
+
+    def batch_parameters(self):
+        '''Returns (length, inner diameter, roughness) in meters.'''
+        return (self.length.to(ureg.meter).m,
+                self.diameter.to(ureg.meter).m,
+                self.roughness.to(ureg.meter).m)
+
+    @classmethod
+    def from_batch_parameters(cls, params):
+        '''Returns Pipe with the (length, diameter, roughness) of params in m.
+
+        schedule isn't part of the parameters and is left as None.
+        '''
+        pipe = cls.__new__(cls)
+        pipe.fluid = pipe.schedule = None
+        pipe.length, pipe.diameter, pipe.roughness = (
+            value * ureg.meter for value in params)
+        return pipe
+
+    @classmethod
+    def batch_loss(cls, params, flow, density, viscosity):
+        '''Returns Darcy-Weisbach head loss in m for arrays in SI units.'''
+        length, diameter, roughness = params.T
+        area = math.pi * diameter**2 / 4
+        velocity = flow / area
+        reynolds = density * velocity * diameter / viscosity
+        f = utils.darcy_friction_factors(roughness / diameter, reynolds)
+        loss = f * length / diameter * velocity * np.abs(velocity) / (2 * GRAVITY)
+        # Laminar loss is linear in velocity; write it that way so it is
+        # exact down to zero flow
+        laminar = np.abs(reynolds) < utils.LAMINAR_LIMIT
+        return np.where(laminar, cls._laminar_resistance(
+            length, diameter, density, viscosity) * flow, loss)
+
+    @classmethod
+    def batch_derivative(cls, params, flow, density, viscosity):
+        '''Returns d(head loss)/d(flow) in s/m**2 for arrays in SI units.'''
+        length, diameter, roughness = params.T
+        area = math.pi * diameter**2 / 4
+        velocity = flow / area
+        reynolds = density * velocity * diameter / viscosity
+        f, df = utils.darcy_friction_factors(roughness / diameter, reynolds,
+                                             derivative = True)
+        # d|reynolds|/d(flow) times velocity * |velocity| is always positive
+        dre = density * diameter / (viscosity * area)
+        deriv = length / (2 * GRAVITY * diameter) * (
+            2 * f * np.abs(velocity) / area + df * dre * velocity**2)
+        laminar = np.abs(reynolds) < utils.LAMINAR_LIMIT
+        return np.where(laminar, cls._laminar_resistance(
+            length, diameter, density, viscosity), deriv)
+
+    @staticmethod
+    def _laminar_resistance(length, diameter, density, viscosity):
+        '''Returns Hagen-Poiseuille head loss per unit flow in s/m**2.'''
+        area = math.pi * diameter**2 / 4
+        return 32 * viscosity * length / (density * GRAVITY * diameter**2 * area)
+
     def calculate_diameter(self, sched, nom_diam):
         '''Calculates internal diameter of pipe for a given nominal diameter'''
+        return pipe_sizes.inner_diameter(nom_diam.to(ureg.inch).m,
+                                         sched) * ureg.inch
+
+class Fitting(SizedElement):
+    '''Fittings with a constant resistance coefficient K
+
+    Built from the tags "-K" resistance coefficient, "-q" number of
+    identical fittings (1 if not given), and either "-d" nominal
+    diameter with "-s" schedule (40 if not given) or "-D" inner
+    diameter. Head loss is q K v**2 / 2g at the velocity through the
+    inner diameter.
+    '''
+    __slots__ = ('fluid', 'k_factor', 'quantity', 'diameter')
+
+    @classmethod
+    def _resolve(cls, options):
+        '''Returns arrays of (K of one fitting, inner diameter in inches).'''
+        return (np.array([float(tags['-K'][0]) for tags in options]),
+                parse_diameters(options))
+
+    def _set(self, options, k_factor, diameter):
+        self.fluid = None
+        self.k_factor = k_factor
+        self.quantity = int(options['-q'][0]) if '-q' in options else 1
+        self.diameter = diameter * utils.parse_units('inch')
+
+    def loss_coefficient(self):
+        '''Returns head loss / (flow * |flow|) in s**2/m**5.'''
+        return float(self.batch_coefficients(
+            np.array([self.batch_parameters()]))[0])
+
+    def batch_parameters(self):
+        '''Returns (K, quantity, inner diameter in m).'''
+        return (self.k_factor, self.quantity, self.diameter.to(ureg.meter).m)
+
+    @classmethod
+    def from_batch_parameters(cls, params):
+        '''Returns Fitting with the (K, quantity, diameter in m) of params.'''
+        fitting = cls.__new__(cls)
+        fitting.fluid = None
+        fitting.k_factor = float(params[0])
+        fitting.quantity = int(params[1])
+        fitting.diameter = params[2] * ureg.meter
+        return fitting
+
+    @staticmethod
+    def batch_coefficients(params):
+        '''Returns loss_coefficient for each row of params.'''
+        k_factor, quantity, diameter = params.T
+        return 8 * quantity * k_factor / (GRAVITY * math.pi**2 * diameter**4)
+
+    @classmethod
+    def batch_loss(cls, params, flow, density, viscosity):
+        '''Returns head loss in m for arrays in SI units.'''
+        return cls.batch_coefficients(params) * flow * np.abs(flow)
+
+    @classmethod
+    def batch_derivative(cls, params, flow, density, viscosity):
+        '''Returns d(head loss)/d(flow) in s/m**2 for arrays in SI units.'''
+        return 2 * cls.batch_coefficients(params) * np.abs(flow)
+
+    def calculate_loss(self, flow):
+        '''calculates the head loss for a given flowrate'''
+        return quadratic_loss(self.loss_coefficient(), flow)
+
+    def calculate_derivative(self, flow):
+        '''calculates d(head loss)/d(flow) for a given flowrate'''
+        return quadratic_derivative(self.loss_coefficient(), flow)
+
+class _TableFitting(Fitting, metaclass = abc.ABCMeta):
+    '''Fittings whose K is looked up in the fittings table
+
+    "-d" nominal diameter picks the row of the table, so it is needed
+    even when "-D" gives the inner diameter. Subclasses name the column
+    with _kind.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def _resolve(cls, options):
+        inch = utils.parse_units('inch')
+        nominal = [parse_quantity(tags['-d']).to(inch).m for tags in options]
+        return (fittings.k_factors([cls._kind(tags) for tags in options],
+                                   nominal),
+                parse_diameters(options))
+
+    @staticmethod
+    @abc.abstractmethod
+    def _kind(options):
+        '''Returns the fittings table column for parsed options.'''
+
+class Elbow(_TableFitting):
+    '''Pipe elbows
+
+    Built from the Fitting tags other than "-K", plus "-a" angle (90 if
+    not given, 45 or 180) and "-r" radius of a 90 degree elbow
+    ("standard" if not given, or "long").
+    '''
+    __slots__ = ()
+
+    @staticmethod
+    def _kind(options):
+        angle = options['-a'][0] if '-a' in options else '90'
+        if angle == '90' and '-r' in options and options['-r'][0] == 'long':
+            return 'elbow_90_long'
+        return 'elbow_' + angle
+
+class Tee(_TableFitting):
+    '''Tees
+
+    Built from the Fitting tags other than "-K", plus "-f" the path of
+    the flow through the tee ("run" if not given, or "branch").
+    '''
+    __slots__ = ()
+
+    @staticmethod
+    def _kind(options):
+        return 'tee_' + (options['-f'][0] if '-f' in options else 'run')
+
+class Valve(_TableFitting):
+    '''Fully open valves
+
+    Built from the Fitting tags other than "-K", plus "-t" type of
+    valve: gate, globe, angle, ball, plug, butterfly, swing_check or
+    lift_check.
+    '''
+    __slots__ = ()
+
+    @staticmethod
+    def _kind(options):
+        return options['-t'][0] + '_valve'
+
+class Entrance(_TableFitting):
+    '''Pipe entrances from a tank or reservoir
+
+    Built from the Fitting tags other than "-K", plus "-t" shape of the
+    entrance ("sharp" if not given, "projecting" or "rounded").
+    '''
+    __slots__ = ()
+
+    @staticmethod
+    def _kind(options):
+        return 'entrance_' + (options['-t'][0] if '-t' in options
+                              else 'sharp')
+
+class Exit(_TableFitting):
+    '''Pipe exits into a tank or reservoir, losing the velocity head'''
+    __slots__ = ()
+
+    @staticmethod
+    def _kind(options):
+        return 'exit'
+
+class Reducer(Fitting):
+    '''Concentric reducers and expanders
+
+    Built from the tags "-d" inlet and "-o" outlet nominal diameters,
+    "-s" schedule (40 if not given), "-a" included angle of the taper
+    in degrees (180, a sudden change, if not given) and "-q". K and
+    diameter are those of the smaller end. The loss is worked out for
+    flow from inlet to outlet and used for both directions.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def _resolve(cls, options):
+        ends = [parse_diameters([{'-d': tags[tag],
+                                  '-s': tags.get('-s', ['40'])}
+                                 for tags in options])
+                for tag in ('-d', '-o')]
+        angle = [float(tags['-a'][0]) if '-a' in tags else 180
+                 for tags in options]
+        return (fittings.reducer_k_factors(ends[0], ends[1], angle),
+                np.minimum(ends[0], ends[1]))
+
+class Resistance(BatchElement):
+    '''Elements with a loss_coefficient, folded into one
+
+    parts is a list of elements that all provide loss_coefficient; the
+    Resistance's coefficient is their sum, worked out again each time
+    it is asked for. It isn't meant to be used in input files.
+    '''
+    __slots__ = ('fluid', 'parts')
+
+    def __init__(self, parts):
+        self.fluid = None
+        self.parts = list(parts)
+
+    def loss_coefficient(self):
+        '''Returns sum of the loss_coefficient of every part.'''
+        return sum(part.loss_coefficient() for part in self.parts)
+
+    def batch_parameters(self):
+        return (self.loss_coefficient(),)
+
+    @classmethod
+    def batch_loss(cls, params, flow, density, viscosity):
+        return params[:, 0] * flow * np.abs(flow)
+
+    @classmethod
+    def batch_derivative(cls, params, flow, density, viscosity):
+        return 2 * params[:, 0] * np.abs(flow)
 
-        sizes = dict()
-        with open(os.path.join(os.path.abspath(__file__), 'data/pipe_size.csv'), 'r') as f:
-            csv_reader = csv.reader(f)
-            for line in csv_reader:
-                if csv_reader.line_num == 1: #first line is just the labels
-                    index = [str(i) for i in line] #make sure index has correct type
-                else: #Each column is wall thickness at a specific schedule
-                    sizes[line[0]] = dict(zip(index[1:], line[1:]))
+    def calculate_loss(self, flow):
+        return quadratic_loss(self.loss_coefficient(), flow)
 
-        return float(sizes[nom_diam][sched])
+    def calculate_derivative(self, flow):
+        return quadratic_derivative(self.loss_coefficient(), flow)
@@ -0,0 +1,560 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Solver engines for a compiled.CompiledNetwork.
+
+An engine is a function taking a CompiledNetwork and an optional
+instrument.SolveReport and returning the solved unknowns as an SI array
+ordered like initial_guess. It starts from the network's current values,
+records each step it takes with report.step and raises Warning if it
+doesn't converge. Engines are looked up by name in ENGINES, so new ones
+can be added there.
+'''
+
+import numpy as np
+from scipy import sparse
+from . import instrument
+from . import utils
+
+MAX_ITERATIONS = 100
+# Halvings of a Newton step tried before taking it anyway
+MAX_BACKTRACKS = 8
+# Linear solves of linear_guess, each with resistances from the last
+LINEAR_PASSES = 3
+# Fractions of the demands solve steps through when all else fails
+CONTINUATION_STEPS = 4
+
+def watch(residuals, report):
+    '''Returns residuals wrapped to record every evaluation in report.
+
+    MINPACK doesn't expose its iterations, so for hybr each function
+    evaluation counts as a step, its size being the distance from the
+    previous evaluation point.
+    '''
+    previous = list()
+    def watched(z):
+        errors = residuals(z)
+        step = np.linalg.norm(z - previous.pop()) if previous else 0.
+        previous.append(np.array(z))
+        report.step(float(np.linalg.norm(errors)), float(step))
+        return errors
+    return watched
+
+def hybr(network, report = None):
+    '''Solves network with MINPACK's hybrid method through optimize.root.
+
+    The system is handed over in scaled variables (gpm and feet) with
+    the dense form of the sparse Jacobian. Loss slopes of elements
+    without a derivative are taken by differences all at once, rather
+    than leaving MINPACK to difference every unknown in turn.
+    '''
+    from scipy import optimize
+    if report is None:
+        report = instrument.SolveReport('hybr')
+    sol = optimize.root(watch(network.scaled_residuals, report),
+                        network.initial_guess() / network.x_scale,
+                        jac = lambda z: network.scaled_jacobian(z).toarray(),
+                        method = 'hybr')
+    report.residual_norm = float(np.linalg.norm(sol.fun))
+    if sol.success or utils.converged(sol.fun):
+        return sol.x * network.x_scale
+    raise Warning(sol.message)
+
+class PatternSolver:
+    '''Solves sparse systems whose matrices all share one sparsity pattern.
+
+    SuperLU picks a fill-reducing ordering with permc_spec the first
+    time. The ordering only depends on the pattern, so it is kept and
+    later matrices are permuted with it and factorized with
+    permc_spec NATURAL, skipping the ordering step. If symmetric is
+    True the pattern is treated as symmetric and rows are permuted the
+    same way as columns. An order known in advance can be given instead
+    of letting SuperLU choose one.
+
+    Only the ordering is reused. SuperLU can't keep a symbolic
+    factorization, so every matrix is still analysed and factorized
+    from scratch; on a 10^4 unknown grid the ordering is roughly a
+    tenth of the cost of a factorization. The instrument counters
+    'orderings' and 'factorizations' show how often each happens.
+    '''
+    def __init__(self, permc_spec = 'COLAMD', symmetric = False,
+                 order = None):
+        self.permc_spec = permc_spec
+        self.options = dict(SymmetricMode = True) if symmetric else dict()
+        self.symmetric = symmetric
+        self.order = order
+
+    def solve(self, matrix, rhs):
+        '''Returns x solving matrix @ x = rhs; Warning if matrix is singular.'''
+        from scipy.sparse import linalg
+        started = instrument.start()
+        try:
+            instrument.count('factorizations')
+            if self.order is None:
+                instrument.count('orderings')
+                lu = linalg.splu(matrix, permc_spec = self.permc_spec,
+                                 options = self.options)
+                self.order = np.argsort(lu.perm_c)
+                return lu.solve(rhs)
+            order = self.order
+            if self.symmetric:
+                matrix, rhs = matrix[order], rhs[order]
+            lu = linalg.splu(matrix[:, order].tocsc(), permc_spec = 'NATURAL',
+                             options = self.options)
+            x = np.empty_like(rhs)
+            x[order] = lu.solve(rhs)
+            return x
+        except RuntimeError as err:
+            raise Warning(str(err))
+        finally:
+            instrument.stop('linear_solve', started)
+
+def _node_form(network):
+    '''Returns True if every flow is unknown and unknown heads match continuity.
+
+    That is, every node has either a known head or a continuity
+    equation but not both, which the node-based engines rely on.
+    '''
+    return (len(network.flow_unknowns) == network.n_segs
+            and np.array_equal(np.sort(network.head_unknowns),
+                               np.flatnonzero(network.continuity)))
+
+def _floor(deriv):
+    '''Returns deriv with entries raised to a small fraction of the largest.
+
+    Quadratic losses have no slope at zero flow; this keeps the
+    linearized systems invertible.
+    '''
+    return np.maximum(deriv, max(1e-6 * deriv.max(initial = 0), 1e-9))
+
+def gga(network, report = None):
+    '''Solves network with the Global Gradient Algorithm (Todini-Pilati).
+
+    Each Newton step on segment flows Q and unknown heads H is reduced
+    to the symmetric positive-definite system
+
+        (A D^-1 A^T) dH = g - A D^-1 f
+
+    where A is the incidence of the unknown-head nodes, D the diagonal
+    of loss derivatives, f the segment residuals and g the continuity
+    residuals, after which dQ follows segment by segment. Steps that
+    don't reduce the residuals are halved.
+
+    Needs every flow to be unknown and every node to have either a known
+    head or a continuity equation, but not both; raises ValueError
+    otherwise.
+    '''
+    head_unknowns = network.head_unknowns
+    if report is None:
+        report = instrument.SolveReport('gga')
+    if not _node_form(network):
+        raise ValueError('GGA needs a continuity equation at exactly the '
+                         'nodes with unknown heads')
+
+    factor = network.solver_cache.get('gga')
+    if factor is None:
+        factor = network.solver_cache['gga'] = PatternSolver(
+            'MMD_AT_PLUS_A', symmetric = True)
+    a21 = network.incidence[head_unknowns]
+    a12 = a21.T.tocsr()
+    demand = network.outflow[head_unknowns]
+    r_scale = np.concatenate((np.full(network.n_segs, network._foot),
+                              np.full(len(head_unknowns), network._gpm)))
+
+    def residuals(flow, head):
+        instrument.count('residuals')
+        loss = network.losses(flow)
+        f = loss + network.incidence.T @ head
+        g = a21 @ flow - demand
+        return loss, f, g, np.concatenate((f, g)) / r_scale
+
+    flow = network.flow.copy()
+    head = network.head.copy()
+    loss, f, g, scaled = residuals(flow, head)
+    report.residual_norm = float(np.linalg.norm(scaled))
+    for _ in range(MAX_ITERATIONS):
+        if utils.converged(scaled):
+            return np.concatenate((flow[network.flow_unknowns],
+                                   head[head_unknowns]))
+        instrument.count('jacobians')
+        inverse = 1 / _floor(network.loss_slopes(flow, loss))
+
+        # A minimum degree ordering on the symmetric pattern keeps fill
+        # far lower than SuperLU's default column ordering
+        schur = (a21 @ sparse.diags(inverse) @ a12).tocsc()
+        d_head = factor.solve(schur, g - a21 @ (inverse * f))
+        d_flow = -inverse * (f + a12 @ d_head)
+
+        merit = np.linalg.norm(scaled)
+        alpha = 1.
+        for _ in range(MAX_BACKTRACKS):
+            new_flow = flow + alpha * d_flow
+            new_head = head.copy()
+            new_head[head_unknowns] += alpha * d_head
+            trial = residuals(new_flow, new_head)
+            if np.linalg.norm(trial[3]) < merit:
+                break
+            alpha /= 2
+        flow, head = new_flow, new_head
+        loss, f, g, scaled = trial
+        report.step(float(np.linalg.norm(scaled)), alpha * float(np.hypot(
+            np.linalg.norm(d_flow) / network._gpm,
+            np.linalg.norm(d_head) / network._foot)))
+
+    if utils.converged(scaled):
+        return np.concatenate((flow[network.flow_unknowns],
+                               head[head_unknowns]))
+    raise Warning('GGA did not converge in {} iterations'.format(
+        MAX_ITERATIONS))
+
+def node_ordering(network):
+    '''Returns fill-reducing order of network.head_unknowns by position.
+
+    The order is minimum degree on the graph of nodes joined by
+    segments, read off SuperLU's factorization of that graph's
+    Laplacian (plus the identity, to keep it definite).
+    '''
+    from scipy.sparse import linalg
+    a = network.incidence[network.head_unknowns]
+    laplacian = (abs(a) @ abs(a).T
+                 + sparse.identity(a.shape[0])).tocsc()
+    lu = linalg.splu(laplacian, permc_spec = 'MMD_AT_PLUS_A',
+                     options = dict(SymmetricMode = True))
+    return np.argsort(lu.perm_c)
+
+class JacobianPattern:
+    '''Sparsity pattern of a CompiledNetwork's Jacobian, assembled once.
+
+    The only entries that change between Newton steps are the loss
+    derivatives on the diagonal of the flow unknowns; the rest are the
+    +1 and -1 of the incidence matrix. The CSC structure is built once
+    along with a map from (derivatives, constants) to its data, so each
+    step only fills in the data array.
+    '''
+    def __init__(self, network):
+        n_segs = network.n_segs
+        n_flows = len(network.flow_unknowns)
+        column = np.full(n_segs + network.n_nodes, -1, dtype=np.intp)
+        column[network.flow_unknowns] = np.arange(n_flows)
+        column[n_segs + network.head_unknowns] = np.arange(
+            n_flows, network.n_unknowns)
+        node_row = np.full(network.n_nodes, -1, dtype=np.intp)
+        node_row[network.continuity] = n_segs + np.arange(
+            network.continuity.sum())
+
+        seg_range = np.arange(n_segs)
+        incidence = network.incidence.tocoo()
+        # Derivative entries first, then the constant ones
+        rows = np.concatenate((network.flow_unknowns, seg_range, seg_range,
+                               node_row[incidence.row]))
+        cols = np.concatenate((np.arange(n_flows),
+                               column[n_segs + network.end],
+                               column[n_segs + network.start],
+                               column[incidence.col]))
+        values = np.concatenate((np.ones(n_segs), -np.ones(n_segs),
+                                 incidence.data))
+        keep = np.r_[np.ones(n_flows, dtype=bool), (rows[n_flows:] >= 0)
+                     & (cols[n_flows:] >= 0)]
+        rows, cols = rows[keep], cols[keep]
+        self.constants = values[keep[n_flows:]]
+
+        # CSC keeps entries sorted by column then row, so numbering the
+        # distinct (column, row) keys in order gives each entry its place
+        # in the data array, with duplicates sharing one
+        self.shape = (n_segs + network.continuity.sum(), network.n_unknowns)
+        keys, place = np.unique(cols * self.shape[0] + rows,
+                                return_inverse = True)
+        self.indices = keys % self.shape[0]
+        self.indptr = np.searchsorted(keys // self.shape[0],
+                                      np.arange(self.shape[1] + 1))
+        self.scatter = sparse.csr_matrix(
+            (np.ones(len(rows)), (place, np.arange(len(rows)))),
+            shape = (len(keys), len(rows)))
+        self.flow_unknowns = network.flow_unknowns
+        if _node_form(network):
+            # Row k and column k belong to the same segment or node, so
+            # flows can be eliminated first on their own diagonal,
+            # leaving the node system that gga solves, in fill-reducing
+            # node order
+            self.solver = PatternSolver(symmetric = True, order = np.r_[
+                np.arange(n_segs), n_segs + node_ordering(network)])
+        else:
+            self.solver = PatternSolver('MMD_AT_PLUS_A')
+
+    def assemble(self, deriv):
+        '''Returns CSC Jacobian given loss derivatives of every segment.'''
+        values = np.concatenate((deriv[self.flow_unknowns], self.constants))
+        return sparse.csc_matrix((self.scatter @ values, self.indices,
+                                  self.indptr), shape = self.shape)
+
+def newton(network, report = None):
+    '''Solves network with Newton's method on the sparse Jacobian.
+
+    The Jacobian is never held dense: its pattern and fill-reducing
+    ordering are kept in network.solver_cache, so later steps and
+    later solves of the same topology only redo the numeric
+    factorization. Steps that don't reduce the residuals are halved.
+    Raises ValueError if the system isn't square.
+    '''
+    if network.n_unknowns != network.n_segs + network.continuity.sum():
+        raise ValueError('Newton needs as many equations as unknowns')
+    if report is None:
+        report = instrument.SolveReport('newton')
+    pattern = network.solver_cache.get('newton')
+    if pattern is None:
+        started = instrument.start()
+        pattern = network.solver_cache['newton'] = JacobianPattern(network)
+        instrument.stop('setup', started)
+
+    def residuals(x):
+        instrument.count('residuals')
+        flow, head = network.expand(x)
+        loss = network.losses(flow)
+        seg_errors = head[network.end] + loss - head[network.start]
+        node_errors = network.incidence @ flow - network.outflow
+        r = np.concatenate((seg_errors, node_errors[network.continuity]))
+        return flow, loss, r, r / network.r_scale
+
+    x = network.initial_guess()
+    flow, loss, r, scaled = residuals(x)
+    report.residual_norm = float(np.linalg.norm(scaled))
+    for _ in range(MAX_ITERATIONS):
+        if utils.converged(scaled):
+            return x
+        instrument.count('jacobians')
+        deriv = _floor(network.loss_slopes(flow, loss))
+        dx = pattern.solver.solve(pattern.assemble(deriv), -r)
+
+        merit = np.linalg.norm(scaled)
+        alpha = 1.
+        for _ in range(MAX_BACKTRACKS):
+            trial = residuals(x + alpha * dx)
+            if np.linalg.norm(trial[3]) < merit:
+                break
+            alpha /= 2
+        x = x + alpha * dx
+        flow, loss, r, scaled = trial
+        report.step(float(np.linalg.norm(scaled)),
+                    alpha * float(np.linalg.norm(dx / network.x_scale)))
+
+    if utils.converged(scaled):
+        return x
+    raise Warning('Newton did not converge in {} iterations'.format(
+        MAX_ITERATIONS))
+
+def loop(network, report = None):
+    '''Solves network for one corrective flow per independent loop.
+
+    Flows are built as tree flows meeting every demand plus the loop
+    flows (see loops.LoopBasis), so continuity holds throughout and
+    Newton's method only works on the loop head balances, a symmetric
+    system of (loops x loops) with matrix B D B^T. Heads are filled in
+    down the spanning tree afterwards. The chords' current flows are
+    the starting loop flows. Needs the same network form as gga.
+
+    This suits lightly looped networks best: loops that share long tree
+    paths make B D B^T dense, where gga stays sparse.
+    '''
+    from . import loops
+    if not _node_form(network):
+        raise ValueError('the loop method needs a continuity equation at '
+                         'exactly the nodes with unknown heads')
+    if report is None:
+        report = instrument.SolveReport('loop')
+    if 'loop' not in network.solver_cache:
+        started = instrument.start()
+        network.solver_cache['loop'] = (
+            loops.LoopBasis(network),
+            PatternSolver('MMD_AT_PLUS_A', symmetric = True))
+        instrument.stop('setup', started)
+    basis, solver = network.solver_cache['loop']
+    b = basis.loops
+    tree_flow = basis.tree_flows(network.outflow)
+    # Unknown heads cancel around every loop, leaving only differences
+    # between fixed heads on loops that join two of them
+    known = network.head.copy()
+    known[network.head_unknowns] = 0
+    lift = b @ (network.incidence.T @ known)
+
+    def residuals(q):
+        instrument.count('residuals')
+        flow = tree_flow + b.T @ q
+        loss = network.losses(flow)
+        error = b @ loss + lift
+        return flow, loss, error, error / network._foot
+
+    q = network.flow[basis.chords]
+    flow, loss, error, scaled = residuals(q)
+    report.residual_norm = float(np.linalg.norm(scaled))
+    for _ in range(MAX_ITERATIONS):
+        if utils.converged(scaled):
+            break
+        instrument.count('jacobians')
+        deriv = _floor(network.loss_slopes(flow, loss))
+        dq = solver.solve((b @ sparse.diags(deriv) @ b.T).tocsc(),
+                          -error)
+
+        merit = np.linalg.norm(scaled)
+        alpha = 1.
+        for _ in range(MAX_BACKTRACKS):
+            trial = residuals(q + alpha * dq)
+            if np.linalg.norm(trial[3]) < merit:
+                break
+            alpha /= 2
+        q = q + alpha * dq
+        flow, loss, error, scaled = trial
+        report.step(float(np.linalg.norm(scaled)),
+                    alpha * float(np.linalg.norm(dq)) / network._gpm)
+    else:
+        if not utils.converged(scaled):
+            raise Warning('loop method did not converge in {} '
+                          'iterations'.format(MAX_ITERATIONS))
+
+    head = basis.tree_heads(network, network.head, loss)
+    return np.concatenate((flow[network.flow_unknowns],
+                           head[network.head_unknowns]))
+
+ENGINES = {'hybr': hybr, 'gga': gga, 'newton': newton, 'loop': loop}
+
+def default_engine(network):
+    '''Returns name of the engine network is solved with by default.
+
+    gga takes the usual network of pipes between reservoirs and demand
+    nodes, newton any other square system, and only what neither can
+    take is left to hybr, whose dense Jacobian grows as the cube of the
+    unknowns.
+    '''
+    if _node_form(network):
+        return 'gga'
+    if network.n_unknowns == network.n_segs + network.continuity.sum():
+        return 'newton'
+    return 'hybr'
+
+def linear_guess(network, passes = None):
+    '''Returns unknowns of network solved with linearized losses.
+
+    Each segment's loss is replaced by R q, which makes the network a
+    linear system with the same pattern as the Newton Jacobian. R
+    starts as the secant resistance at the network's mean demand (or
+    one gpm) and is then worked out again at the average of each
+    segment's last two flows, for passes solves in all (the linear
+    theory method). The result is a far better start than zero flow,
+    where friction factors have no meaning. Raises ValueError if the
+    system isn't square.
+    '''
+    if network.n_unknowns != network.n_segs + network.continuity.sum():
+        raise ValueError('a linear guess needs as many equations as '
+                         'unknowns')
+    pattern = network.solver_cache.get('newton')
+    if pattern is None:
+        pattern = network.solver_cache['newton'] = JacobianPattern(network)
+    flow, head = network.expand(np.zeros(network.n_unknowns))
+    demand = np.abs(network.outflow[network.continuity])
+    scale = demand.mean() if demand.any() else network._gpm
+    average = np.full(network.n_segs, scale)
+    x = None
+    for _ in range(passes or LINEAR_PASSES):
+        q = np.where(np.abs(average) > 1e-3 * scale, np.abs(average), scale)
+        resistance = _floor(network.losses(q) / q)
+        r = np.concatenate((
+            head[network.end] + resistance * flow - head[network.start],
+            (network.incidence @ flow - network.outflow)[network.continuity]))
+        x = pattern.solver.solve(pattern.assemble(resistance), -r)
+        average = (average + network.expand(x)[0]) / 2
+    return x
+
+def seed(network):
+    '''Starts network from linear_guess if every unknown is still zero.
+
+    Networks that were never solved hold zeros in their unknowns, the
+    worst place to start from. Returns True if network was seeded;
+    networks that can't be linearized are left alone.
+    '''
+    if network.initial_guess().any():
+        return False
+    try:
+        x = linear_guess(network)
+    except (ValueError, Warning):
+        return False
+    if not np.all(np.isfinite(x)):
+        return False
+    network.flow, network.head = network.expand(x)
+    return True
+
+def continuation(network, method, report):
+    '''Returns unknowns of network solved by method with demands ramped up.
+
+    The outflows are scaled to 1 / CONTINUATION_STEPS of their values
+    and raised in equal steps to the full demand, each solve starting
+    from the one before. network is left as it was.
+    '''
+    outflow, flow, head = network.outflow, network.flow, network.head
+    try:
+        for fraction in np.arange(1, CONTINUATION_STEPS + 1) / \
+                CONTINUATION_STEPS:
+            network.outflow = outflow * fraction
+            x = method(network, report)
+            network.flow, network.head = network.expand(x)
+    finally:
+        network.outflow, network.flow, network.head = outflow, flow, head
+    return x
+
+def solve(network, engine = None, report = None):
+    '''Returns unknowns of network solved by the engine named engine.
+
+    Without engine, default_engine picks one for network. A network
+    whose unknowns are all zero is first seeded with linear_guess. If an
+    engine other than hybr fails to converge, hybr is tried from the
+    original starting point; if that fails too, the engine is run again
+    by continuation, ramping the demands up. report.fallback names
+    whichever of 'hybr' and 'continuation' was tried last. report (an
+    instrument.SolveReport, made here if not given) is finished either
+    way; if nothing converges, instrument.ConvergenceWarning is raised
+    carrying it.
+    '''
+    if engine is None:
+        engine = default_engine(network)
+    try:
+        method = ENGINES[engine]
+    except KeyError:
+        raise ValueError('Unknown solver engine: {}'.format(engine))
+    if report is None:
+        report = instrument.SolveReport(engine)
+    seed(network)
+    fallbacks = list()
+    if method is not hybr:
+        fallbacks.append(('hybr', hybr))
+    fallbacks.append(('continuation', lambda network, report: continuation(
+        network, method, report)))
+    try:
+        x = method(network, report)
+    except Warning as err:
+        error = err
+        for name, fallback in fallbacks:
+            report.message = str(error)
+            report.fallback = name
+            try:
+                x = fallback(network, report)
+                break
+            except Warning as err:
+                error = err
+        else:
+            report.finish(False, message = str(error))
+            raise instrument.ConvergenceWarning(str(error), report) \
+                from error
+    report.finish(True, message = report.message)
+    return x
@@ -0,0 +1,306 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Solving many perturbed copies of one network together.
+
+An Ensemble holds K scenarios of one topology as (K x n) arrays of
+element parameters, demands, fixed heads and fluid properties, which
+can be perturbed freely, for example for a Monte Carlo study:
+
+    ensemble = Ensemble(network, 1000)
+    ensemble.parameters(element_classes.Pipe)[:, :, 2] *= rng.lognormal(
+        0, 0.3, (1000, n_pipes))
+    ensemble.set_outflow('C', rng.normal(10, 2, 1000) * ureg.gpm)
+    ensemble.set_temperature(network.fluid, ureg.Quantity(
+        rng.uniform(5, 80, 1000), ureg.degC))
+    ensemble.solve()
+
+Every scenario takes Newton steps at the same time: losses, friction
+factors and derivatives of all of them are evaluated in one call per
+element class, and the Jacobians are factorized as one block diagonal
+matrix. Scenarios drop out of the arrays as they converge.
+'''
+
+import numpy as np
+from scipy import sparse
+from . import compiled
+from . import engines
+from . import instrument
+from . import utils
+
+class Ensemble:
+    '''size scenarios of a network, solved together with Newton's method.
+
+    network is a core.Network or compiled.CompiledNetwork; every
+    scenario starts as a copy of it, from its current solution. All
+    arrays are in SI units and have one row per scenario: flow (by
+    segment), head, outflow (by node), density and viscosity (by
+    segment), and one array per element class from parameters.
+    Raises ValueError if some elements have no batch_loss or if the
+    network doesn't have as many equations as unknowns.
+    '''
+    def __init__(self, network, size):
+        if not isinstance(network, compiled.CompiledNetwork):
+            network = network.compile()
+        self.base = base = network.detach()
+        if base.n_unknowns != base.n_segs + base.continuity.sum():
+            raise ValueError('an Ensemble needs as many equations as '
+                             'unknowns')
+        self.size = size
+        self.segment_names = base.segment_names
+        self.node_names = base.node_names
+        rows = (size, 1)
+        self.flow = np.tile(base.flow, rows)
+        self.head = np.tile(base.head, rows)
+        self.outflow = np.tile(base.outflow, rows)
+        self.density = np.tile(base.density, rows)
+        self.viscosity = np.tile(base.viscosity, rows)
+        self.params = [np.tile(group.params, (size, 1, 1))
+                       for group in base.groups]
+        self.converged = np.zeros(size, dtype=bool)
+        self.iterations = np.zeros(size, dtype=int)
+        self.residual_norms = np.full(size, np.nan)
+
+        pattern = base.solver_cache.get('newton')
+        if pattern is None:
+            pattern = base.solver_cache['newton'] = engines.JacobianPattern(
+                base)
+        self._pattern = pattern
+
+    def parameters(self, element_class):
+        '''Returns the (size x elements x parameters) array of element_class.
+
+        The array is the ensemble's own, so changing it changes the
+        scenarios. Its last axis is ordered like the class's
+        batch_parameters and its middle one like segments(element_class).
+        Raises KeyError if there are no such elements.
+        '''
+        return self.params[self._group(element_class)]
+
+    def segments(self, element_class):
+        '''Returns the segment name of each element of element_class.'''
+        group = self.base.groups[self._group(element_class)]
+        return [self.segment_names[i] for i in group.segment_index]
+
+    def _group(self, element_class):
+        for i, group in enumerate(self.base.groups):
+            if group.element_class is element_class:
+                return i
+        raise KeyError('No elements of class {}'.format(
+            element_class.__name__))
+
+    def set_outflow(self, name, values):
+        '''Sets the outflow of node name in every scenario.
+
+        values is a pint Quantity holding one value or one per
+        scenario. Raises ValueError if the node's outflow is unknown.
+        '''
+        i = self.base.node_index(name)
+        if not self.base.continuity[i]:
+            raise ValueError('outflow of node {} is unknown'.format(name))
+        self.outflow[:, i] = compiled._si(values, compiled.FLOW_UNITS)
+
+    def set_head(self, name, values):
+        '''Sets the fixed head of node name in every scenario.
+
+        values is a pint Quantity holding one value or one per
+        scenario. Raises ValueError if the node's head is unknown.
+        '''
+        i = self.base.node_index(name)
+        if i in self.base.head_unknowns:
+            raise ValueError('head of node {} is unknown'.format(name))
+        self.head[:, i] = compiled._si(values, compiled.HEAD_UNITS)
+
+    def set_temperature(self, fluid, values):
+        '''Sets density and viscosity of every scenario from core.Fluid fluid.
+
+        values is a pint Quantity holding one temperature, one per
+        scenario, or a (size x segments) array of them. The table is
+        interpolated once for each distinct temperature.
+        '''
+        density, viscosity = fluid.properties(values)
+        if density.ndim == 1:
+            density, viscosity = density[:, None], viscosity[:, None]
+        self.density[:], self.viscosity[:] = density, viscosity
+
+    def losses(self, rows, flow):
+        '''Returns head loss across every segment of scenarios rows.
+
+        flow holds the segment flows of those scenarios, one row each.
+        '''
+        instrument.count('losses', len(rows))
+        started = instrument.start()
+        loss = np.zeros(flow.shape)
+        for group, params in zip(self.base.groups, self.params):
+            np.add.at(loss, (slice(None), group.segment_index),
+                      self._evaluate(group.element_class.batch_loss,
+                                     group, params, rows, flow))
+        instrument.stop('losses', started)
+        return loss
+
+    def loss_derivatives(self, rows, flow, loss):
+        '''Returns d(head loss)/d(flow) of every segment of scenarios rows.
+
+        Elements without batch_derivative are differenced, which costs
+        one more evaluation of losses, as in engines.
+        '''
+        if not self.base.has_derivatives:
+            step = 1e-6 * np.maximum(abs(flow), self.base._gpm)
+            return (self.losses(rows, flow + step) - loss) / step
+        instrument.count('loss_derivatives', len(rows))
+        started = instrument.start()
+        deriv = np.zeros(flow.shape)
+        for group, params in zip(self.base.groups, self.params):
+            np.add.at(deriv, (slice(None), group.segment_index),
+                      self._evaluate(group.element_class.batch_derivative,
+                                     group, params, rows, flow))
+        instrument.stop('losses', started)
+        return deriv
+
+    def _evaluate(self, method, group, params, rows, flow):
+        '''Returns method of group over all rows in one call, one row each.'''
+        i = group.segment_index
+        shape = (len(rows), len(i))
+        values = method(params[rows].reshape(len(rows) * len(i), -1),
+                        flow[:, i].ravel(), self.density[rows][:, i].ravel(),
+                        self.viscosity[rows][:, i].ravel())
+        return values.reshape(shape)
+
+    def _residuals(self, rows, x):
+        '''Returns (flow, loss, residuals, scaled residuals) of rows.'''
+        instrument.count('residuals', len(rows))
+        base = self.base
+        n_flows = len(base.flow_unknowns)
+        flow, head = self.flow[rows], self.head[rows]
+        flow[:, base.flow_unknowns] = x[:, :n_flows]
+        head[:, base.head_unknowns] = x[:, n_flows:]
+        loss = self.losses(rows, flow)
+        seg_errors = head[:, base.end] + loss - head[:, base.start]
+        node_errors = (base.incidence @ flow.T).T - self.outflow[rows]
+        r = np.concatenate((seg_errors, node_errors[:, base.continuity]),
+                           axis = 1)
+        return flow, loss, r, r / base.r_scale
+
+    def _block_jacobian(self, deriv):
+        '''Returns block diagonal CSC of the Jacobians of deriv's rows.'''
+        pattern = self._pattern
+        m = len(deriv)
+        n_rows, n_cols = pattern.shape
+        nnz = len(pattern.indices)
+        values = np.concatenate(
+            (deriv[:, pattern.flow_unknowns],
+             np.tile(pattern.constants, (m, 1))), axis = 1)
+        data = (pattern.scatter @ values.T).T.ravel()
+        indices = (pattern.indices + n_rows * np.arange(m)[:, None]).ravel()
+        indptr = np.r_[(pattern.indptr[:-1]
+                        + nnz * np.arange(m)[:, None]).ravel(), m * nnz]
+        return sparse.csc_matrix((data, indices, indptr),
+                                 shape = (m * n_rows, m * n_cols))
+
+    def _block_solver(self, m):
+        '''Returns PatternSolver for m blocks ordered like one Jacobian.'''
+        solver = self._pattern.solver
+        n = self._pattern.shape[1]
+        if solver.order is None:
+            # Let SuperLU choose the ordering once, on a single block
+            solver.solve(self._pattern.assemble(np.ones(self.base.n_segs)),
+                         np.zeros(n))
+        order = (solver.order + n * np.arange(m)[:, None]).ravel()
+        return engines.PatternSolver(symmetric = solver.symmetric,
+                                     order = order)
+
+    def solve(self, callback = None):
+        '''Solves every scenario and returns an instrument.SolveReport.
+
+        Each iteration of the report is one Newton step of all the
+        scenarios still running, its residual norm that of all their
+        residuals together. Scenarios that don't converge within
+        engines.MAX_ITERATIONS steps are left at their last iterate and
+        marked False in converged; the report then says how many, but
+        unlike Network.solve nothing is raised, so the rest can still
+        be used. iterations and residual_norms hold each scenario's own
+        step count and final norm.
+        '''
+        base = self.base
+        report = instrument.SolveReport('ensemble', callback)
+        x = np.concatenate((self.flow[:, base.flow_unknowns],
+                            self.head[:, base.head_unknowns]), axis = 1)
+        x = np.nan_to_num(x)
+        rows = np.arange(self.size)
+        self.iterations[:] = 0
+        flow, loss, r, scaled = self._residuals(rows, x)
+        report.residual_norm = float(np.linalg.norm(scaled))
+        for _ in range(engines.MAX_ITERATIONS + 1):
+            done = np.all(np.abs(scaled) <= utils.RESIDUAL_TOLERANCE,
+                          axis = 1)
+            self.residual_norms[rows] = np.linalg.norm(scaled, axis = 1)
+            self.converged[rows] = done
+            self._store(rows[done], x[done])
+            # Finished scenarios are masked out of everything after this
+            keep = ~done
+            rows, x, flow, loss = rows[keep], x[keep], flow[keep], loss[keep]
+            r, scaled = r[keep], scaled[keep]
+            if not len(rows) or report.iterations == engines.MAX_ITERATIONS:
+                break
+            instrument.count('jacobians', len(rows))
+            deriv = self.loss_derivatives(rows, flow, loss)
+            deriv = np.maximum(deriv, np.maximum(
+                1e-6 * deriv.max(axis = 1, keepdims = True), 1e-9))
+            dx = self._block_solver(len(rows)).solve(
+                self._block_jacobian(deriv), -r.ravel()).reshape(x.shape)
+
+            # Steps are halved scenario by scenario until they reduce
+            # that scenario's residuals
+            merit = np.linalg.norm(scaled, axis = 1)
+            alpha = np.ones(len(rows))
+            pending = np.arange(len(rows))
+            trial = [flow, loss, r, scaled]
+            for attempt in range(engines.MAX_BACKTRACKS):
+                step = x[pending] + alpha[pending, None] * dx[pending]
+                values = self._residuals(rows[pending], step)
+                for whole, part in zip(trial, values):
+                    whole[pending] = part
+                worse = (np.linalg.norm(values[3], axis = 1)
+                         >= merit[pending])
+                if attempt + 1 < engines.MAX_BACKTRACKS:
+                    alpha[pending[worse]] /= 2
+                pending = pending[worse]
+                if not len(pending):
+                    break
+            x = x + alpha[:, None] * dx
+            flow, loss, r, scaled = trial
+            self.iterations[rows] += 1
+            report.step(float(np.linalg.norm(scaled)), float(np.linalg.norm(
+                alpha[:, None] * dx / base.x_scale)))
+
+        self._store(rows, x)
+        failed = self.size - int(self.converged.sum())
+        report.residual_norm = float(np.linalg.norm(
+            np.nan_to_num(self.residual_norms)))
+        if failed:
+            return report.finish(False, message = '{} of {} scenarios did '
+                                 'not converge'.format(failed, self.size))
+        return report.finish(True)
+
+    def _store(self, rows, x):
+        '''Writes the unknowns x into the flow and head rows.'''
+        base = self.base
+        n_flows = len(base.flow_unknowns)
+        flow, head = self.flow[rows], self.head[rows]
+        flow[:, base.flow_unknowns] = x[:, :n_flows]
+        head[:, base.head_unknowns] = x[:, n_flows:]
+        self.flow[rows], self.head[rows] = flow, head
@@ -0,0 +1,130 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Extended-period (time-series) simulation.
+
+The network is compiled once and the same compiled.CompiledNetwork is
+solved at every time step: node demands are read from preallocated
+arrays, tank heads follow their levels, and each step starts from the
+previous step's solution. Results are written straight into
+preallocated arrays.
+'''
+
+import numpy as np
+from . import compiled
+from . import ureg
+
+class Tank:
+    '''Storage tank at a node.
+
+    The node's head is elevation + level and is held fixed within a
+    step. Between steps the level moves by the net flow into the node
+    times the step length over area. The node must have a known head
+    and an unknown outflow in the network, like any reservoir.
+    '''
+    def __init__(self, area, level, elevation = 0):
+        self.area = compiled._si(area, 'meter**2')
+        self.level = compiled._si(level, compiled.HEAD_UNITS)
+        self.elevation = compiled._si(elevation, compiled.HEAD_UNITS)
+
+class ExtendedPeriodResult:
+    '''Arrays of results from simulate, in SI units.
+
+    flow[k] and head[k] are the segment flows and node heads solved at
+    times[k], ordered like segment_names and node_names. levels[k] is
+    the level of each tank in tank_names at times[k]; it has one more
+    row than flow, holding the levels after the last step.
+    '''
+    def __init__(self, times, flow, head, levels, network, tank_names):
+        self.times = times
+        self.flow = flow
+        self.head = head
+        self.levels = levels
+        self.segment_names = network.segment_names
+        self.node_names = network.node_names
+        self.tank_names = tank_names
+
+def _series(values, n_steps):
+    '''Returns demand series values as an SI array of length n_steps.'''
+    if isinstance(values, ureg.Quantity):
+        values = values.to(compiled.FLOW_UNITS).magnitude
+    values = np.asarray(values, dtype=float)
+    if values.shape != (n_steps,):
+        raise ValueError('demand series must have one value per step')
+    return values
+
+def simulate(network, n_steps, step, demands = None, tanks = None,
+             dtype = np.float64):
+    '''Returns ExtendedPeriodResult of n_steps steps of length step.
+
+    network is a core.Network or compiled.CompiledNetwork; it is
+    compiled once and reused for every step. demands maps node names
+    to sequences (or pint Quantity arrays) of n_steps outflows; plain
+    numbers are taken as m**3/s. tanks maps node names to Tank objects.
+    dtype sets the precision of the stored results, so long runs over
+    large networks can use float32 to halve their memory.
+
+    Raises Warning naming the step if a step doesn't converge.
+    '''
+    if not isinstance(network, compiled.CompiledNetwork):
+        network = network.compile()
+    network = network.copy()
+    # Results go to the arrays below rather than back into the Network
+    network.segments = network.nodes = None
+    step = compiled._si(step, 'second')
+    demands = demands or dict()
+    tanks = tanks or dict()
+
+    demand_nodes = np.array([network.node_index(n) for n in demands],
+                            dtype=np.intp)
+    demand_series = np.empty((n_steps, len(demands)))
+    for j, name in enumerate(demands):
+        if not network.continuity[demand_nodes[j]]:
+            raise ValueError('node {} has no continuity equation, so it '
+                             "can't be given a demand".format(name))
+        demand_series[:, j] = _series(demands[name], n_steps)
+
+    tank_names = list(tanks)
+    tank_nodes = np.array([network.node_index(n) for n in tank_names],
+                          dtype=np.intp)
+    for name, i in zip(tank_names, tank_nodes):
+        if network.continuity[i] or i in network.head_unknowns:
+            raise ValueError('tank node {} needs a known head and an '
+                             'unknown outflow'.format(name))
+    area = np.array([tanks[n].area for n in tank_names])
+    elevation = np.array([tanks[n].elevation for n in tank_names])
+
+    flow = np.empty((n_steps, network.n_segs), dtype=dtype)
+    head = np.empty((n_steps, network.n_nodes), dtype=dtype)
+    levels = np.empty((n_steps + 1, len(tank_names)), dtype=dtype)
+    levels[0] = level = np.array([tanks[n].level for n in tank_names])
+
+    for k in range(n_steps):
+        network.outflow[demand_nodes] = demand_series[k]
+        network.head[tank_nodes] = elevation + level
+        try:
+            network.solve()
+        except Warning as err:
+            raise Warning('step {}: {}'.format(k, err))
+        flow[k] = network.flow
+        head[k] = network.head
+        inflow = network.incidence[tank_nodes] @ network.flow
+        level = level + inflow * step / area
+        levels[k + 1] = level
+
+    return ExtendedPeriodResult(np.arange(n_steps) * step, flow, head,
+                                levels, network, tank_names)
@@ -0,0 +1,128 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Resistance coefficients of standard fittings by type and nominal size.
+
+The table in data/fitting_k.csv is read the first time it is needed and
+shared by every caller afterwards. Valves, elbows and tees follow the
+Crane TP-410 correlation K = n f_T, where f_T is the fully turbulent
+friction factor of clean commercial steel pipe of the fitting's nominal
+size and n is a multiplier for the type of fitting. Entrances and exits
+don't depend on size. Reducers depend on two sizes, so their K is
+worked out from the diameter ratio by reducer_k_factors instead.
+'''
+
+import csv
+import os
+import numpy as np
+from . import pipe_sizes
+
+K_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'data', 'fitting_k.csv')
+
+_table = None
+
+class FittingTable:
+    '''K-factors by nominal pipe size and fitting type.
+
+    Rows are nominal pipe sizes and columns are fitting types, held in
+    a NumPy array, with two dicts mapping NPS and type names to row and
+    column indices. The f_T column holds the friction factor the
+    K-factors were worked out from.
+    '''
+    def __init__(self, filename = K_FILE):
+        with open(filename, 'r') as f:
+            csv_reader = csv.reader(f)
+            header = [i.strip() for i in next(csv_reader)]
+            rows = [[i.strip() for i in line] for line in csv_reader if line]
+
+        self.kinds = header[2:]
+        self.sizes = [row[0] for row in rows]
+        self.friction = np.array([float(row[1]) for row in rows])
+        self.k = np.array([[float(i) for i in row[2:]] for row in rows])
+
+        self.kind_index = {s: j for j, s in enumerate(self.kinds)}
+        self.size_index = {s: i for i, s in enumerate(self.sizes)}
+        # Allow sizes to be given as numbers of inches too
+        self.size_index.update({pipe_sizes._parse_nps(s): i
+                                for i, s in enumerate(self.sizes)})
+
+    def _row(self, nps):
+        try:
+            if nps in self.size_index:
+                return self.size_index[nps]
+            return self.size_index[pipe_sizes._parse_nps(str(nps))]
+        except (KeyError, ValueError):
+            raise KeyError('No fittings of nominal size: {}'.format(nps))
+
+    def _column(self, kind):
+        try:
+            return self.kind_index[kind]
+        except KeyError:
+            raise KeyError('Unknown fitting type: {}'.format(kind))
+
+    def lookup(self, kind, nps):
+        '''Returns K-factor of one fitting of type kind and size nps.'''
+        return float(self.k[self._row(nps), self._column(kind)])
+
+    def lookup_many(self, kinds, nps):
+        '''Returns array of K-factors for many fittings at once.
+
+        kinds and nps are equal length sequences. Each distinct name is
+        only resolved once and the K-factors are gathered from the table
+        array in one indexing operation.
+        '''
+        kind_cols = {k: self._column(k) for k in set(kinds)}
+        size_rows = {n: self._row(n) for n in set(nps)}
+        i = np.array([size_rows[n] for n in nps], dtype=np.intp)
+        j = np.array([kind_cols[k] for k in kinds], dtype=np.intp)
+        return self.k[i, j]
+
+def get_table():
+    '''Returns the shared FittingTable, reading it on first use.'''
+    global _table
+    if _table is None:
+        _table = FittingTable()
+    return _table
+
+def k_factor(kind, nps):
+    '''Returns K-factor of a fitting of type kind and nominal size nps.'''
+    return get_table().lookup(kind, nps)
+
+def k_factors(kinds, nps):
+    '''Returns array of K-factors for many fittings at once.'''
+    return get_table().lookup_many(kinds, nps)
+
+def reducer_k_factors(inlet, outlet, angle = 180):
+    '''Returns K-factors of reducers, referred to the smaller diameter.
+
+    inlet and outlet are arrays of inner diameters in any one unit and
+    angle is the included angle of the taper in degrees, 180 for a
+    sudden change. Reducers whose outlet is smaller are contractions
+    and the rest are expansions; both follow Crane TP-410.
+    '''
+    inlet, outlet, angle = np.broadcast_arrays(
+        np.asarray(inlet, dtype=float), np.asarray(outlet, dtype=float),
+        np.asarray(angle, dtype=float))
+    beta2 = (np.minimum(inlet, outlet) / np.maximum(inlet, outlet))**2
+    half = np.sin(np.radians(angle) / 2)
+    gradual = angle <= 45
+    contraction = np.where(gradual, 0.8 * half * (1 - beta2),
+                           0.5 * np.sqrt(half) * (1 - beta2))
+    expansion = np.where(gradual, 2.6 * half * (1 - beta2)**2,
+                         (1 - beta2)**2)
+    return np.where(outlet < inlet, contraction, expansion)
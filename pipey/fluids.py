@@ -0,0 +1,135 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Density and viscosity of fluids over a range of temperatures.
+
+Each fluid is a CSV file with a temperature, density and viscosity
+column. Its first row names the columns and its second gives their
+units, so tables may be written in whatever units they were taken from:
+
+    temperature,density,viscosity
+    degF,lb/ft**3,cP
+    40,62.43,1.55
+
+The built-in tables in FLUIDS are in data/fluid_<name>.csv. Water is
+from the IAPWS formulations and the glycol mixtures (percent by volume)
+are typical values from the ASHRAE Handbook, good enough for pressure
+drop estimates. Tables are read the first time they are needed and
+shared by every caller afterwards, and the properties worked out at
+each temperature are kept, so sweeping a network through a handful of
+temperatures only interpolates each of them once.
+'''
+
+import csv
+import os
+import numpy as np
+from . import instrument
+from . import ureg
+from . import utils
+
+FLUID_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'data', 'fluid_{}.csv')
+FLUIDS = ('water', 'ethylene_glycol_30', 'ethylene_glycol_50',
+          'propylene_glycol_30', 'propylene_glycol_50')
+# Temperatures remembered by each table before it starts over
+CACHE_SIZE = 4096
+
+_tables = dict()
+
+class FluidTable:
+    '''Density and viscosity of one fluid by temperature.
+
+    The columns are held as NumPy arrays in SI units, sorted by
+    temperature. Density is interpolated linearly between rows and
+    viscosity, which falls roughly exponentially with temperature,
+    linearly in its logarithm. Raises ValueError if the file is missing
+    a column or has temperatures out of order.
+    '''
+    def __init__(self, filename):
+        with open(filename, 'r') as f:
+            csv_reader = csv.reader(f)
+            header = [i.strip() for i in next(csv_reader)]
+            units = [i.strip() for i in next(csv_reader)]
+            rows = [[float(i) for i in line] for line in csv_reader if line]
+
+        columns = dict()
+        values = np.array(rows, dtype=float).reshape(len(rows), len(header))
+        for name, si_units in (('temperature', 'K'),
+                               ('density', 'kg/m**3'),
+                               ('viscosity', 'Pa*s')):
+            if name not in header:
+                raise ValueError('{} has no {} column'.format(filename,
+                                                               name))
+            j = header.index(name)
+            columns[name] = ureg.Quantity(
+                values[:, j], utils.parse_units(units[j])).to(si_units).m
+        if np.any(np.diff(columns['temperature']) <= 0):
+            raise ValueError('temperatures in {} must increase'.format(
+                filename))
+
+        self.temperature = columns['temperature']
+        self.density = columns['density']
+        self._log_viscosity = np.log(columns['viscosity'])
+        self._cache = dict()
+
+    def properties(self, temperature):
+        '''Returns (density, viscosity) arrays in SI units at temperature.
+
+        temperature is an array of any shape in kelvin, and the results
+        have the same shape. Each distinct temperature is interpolated
+        once, together with any others not seen before, and looked up
+        afterwards. Raises ValueError outside the table's range.
+        '''
+        temperature = np.asarray(temperature, dtype=float)
+        if (np.any(temperature < self.temperature[0])
+                or np.any(temperature > self.temperature[-1])):
+            raise ValueError('temperature outside of {:g} K to {:g} K'.format(
+                self.temperature[0], self.temperature[-1]))
+        unique, inverse = np.unique(temperature.ravel(), return_inverse=True)
+        keys = unique.tolist()
+        found = [self._cache.get(key) for key in keys]
+        missing = [i for i, pair in enumerate(found) if pair is None]
+        if missing:
+            instrument.count('fluid_properties', len(missing))
+            new = unique[missing]
+            density = np.interp(new, self.temperature, self.density)
+            viscosity = np.exp(np.interp(new, self.temperature,
+                                         self._log_viscosity))
+            if len(self._cache) + len(missing) > CACHE_SIZE:
+                self._cache.clear()
+            for i, pair in zip(missing, zip(density.tolist(),
+                                            viscosity.tolist())):
+                found[i] = self._cache[keys[i]] = pair
+        pairs = np.array(found, dtype=float).reshape(len(keys), 2)[inverse]
+        return (pairs[:, 0].reshape(temperature.shape),
+                pairs[:, 1].reshape(temperature.shape))
+
+def get_table(name):
+    '''Returns the shared FluidTable for name, reading it on first use.
+
+    name is one of FLUIDS or the path of a CSV file laid out like them.
+    Raises KeyError if it is neither.
+    '''
+    if name in FLUIDS:
+        filename = FLUID_FILE.format(name)
+    elif os.path.isfile(name):
+        filename = os.path.abspath(name)
+    else:
+        raise KeyError('Unknown fluid: {}'.format(name))
+    if filename not in _tables:
+        _tables[filename] = FluidTable(filename)
+    return _tables[filename]
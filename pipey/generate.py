@@ -0,0 +1,169 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Synthetic networks of any size in .pipey format.
+
+Each generator returns a list of (start, end) node name pairs, one per
+segment, fed from a reservoir node named R. lines turns such a list into
+the lines of a .pipey file, giving every node other than the reservoir a
+random demand and every segment a Pipe of random length sized for the
+flow it carries, and write saves them. The same seed always gives the
+same network.
+'''
+
+import collections
+import math
+import numpy as np
+
+RESERVOIR = 'R'
+RESERVOIR_HEAD = 200 # ft
+NOMINAL_SIZES = ('0.5', '0.75', '1', '1.5', '2', '3', '4', '6', '8', '10',
+                 '12', '16', '20', '24')
+SCHEDULE = '40'
+DEMAND_RANGE = (2, 20) # gpm
+# Pipes are sized the way a designer would, as the smallest size that
+# keeps the velocity under a limit drawn from this range, so flows are
+# turbulent apart from the odd segment closing a loop. Pipes near the
+# reservoir of very large networks can outgrow the largest size and run
+# faster, with heads to match.
+VELOCITY_RANGE = (2, 6) # ft/s
+LENGTH_RANGE = (10, 200) # ft
+
+def grid(rows, columns):
+    '''Returns segments of a rows x columns grid fed at one corner.
+
+    Every node is joined to its right and lower neighbours, so the grid
+    has (rows - 1) * (columns - 1) independent loops.
+    '''
+    name = lambda r, c: 'G{}_{}'.format(r, c)
+    segments = [(RESERVOIR, name(0, 0))]
+    for r in range(rows):
+        for c in range(columns):
+            if c + 1 < columns:
+                segments.append((name(r, c), name(r, c + 1)))
+            if r + 1 < rows:
+                segments.append((name(r, c), name(r + 1, c)))
+    return segments
+
+def tree(nodes, seed = 0, span = 5):
+    '''Returns segments of a random tree of nodes nodes below the reservoir.
+
+    Each node hangs off one of the span nodes created just before it,
+    which gives long branches with some side branches, much like a
+    distribution system.
+    '''
+    rng = np.random.default_rng(seed)
+    names = [RESERVOIR] + ['T{}'.format(i) for i in range(1, nodes + 1)]
+    return [(names[rng.integers(max(0, i - span), i)], names[i])
+            for i in range(1, nodes + 1)]
+
+def looped(nodes, loops, seed = 0, span = 50):
+    '''Returns segments of a random tree with loops extra segments added.
+
+    Extra segments join nodes at most span apart in creation order, so
+    loops stay local rather than crossing the whole network.
+    '''
+    rng = np.random.default_rng(seed)
+    segments = tree(nodes, seed, span = 5)
+    added = 0
+    while added < loops:
+        a = int(rng.integers(1, nodes + 1))
+        b = int(rng.integers(max(1, a - span), min(nodes, a + span) + 1))
+        if a != b:
+            segments.append(('T{}'.format(a), 'T{}'.format(b)))
+            added += 1
+    return segments
+
+def design_flows(segments, demands):
+    '''Returns the flow in gpm each segment carries for demands.
+
+    Flows are worked out on a spanning tree found breadth first from
+    the reservoir: a tree segment carries every demand beyond it and a
+    segment closing a loop carries the demand at its end. They are only
+    meant for sizing pipes, not as a solution of the network.
+    '''
+    joined = collections.defaultdict(list)
+    for i, (start, end) in enumerate(segments):
+        joined[start].append((i, end))
+        joined[end].append((i, start))
+    parent = {RESERVOIR: None}
+    order = [RESERVOIR]
+    for name in order:
+        for i, other in joined[name]:
+            if other not in parent:
+                parent[other] = i, name
+                order.append(other)
+    flows = [demands.get(end, 0.) for _, end in segments]
+    carried = dict(demands)
+    for name in reversed(order[1:]):
+        i, above = parent[name]
+        flows[i] = carried[name]
+        carried[above] = carried.get(above, 0.) + carried[name]
+    return flows
+
+def design_sizes(flows, velocities):
+    '''Returns the smallest nominal sizes keeping flows under velocities.
+
+    flows are in gpm and velocities in ft/s. The largest size is given
+    to flows that no size is big enough for.
+    '''
+    from . import pipe_sizes
+    inner = pipe_sizes.inner_diameters(NOMINAL_SIZES,
+                                       [SCHEDULE] * len(NOMINAL_SIZES))
+    # Inner diameter in inches giving each flow (gpm to ft**3/s) at its
+    # velocity
+    needed = 12 * np.sqrt(np.asarray(flows) * 0.13368 / 60
+                          / (math.pi / 4 * np.asarray(velocities)))
+    index = np.minimum(np.searchsorted(inner, needed), len(inner) - 1)
+    return [NOMINAL_SIZES[i] for i in index]
+
+def lines(segments, seed = 0):
+    '''Yields lines of a .pipey file for segments.
+
+    The reservoir gets a known head and every other node a demand.
+    '''
+    rng = np.random.default_rng(seed)
+    nodes = dict()
+    for start, end in segments:
+        nodes[start] = nodes[end] = None
+    demands = {name: rng.uniform(*DEMAND_RANGE) for name in nodes
+               if name != RESERVOIR}
+    sizes = design_sizes(design_flows(segments, demands),
+                         rng.uniform(*VELOCITY_RANGE, len(segments)))
+    lengths = rng.integers(*LENGTH_RANGE, len(segments))
+    for i, (start, end) in enumerate(segments):
+        size, length = sizes[i], lengths[i]
+        yield 'segment S{}'.format(i)
+        yield 'start ' + start
+        yield 'end ' + end
+        yield 'Pipe -s {} -d {} in -l {} ft'.format(SCHEDULE, size, length)
+        yield ''
+    for name in nodes:
+        yield 'node ' + name
+        if name == RESERVOIR:
+            yield 'head {} ft'.format(RESERVOIR_HEAD)
+            yield 'unknown outflow'
+        else:
+            yield 'outflow {:.4f} gpm'.format(demands[name])
+        yield ''
+
+def write(filename, segments, seed = 0):
+    '''Writes segments as a .pipey file named filename.'''
+    with open(filename, 'w') as f:
+        # The format has no trailing blank line after the last block
+        text = '\n'.join(lines(segments, seed))
+        f.write(text.rstrip('\n') + '\n')
@@ -0,0 +1,170 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Solve reports, counters and phase timings.
+
+Every solve returns a SolveReport describing how it went. A solve that
+fails raises ConvergenceWarning, which carries the same report.
+
+Counters and timings are only kept while a Recorder is active:
+
+    with instrument.Recorder() as recorder:
+        network.load('network.pipey')
+        report = network.solve(engine = 'gga')
+    recorder.counters['residuals'], recorder.timings['parse']
+
+Each hook in the solver checks a single module global first and returns
+straight away when nothing is recording, so they can stay in place in
+production code. Counters in use are residuals and jacobians
+(evaluations of the full system or an engine's reduced one), losses and
+loss_derivatives (evaluations over every segment) and friction_factors
+(the number of friction factors computed); phases timed are parse,
+setup, losses and linear_solve. hybr's own linear algebra happens
+inside MINPACK and isn't timed separately.
+'''
+
+import collections
+import time
+
+# The Recorder currently collecting counters and timings, if any
+active = None
+
+class Recorder:
+    '''Collects counters and per-phase wall time while in a with block.
+
+    Recorders nest; the innermost one collects. Counts made from several
+    threads at once (as in solve_split) go to the same Recorder and may
+    occasionally race.
+    '''
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timings = collections.defaultdict(float)
+        self._previous = None
+
+    def __enter__(self):
+        global active
+        self._previous = active
+        active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active = self._previous
+        return False
+
+    def snapshot(self):
+        '''Returns copies of (counters, timings) as they stand.'''
+        return collections.Counter(self.counters), dict(self.timings)
+
+def count(name, n = 1):
+    '''Adds n to counter name of the active Recorder, if there is one.'''
+    if active is not None:
+        active.counters[name] += n
+
+def start():
+    '''Returns start time for stop, or None if nothing is recording.'''
+    if active is not None:
+        return time.perf_counter()
+
+def stop(phase, started):
+    '''Adds time since started (from start) to phase of the active Recorder.'''
+    if started is not None and active is not None:
+        active.timings[phase] += time.perf_counter() - started
+
+class SolveReport:
+    '''Structured account of one solve.
+
+    engine is the name of the solver used and converged whether it
+    succeeded. iterations counts the solver's steps (for hybr, its
+    function evaluations), history holds (residual norm, step size)
+    for each step, and residual_norm is the final norm of the
+    residuals in feet and gpm. If a Recorder was active, counters and
+    timings hold what this solve added to it; seconds is always the
+    solve's total wall time.
+    '''
+    def __init__(self, engine, callback = None):
+        self.engine = engine
+        self.converged = False
+        self.iterations = 0
+        self.residual_norm = None
+        self.message = ''
+        self.history = list()
+        self.counters = dict()
+        self.timings = dict()
+        self.seconds = 0.
+        self.fallback = None
+        self.pieces = list()
+        self._callback = callback
+        self._started = time.perf_counter()
+        self._baseline = active.snapshot() if active is not None else None
+
+    def step(self, residual_norm, step_size):
+        '''Records one solver step and hands it to the callback.
+
+        The callback is called as callback(report, residual_norm,
+        step_size).
+        '''
+        self.iterations += 1
+        self.residual_norm = residual_norm
+        self.history.append((residual_norm, step_size))
+        if self._callback is not None:
+            self._callback(self, residual_norm, step_size)
+
+    def finish(self, converged, residual_norm = None, message = ''):
+        '''Fills in the outcome, elapsed time and recorded counters.'''
+        self.converged = converged
+        if residual_norm is not None:
+            self.residual_norm = residual_norm
+        self.message = message
+        self.seconds = time.perf_counter() - self._started
+        if self._baseline is not None and active is not None:
+            counters, timings = self._baseline
+            self.counters = dict(active.counters - counters)
+            self.timings = {phase: seconds - timings.get(phase, 0.)
+                            for phase, seconds in active.timings.items()
+                            if seconds - timings.get(phase, 0.) > 0}
+        return self
+
+    def combine(self, reports):
+        '''Finishes the report as the sum of reports of separate pieces.
+
+        The pieces are kept in self.pieces; iterations are summed and
+        the residual norm is that of all the pieces' residuals together.
+        '''
+        self.pieces = list(reports)
+        self.iterations = sum(r.iterations for r in reports)
+        norms = [r.residual_norm for r in reports
+                 if r.residual_norm is not None]
+        return self.finish(all(r.converged for r in reports),
+                           sum(n**2 for n in norms)**0.5 if norms else None)
+
+    def as_dict(self):
+        '''Returns the report as a dict of plain values, e.g. for JSON.'''
+        return {'engine': self.engine, 'converged': self.converged,
+                'iterations': self.iterations,
+                'residual_norm': self.residual_norm,
+                'message': self.message, 'fallback': self.fallback,
+                'history': [list(h) for h in self.history],
+                'counters': dict(self.counters),
+                'timings': dict(self.timings), 'seconds': self.seconds,
+                'pieces': [r.as_dict() for r in self.pieces]}
+
+class ConvergenceWarning(Warning):
+    '''Warning raised when a solve fails, carrying its SolveReport.'''
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
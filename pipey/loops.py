@@ -0,0 +1,146 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Spanning trees and independent loops of a CompiledNetwork.
+
+Nodes with known heads are treated as one root node, since their heads
+are all tied to the same datum. A breadth-first spanning tree is grown
+out from it over the segments; every segment left out of the tree (a
+chord) closes exactly one loop with the tree path between its ends. A
+loop whose path runs through the root joins two fixed-head nodes and
+is balanced by the difference in their heads rather than by zero.
+
+Flows that satisfy continuity are then any tree solution plus any
+combination of loop flows, so the only unknowns left are one corrective
+flow per loop.
+'''
+
+from collections import deque
+import numpy as np
+from scipy import sparse
+
+class LoopBasis:
+    '''Spanning tree and loop matrix of a CompiledNetwork's topology.
+
+    loops is the sparse (loop x segment) matrix holding +1 or -1 for
+    each segment around each loop, taking the direction of the loop's
+    chord as positive. Raises ValueError if some node with an unknown
+    head can't reach a node with a known head.
+    '''
+    def __init__(self, network):
+        n_nodes = network.n_nodes
+        root = n_nodes
+        fixed = np.ones(n_nodes, dtype=bool)
+        fixed[network.head_unknowns] = False
+        # Every fixed-head node is merged into the root
+        label = np.where(fixed, root, np.arange(n_nodes))
+        start = label[network.start]
+        end = label[network.end]
+
+        adjacent = [list() for _ in range(n_nodes + 1)]
+        for seg, (a, b) in enumerate(zip(start, end)):
+            if a != b:
+                adjacent[a].append(seg)
+                adjacent[b].append(seg)
+
+        # Breadth-first tree from the root; parent_seg[node] is the tree
+        # segment leading to node from the root side
+        self.parent_seg = np.full(n_nodes + 1, -1, dtype=np.intp)
+        depth = np.full(n_nodes + 1, -1, dtype=np.intp)
+        depth[root] = 0
+        in_tree = np.zeros(network.n_segs, dtype=bool)
+        order = [root]
+        queue = deque(order)
+        while queue:
+            node = queue.popleft()
+            for seg in adjacent[node]:
+                other = end[seg] if start[seg] == node else start[seg]
+                if depth[other] < 0:
+                    depth[other] = depth[node] + 1
+                    self.parent_seg[other] = seg
+                    in_tree[seg] = True
+                    order.append(other)
+                    queue.append(other)
+        if np.any(depth[network.head_unknowns] < 0):
+            raise ValueError('some nodes are not connected to a node with '
+                             'a known head')
+
+        self.order = np.array(order[1:], dtype=np.intp)
+        self.chords = np.flatnonzero(~in_tree)
+        self.start, self.end, self.depth = start, end, depth
+
+        rows, cols, signs = list(), list(), list()
+        for loop, chord in enumerate(self.chords):
+            # The chord runs start -> end, so the loop carries on from
+            # end back to start through the tree
+            for seg, sign in self._path(end[chord], start[chord]):
+                rows.append(loop)
+                cols.append(seg)
+                signs.append(sign)
+            rows.append(loop)
+            cols.append(chord)
+            signs.append(1.)
+        self.loops = sparse.csr_matrix(
+            (signs, (rows, cols)), shape = (len(self.chords), network.n_segs))
+
+    def _path(self, a, b):
+        '''Yields (segment, sign) along the tree path from node a to node b.
+
+        sign is +1 where the segment points along the path.
+        '''
+        start, end = self.start, self.end
+        tail = list()
+        while a != b:
+            if self.depth[a] >= self.depth[b]:
+                seg = self.parent_seg[a]
+                yield seg, (1. if start[seg] == a else -1.)
+                a = end[seg] if start[seg] == a else start[seg]
+            else:
+                seg = self.parent_seg[b]
+                tail.append((seg, 1. if end[seg] == b else -1.))
+                b = end[seg] if start[seg] == b else start[seg]
+        yield from reversed(tail)
+
+    def tree_flows(self, outflow):
+        '''Returns segment flows meeting every node's outflow, zero in chords.
+
+        outflow is the per-node outflow array; nodes with known heads are
+        ignored since the root takes up whatever is left.
+        '''
+        flow = np.zeros(len(self.start))
+        supplied = np.zeros(len(self.parent_seg))
+        supplied[:-1] = np.nan_to_num(outflow)
+        # Leaves first, so each node's demand includes everything beyond it
+        for node in self.order[::-1]:
+            seg = self.parent_seg[node]
+            flow[seg] = (supplied[node] if self.end[seg] == node
+                         else -supplied[node])
+            parent = self.start[seg] if self.end[seg] == node else self.end[seg]
+            supplied[parent] += supplied[node]
+        return flow
+
+    def tree_heads(self, network, head, loss):
+        '''Returns copy of head with unknown heads found down the tree.'''
+        head = head.copy()
+        start, end = network.start, network.end
+        for node in self.order:
+            seg = self.parent_seg[node]
+            if end[seg] == node:
+                head[node] = head[start[seg]] - loss[seg]
+            else:
+                head[node] = head[end[seg]] + loss[seg]
+        return head
@@ -0,0 +1,119 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Nominal pipe size and schedule lookups.
+
+The table in data/pipe_size.csv is read the first time it is needed and
+shared by every caller afterwards. All dimensions are in inches.
+'''
+
+import csv
+import os
+import numpy as np
+
+SIZE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'data', 'pipe_size.csv')
+
+_table = None
+
+def _parse_nps(text):
+    '''Returns nominal pipe size string such as "1-1/2" as a float.'''
+    whole, _, fraction = text.partition('-')
+    if '/' in whole:
+        whole, fraction = '0', whole
+    value = float(whole)
+    if fraction:
+        numerator, denominator = fraction.split('/')
+        value += float(numerator) / float(denominator)
+    return value
+
+class PipeSizeTable:
+    '''Outer diameter, wall thickness and inner diameter by NPS and schedule.
+
+    Rows are nominal pipe sizes and columns are schedules. Dimensions are
+    held in NumPy arrays, with NaN where a size isn't made in a schedule,
+    and two dicts map NPS and schedule names to row and column indices.
+    '''
+    def __init__(self, filename = SIZE_FILE):
+        with open(filename, 'r') as f:
+            csv_reader = csv.reader(f)
+            header = [i.strip() for i in next(csv_reader)]
+            rows = [[i.strip() for i in line] for line in csv_reader if line]
+
+        self.schedules = header[2:]
+        self.sizes = [row[0] for row in rows]
+        self.od = np.array([float(row[1]) for row in rows])
+        self.wall = np.array([[float(i) if i else np.nan for i in row[2:]]
+                              for row in rows])
+        self.inner = self.od[:, np.newaxis] - 2 * self.wall
+
+        self.schedule_index = {s: j for j, s in enumerate(self.schedules)}
+        self.size_index = {s: i for i, s in enumerate(self.sizes)}
+        # Allow sizes to be given as numbers of inches too
+        self.size_index.update({_parse_nps(s): i
+                                for i, s in enumerate(self.sizes)})
+
+    def _row(self, nps):
+        try:
+            if nps in self.size_index:
+                return self.size_index[nps]
+            return self.size_index[_parse_nps(str(nps))]
+        except (KeyError, ValueError):
+            raise KeyError('Unknown nominal pipe size: {}'.format(nps))
+
+    def _column(self, schedule):
+        try:
+            return self.schedule_index[str(schedule).strip()]
+        except KeyError:
+            raise KeyError('Unknown pipe schedule: {}'.format(schedule))
+
+    def lookup(self, nps, schedule):
+        '''Returns (outer diameter, wall thickness, inner diameter) in inches.'''
+        i, j = self._row(nps), self._column(schedule)
+        if np.isnan(self.wall[i, j]):
+            raise KeyError('NPS {} is not made in schedule {}'.format(
+                nps, schedule))
+        return float(self.od[i]), float(self.wall[i, j]), float(self.inner[i, j])
+
+    def lookup_many(self, nps, schedules):
+        '''Returns arrays of (outer diameter, wall, inner diameter) in inches.
+
+        nps and schedules are equal length sequences. Each distinct
+        name is only resolved once and the dimensions are gathered from
+        the table arrays in one indexing operation. Combinations that
+        aren't made come back as NaN.
+        '''
+        size_rows = {n: self._row(n) for n in set(nps)}
+        schedule_cols = {s: self._column(s) for s in set(schedules)}
+        i = np.array([size_rows[n] for n in nps], dtype=np.intp)
+        j = np.array([schedule_cols[s] for s in schedules], dtype=np.intp)
+        return self.od[i], self.wall[i, j], self.inner[i, j]
+
+def get_table():
+    '''Returns the shared PipeSizeTable, reading it on first use.'''
+    global _table
+    if _table is None:
+        _table = PipeSizeTable()
+    return _table
+
+def inner_diameter(nps, schedule):
+    '''Returns inner diameter in inches of nps pipe in schedule.'''
+    return get_table().lookup(nps, schedule)[2]
+
+def inner_diameters(nps, schedules):
+    '''Returns array of inner diameters in inches for many pipes at once.'''
+    return get_table().lookup_many(nps, schedules)[2]
@@ -0,0 +1,319 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Topological reduction of a CompiledNetwork before solving.
+
+Two things are taken out of the nonlinear system:
+
+- Tree branches. A dead-end node with an unknown head has exactly one
+  segment, whose flow must equal the node's outflow plus everything
+  beyond it. Such nodes are peeled off one at a time until only loops
+  and reservoirs are left, and their heads are found afterwards by
+  walking back out from the remaining network.
+- Series chains. A node with an unknown head and exactly two segments
+  just passes flow along, less its own outflow. Every run of such nodes
+  is collapsed into a single chain whose loss is the sum of its
+  members' losses.
+
+What is left, the looped core, is an ordinary CompiledNetwork whose
+segments are chains, so it can be solved (or split) like any other.
+'''
+
+import numpy as np
+from scipy import sparse
+from . import compiled
+from . import engines
+from . import instrument
+
+class ChainGroup:
+    '''Losses of core segments that each stand for a chain of segments.
+
+    Member segment i carries flow sign[i] * q[chain[i]] + offset[i],
+    where q is the flow through the chain, and the chain's loss is the
+    sum of sign[i] times each member's loss. members is a CompiledNetwork
+    holding only the member segments, in the same order as the arrays.
+    '''
+    def __init__(self, members, chain, sign, offset, n_chains):
+        self.members = members
+        self.segment_index = np.arange(n_chains)
+        self.has_derivative = members.has_derivatives
+        self.chain = chain
+        self.offset = offset
+        self.sign = sign
+        # Maps chain flows to member flows; its transpose sums member
+        # losses back onto the chains
+        self.spread = sparse.csr_matrix(
+            (sign, (np.arange(len(chain)), chain)),
+            shape = (len(chain), n_chains))
+
+    def loss(self, flow, density, viscosity):
+        member_flow = self.spread @ flow + self.offset
+        return self.spread.T @ self.members.losses(member_flow)
+
+    def derivative(self, flow, density, viscosity):
+        member_flow = self.spread @ flow + self.offset
+        # sign squared is one, so the chain derivative is a plain sum
+        return abs(self.spread.T) @ self.members.loss_derivatives(member_flow)
+
+    def subset(self, rows, segment_index):
+        '''Returns ChainGroup of only chains rows, renumbered in order.'''
+        chain_map = np.full(len(self.segment_index), -1, dtype=np.intp)
+        chain_map[rows] = segment_index
+        keep = np.flatnonzero(chain_map[self.chain] >= 0)
+        members, _ = self.members.subnetwork(keep)
+        return ChainGroup(members, chain_map[self.chain[keep]],
+                          self.sign[keep], self.offset[keep], len(rows))
+
+class ReducedNetwork:
+    '''CompiledNetwork with its tree branches and series chains removed.
+
+    core is the CompiledNetwork left to solve. solve solves it and then
+    expands the result back onto every segment and node of network,
+    storing it there as CompiledNetwork.solve would.
+    '''
+    def __init__(self, network):
+        started = instrument.start()
+        self.network = network
+        n_segs = network.n_segs
+        unknown_flow = np.zeros(n_segs, dtype=bool)
+        unknown_flow[network.flow_unknowns] = True
+        unknown_head = np.zeros(network.n_nodes, dtype=bool)
+        unknown_head[network.head_unknowns] = True
+        # Only nodes with both a continuity equation and an unknown head
+        # can be removed, and only through segments with unknown flow
+        self._free = network.continuity & unknown_head
+        self._unknown_flow = unknown_flow
+
+        ends = np.concatenate((network.start, network.end))
+        order = np.argsort(ends, kind = 'stable')
+        self._node_segs = np.split(order % n_segs,
+                                   np.cumsum(np.bincount(
+                                       ends, minlength = network.n_nodes))[:-1])
+        self._removed = np.zeros(n_segs, dtype=bool)
+        self._degree = np.array([len(s) for s in self._node_segs])
+        self._outflow = np.where(network.continuity, network.outflow, 0.)
+
+        self._prune()
+        self._chain()
+        self._build_core()
+        instrument.stop('setup', started)
+
+    def _remaining(self, node):
+        '''Returns segments at node that haven't been removed.'''
+        segs = self._node_segs[node]
+        return segs[~self._removed[segs]]
+
+    def _other(self, seg, node):
+        net = self.network
+        return net.end[seg] if net.start[seg] == node else net.start[seg]
+
+    def _prune(self):
+        '''Peels tree branches off, fixing their flows from continuity.
+
+        Records in self.tree the (node, segment, parent) triples in the
+        order they were removed, so heads can be found in reverse.
+        '''
+        net = self.network
+        self.tree_flow = dict()
+        self.tree = list()
+        leaves = [n for n in np.flatnonzero(self._free & (self._degree == 1))]
+        while leaves:
+            node = leaves.pop()
+            segs = self._remaining(node)
+            if len(segs) != 1 or not self._unknown_flow[segs[0]]:
+                continue
+            seg = segs[0]
+            parent = self._other(seg, node)
+            if parent == node:
+                continue
+            demand = self._outflow[node]
+            self.tree_flow[seg] = demand if net.end[seg] == node else -demand
+            self._outflow[parent] += demand
+            self._removed[seg] = True
+            self._degree[node] -= 1
+            self._degree[parent] -= 1
+            self.tree.append((node, seg, parent))
+            if self._free[parent] and self._degree[parent] == 1:
+                leaves.append(parent)
+
+    def _interior(self, node):
+        '''Returns True if node only passes flow between two segments.'''
+        if not self._free[node] or self._degree[node] != 2:
+            return False
+        return bool(self._unknown_flow[self._remaining(node)].all())
+
+    def _chain(self):
+        '''Groups the remaining segments into series chains.
+
+        Fills member arrays (segment, chain, sign, offset), the start and
+        end node of every chain, and the interior nodes passed along the
+        way so their heads can be filled in after solving.
+        '''
+        net = self.network
+        assigned = np.zeros(net.n_segs, dtype=bool)
+        members, chains, signs, offsets = [], [], [], []
+        self.chain_start, self.chain_end = [], []
+        self.interior = []   # (node, member position just before it)
+
+        for first in np.flatnonzero(~self._removed):
+            if assigned[first]:
+                continue
+            # Walk backwards to the start of the chain, or all the way
+            # around if the chain is a closed ring
+            seg, node = first, net.start[first]
+            while self._interior(node):
+                a, b = self._remaining(node)
+                prev = b if a == seg else a
+                if prev == first:
+                    break
+                seg, node = prev, self._other(prev, node)
+
+            chain = len(self.chain_start)
+            self.chain_start.append(node)
+            offset = 0.
+            while True:
+                assigned[seg] = True
+                sign = 1. if net.start[seg] == node else -1.
+                members.append(seg)
+                chains.append(chain)
+                signs.append(sign)
+                offsets.append(offset)
+                node = self._other(seg, node)
+                if not self._interior(node):
+                    break
+                a, b = self._remaining(node)
+                seg = b if a == seg else a
+                if assigned[seg]:
+                    break
+                self.interior.append((node, len(members) - 1))
+                offset -= self._outflow[node]
+            self.chain_end.append(node)
+
+        self.members = np.array(members, dtype=np.intp)
+        self.chain = np.array(chains, dtype=np.intp)
+        self.sign = np.array(signs)
+        self.offset = np.array(offsets)
+
+    def _build_core(self):
+        '''Builds self.core from the chains and the nodes at their ends.'''
+        net = self.network
+        n_chains = len(self.chain_start)
+        if not n_chains:
+            # Nothing but tree branches hanging off reservoirs
+            self.core = None
+            self.core_nodes = np.array([], dtype=np.intp)
+            self.n_removed = net.n_unknowns
+            return
+        chain_start = np.array(self.chain_start, dtype=np.intp)
+        chain_end = np.array(self.chain_end, dtype=np.intp)
+        nodes = np.unique(np.concatenate((chain_start, chain_end)))
+        node_map = np.full(net.n_nodes, -1, dtype=np.intp)
+        node_map[nodes] = np.arange(len(nodes))
+
+        # Flow leaving a chain's last member is the chain flow plus the
+        # member's offset, so the end node sees that much less demand
+        last = np.r_[np.flatnonzero(np.diff(self.chain)), len(self.chain) - 1]
+        outflow = self._outflow.copy()
+        np.subtract.at(outflow, chain_end, self.offset[last])
+
+        first = np.r_[0, np.flatnonzero(np.diff(self.chain)) + 1]
+        first_segs = self.members[first]
+        chain_unknown = self._unknown_flow[first_segs]
+        head_unknowns = node_map[net.head_unknowns]
+        arrays = {
+            'segment_names': [net.segment_names[i] for i in first_segs],
+            'node_names': [net.node_names[i] for i in nodes],
+            'start': node_map[chain_start],
+            'end': node_map[chain_end],
+            'flow': net.flow[first_segs] * self.sign[first],
+            'head': net.head[nodes],
+            'continuity': net.continuity[nodes],
+            'outflow': outflow[nodes],
+            'flow_unknowns': np.flatnonzero(chain_unknown),
+            'head_unknowns': head_unknowns[head_unknowns >= 0],
+            'density': net.density[first_segs],
+            'viscosity': net.viscosity[first_segs]}
+
+        member_net, _ = net.subnetwork(self.members)
+        group = ChainGroup(member_net, self.chain, self.sign,
+                           self.sign * self.offset, n_chains)
+        self.core = compiled.CompiledNetwork.from_arrays(arrays, [group])
+        self.core_nodes = nodes
+        self.n_removed = net.n_unknowns - self.core.n_unknowns
+
+    def expand(self):
+        '''Returns full (flow, head) arrays from the current core solution.'''
+        net = self.network
+        core = self.core
+        flow = net.flow.copy()
+        head = net.head.copy()
+        for seg, value in self.tree_flow.items():
+            flow[seg] = value
+        if core is None:
+            loss = net.losses(flow)
+            return self._tree_heads(flow, head, loss)
+
+        head[self.core_nodes] = core.head
+        flow[self.members] = self.sign * (core.flow[self.chain]
+                                          + self.offset)
+        loss = net.losses(flow)
+        # Heads fall by each member's loss along the chain direction
+        drop = np.cumsum(self.sign * loss[self.members])
+        first = np.r_[0, np.flatnonzero(np.diff(self.chain)) + 1]
+        before = np.repeat(drop[first] - self.sign[first]
+                           * loss[self.members[first]],
+                           np.diff(np.r_[first, len(self.chain)]))
+        chain_head = np.array(self.chain_start, dtype=np.intp)[self.chain]
+        for node, position in self.interior:
+            head[node] = (head[chain_head[position]]
+                          - (drop[position] - before[position]))
+        return self._tree_heads(flow, head, loss)
+
+    def _tree_heads(self, flow, head, loss):
+        '''Returns (flow, head) with heads filled in along tree branches.'''
+        net = self.network
+        for node, seg, parent in reversed(self.tree):
+            if net.end[seg] == node:
+                head[node] = head[parent] - loss[seg]
+            else:
+                head[node] = head[parent] + loss[seg]
+        return flow, head
+
+    def solve(self, split = False, max_workers = None, engine = None,
+              callback = None):
+        '''Solves the core and stores the expanded result in network.
+
+        The core is solved with engine (by default the one
+        engines.default_engine picks for network) and callback, and
+        with solve_split if split is True. Returns the core's
+        instrument.SolveReport, or an empty one if there was nothing
+        left to solve.
+        '''
+        if engine is None:
+            engine = engines.default_engine(self.network)
+        if self.core is not None and self.core.n_unknowns:
+            if split:
+                report = self.core.solve_split(max_workers, engine = engine,
+                                               callback = callback)
+            else:
+                report = self.core.solve(engine, callback)
+        else:
+            report = instrument.SolveReport(engine).finish(True, 0.)
+        net = self.network
+        net.flow, net.head = self.expand()
+        net.store(net.initial_guess())
+        return report
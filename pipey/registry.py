@@ -0,0 +1,138 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Registry of the element types that can be named in input files.
+
+The built-in elements are those listed in element_classes.ELEMENTS.
+Other packages add their own either by calling register, or without
+any code running, through an entry point in the ENTRY_POINT_GROUP
+group, named like the element and pointing at its class:
+
+    entry_points = {'pipey.elements': ['Strainer = mypkg:Strainer']}
+
+Entry points are only looked at the first time a name isn't already
+known, and each is imported only when its element is first used.
+
+An element class is built from the tokens after its name and needs
+calculate_loss(flow), or else the batch protocol described in
+element_classes.BatchElement, which also puts it on the compiled fast
+path. Subclassing BatchElement gives calculate_loss (and
+calculate_derivative, with batch_derivative) for free. A class may also
+have classmethod build_many(attribute_lists), returning one element per
+list of tokens, which build_many uses to build many at once.
+'''
+
+import collections
+from . import element_classes
+
+ENTRY_POINT_GROUP = 'pipey.elements'
+
+_registered = dict()
+# Entry points by name, read on the first unknown name
+_entry_points = None
+
+def register(name, element_class = None):
+    '''Registers element_class to be built for lines starting with name.
+
+    Can be used as a class decorator, as @register('Strainer'). A name
+    registered this way takes precedence over built-in elements and
+    entry points. Raises TypeError if element_class has neither
+    calculate_loss nor batch_loss.
+    '''
+    if element_class is None:
+        return lambda element_class: register(name, element_class)
+    if not (hasattr(element_class, 'calculate_loss')
+            or hasattr(element_class, 'batch_loss')):
+        raise TypeError('{} has neither calculate_loss nor batch_loss'.format(
+            element_class.__name__))
+    _registered[name] = element_class
+    return element_class
+
+def unregister(name):
+    '''Removes name added by register; KeyError if it wasn't.'''
+    del _registered[name]
+
+def element_class(name):
+    '''Returns the element class named name; KeyError if there isn't one.'''
+    if name in _registered:
+        return _registered[name]
+    if name in element_classes.ELEMENTS:
+        return getattr(element_classes, name)
+    entry_point = _find_entry_points().get(name)
+    if entry_point is None:
+        raise KeyError('Unknown element: {}'.format(name))
+    return register(name, entry_point.load())
+
+def name_of(element_class):
+    '''Returns name element_class is built under; KeyError if it has none.'''
+    for name, registered in _registered.items():
+        if registered is element_class:
+            return name
+    name = element_class.__name__
+    if (name in element_classes.ELEMENTS
+            and getattr(element_classes, name) is element_class):
+        return name
+    raise KeyError('{} is not a registered element'.format(
+        element_class.__name__))
+
+def names():
+    '''Returns sorted list of every element name that can be used.'''
+    return sorted(set(_registered) | set(element_classes.ELEMENTS)
+                  | set(_find_entry_points()))
+
+def _find_entry_points():
+    global _entry_points
+    if _entry_points is None:
+        from importlib import metadata
+        found = metadata.entry_points()
+        if hasattr(found, 'select'):
+            found = found.select(group = ENTRY_POINT_GROUP)
+        else: # Python 3.9 and older return a dict of groups
+            found = found.get(ENTRY_POINT_GROUP, ())
+        _entry_points = {entry_point.name: entry_point
+                         for entry_point in found}
+    return _entry_points
+
+def build(attributes):
+    '''Returns element built from an input line's tokens.
+
+    attributes[0] names the element and the rest are its parameters.
+    '''
+    return element_class(attributes[0])(attributes[1:])
+
+def build_many(attribute_lists):
+    '''Returns list of elements built from many input lines' tokens.
+
+    Lines naming a class with a build_many classmethod are built by it
+    all together, so that table lookups are shared between them; the
+    rest are built one at a time. The elements are in the same order as
+    attribute_lists.
+    '''
+    rows = collections.defaultdict(list)
+    for i, attributes in enumerate(attribute_lists):
+        rows[attributes[0]].append(i)
+    elements = [None] * len(attribute_lists)
+    for name, indices in rows.items():
+        cls = element_class(name)
+        tokens = [attribute_lists[i][1:] for i in indices]
+        if hasattr(cls, 'build_many'):
+            built = cls.build_many(tokens)
+        else:
+            built = [cls(attributes) for attributes in tokens]
+        for i, element in zip(indices, built):
+            elements[i] = element
+    return elements
@@ -0,0 +1,415 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Struct-of-arrays storage behind core.Network(compact = True).
+
+A NetworkStore keeps every segment's start, end and flow and every
+node's head and outflow in flat typed arrays, one column per attribute,
+instead of a PipeSegment or Node object per row. Flows are held in gpm
+and heads in feet, with NaN standing for None. Elements
+whose class provides both batch_parameters and from_batch_parameters
+are kept as rows of an ElementTable of plain floats; any other element
+is kept as it is.
+
+The usual attribute API keeps working through SegmentView and NodeView,
+which are PipeSegment and Node subclasses that read and write the
+arrays. A row's view is made the first time it is asked for and kept
+from then on, so every row is always seen through the same object.
+Views differ from ordinary objects in a few ways:
+
+    * inputs, outputs and elements are new lists each time, worked out
+      from the arrays; change them by setting start and end or by
+      add_ele and set_element, not by editing the lists.
+    * Elements from an ElementTable are rebuilt from their parameters
+      on every access, in SI units.
+    * Values are converted to gpm or feet when set, so a node's head
+      has to be given in units of length.
+'''
+
+import array
+import collections.abc
+import numpy as np
+from . import core
+from . import ureg
+
+class ElementTable:
+    '''Every element of one class that was added to a NetworkStore.
+
+    If the class provides batch_parameters and from_batch_parameters,
+    only the parameters are kept, as rows of a flat array; otherwise the
+    element objects themselves are kept.
+    '''
+    def __init__(self, element_class):
+        self.element_class = element_class
+        self.tabled = (hasattr(element_class, 'batch_parameters')
+                       and hasattr(element_class, 'from_batch_parameters'))
+        self.values = array.array('d') if self.tabled else list()
+        self.width = None
+        self.n_rows = 0
+
+    def add(self, element):
+        '''Adds element and returns its row.'''
+        if self.tabled:
+            params = element.batch_parameters()
+            if self.width is None:
+                self.width = len(params)
+            self.values.extend(params)
+        else:
+            self.values.append(element)
+        self.n_rows += 1
+        return self.n_rows - 1
+
+    def get(self, row, fluid):
+        '''Returns the element in row, with its fluid set to fluid.'''
+        if not self.tabled:
+            return self.values[row]
+        start = row * self.width
+        element = self.element_class.from_batch_parameters(
+            self.values[start:start + self.width])
+        element.fluid = fluid
+        return element
+
+    def set(self, row, element):
+        '''Replaces the element in row with element.'''
+        if self.tabled:
+            self.values[row * self.width:(row + 1) * self.width] = array.array(
+                'd', element.batch_parameters())
+        else:
+            self.values[row] = element
+
+    def parameters(self):
+        '''Returns (rows x parameters) array of a tabled class.'''
+        return np.frombuffer(self.values, dtype=float).reshape(
+            self.n_rows, self.width).copy()
+
+class TableRows(collections.abc.Sequence):
+    '''Sequence of elements in rows of an ElementTable, rebuilt on access.
+
+    compiled.BatchGroup holds one of these in place of element objects,
+    so that update_segment sees changes made through set_element.
+    '''
+    def __init__(self, table, fluid, rows):
+        self.table = table
+        self.fluid = fluid
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.table.get(self.rows[i], self.fluid)
+
+class SegmentView(core.PipeSegment):
+    '''PipeSegment whose values live in row index of a NetworkStore.'''
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def flow(self):
+        value = self._store.seg_flow[self._index]
+        return None if value != value else value * self._store.flow_units
+
+    @flow.setter
+    def flow(self, value):
+        self._store.seg_flow[self._index] = _magnitude(value, ureg.gpm)
+
+    @property
+    def start(self):
+        return self._store.node_view(self._store.seg_start[self._index])
+
+    @start.setter
+    def start(self, node):
+        self._store.connect(self._store.seg_start, self._index, node)
+
+    @property
+    def end(self):
+        return self._store.node_view(self._store.seg_end[self._index])
+
+    @end.setter
+    def end(self, node):
+        self._store.connect(self._store.seg_end, self._index, node)
+
+    @property
+    def fluid(self):
+        return self._store.fluid
+
+    @property
+    def elements(self):
+        return self._store.segment_elements(self._index)
+
+    def set_val(self, new_flow):
+        '''Sets flow to new_flow in gpm.'''
+        self._store.seg_flow[self._index] = new_flow
+
+    def add_element(self, element):
+        '''Adds element that has already been built.'''
+        self._store.add_element(self._index, element)
+
+    def set_element(self, index, element):
+        '''Replaces element index of the segment with element.'''
+        self._store.set_element(self._index, index, element)
+
+    def _fold(self):
+        '''Returns (folded loss coefficient or None, other elements).
+
+        The elements list is new every time, so the fold is kept until
+        the store's elements change instead.
+        '''
+        folded = getattr(self, '_folded', None)
+        if folded is None or folded[0] != self._store.element_version:
+            folded = self._folded = ((self._store.element_version,)
+                                     + core._fold_elements(self.elements))
+        return folded[1:]
+
+class NodeView(core.Node):
+    '''Node whose values live in row index of a NetworkStore.'''
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def head(self):
+        value = self._store.node_head[self._index]
+        return None if value != value else value * ureg.feet
+
+    @head.setter
+    def head(self, value):
+        self._store.node_head[self._index] = _magnitude(value, ureg.feet)
+
+    @property
+    def outflow(self):
+        value = self._store.node_outflow[self._index]
+        return None if value != value else value * self._store.flow_units
+
+    @outflow.setter
+    def outflow(self, value):
+        self._store.node_outflow[self._index] = _magnitude(value, ureg.gpm)
+
+    @property
+    def inputs(self):
+        return self._store.node_segments(self._index, self._store.seg_end)
+
+    @property
+    def outputs(self):
+        return self._store.node_segments(self._index, self._store.seg_start)
+
+    def set_val(self, new_head):
+        '''Sets head to new_head in feet.'''
+        self._store.node_head[self._index] = new_head
+
+def _magnitude(value, units):
+    '''Returns magnitude of value in units, or NaN for None.'''
+    if value is None:
+        return np.nan
+    return core._magnitude(value, units)
+
+class ViewMap(collections.abc.Mapping):
+    '''Read-only mapping of names to the views of a NetworkStore.
+
+    Network.segments and Network.nodes are ViewMaps in a compact
+    Network; rows are added through NetworkStore.add_segment and
+    add_node instead of by assignment.
+    '''
+    def __init__(self, index, view):
+        self._index = index
+        self._view = view
+
+    def __getitem__(self, name):
+        return self._view(self._index[name])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+class ViewList(collections.abc.Sequence):
+    '''Sequence of every view of one kind, by row.'''
+    def __init__(self, view, length):
+        self._view = view
+        self._length = length
+
+    def __getitem__(self, i):
+        if i < 0 or i >= self._length:
+            raise IndexError(i)
+        return self._view(i)
+
+    def __len__(self):
+        return self._length
+
+class NetworkStore:
+    '''Columns of segment, node and element values of a compact Network.
+
+    fluid is the Fluid every segment and element is given.
+    '''
+    def __init__(self, fluid):
+        self.fluid = fluid
+        # The units set_val gives flows in
+        self.flow_units = ureg.gallons / ureg.minutes
+        self.segment_index = dict()
+        self.node_index = dict()
+        self.seg_start = array.array('q')
+        self.seg_end = array.array('q')
+        self.seg_flow = array.array('d')
+        self.node_head = array.array('d')
+        self.node_outflow = array.array('d')
+        # One entry per element, in the order they were added
+        self.element_segment = array.array('q')
+        self.element_kind = array.array('q')
+        self.element_row = array.array('q')
+        self.tables = list()
+        # Changes whenever an element is added, replaced or removed
+        self.element_version = 0
+        self._kinds = dict()
+        self._segment_views = list()
+        self._node_views = list()
+        # Row lookups by node and by segment, rebuilt after changes
+        self._lookups = dict()
+        self.segments = ViewMap(self.segment_index, self.segment_view)
+        self.nodes = ViewMap(self.node_index, self.node_view)
+
+    def add_segment(self, name):
+        '''Returns view of a new segment called name, replacing any old one.'''
+        if name in self.segment_index:
+            i = self.segment_index[name]
+            self.seg_start[i] = self.seg_end[i] = -1
+            self.seg_flow[i] = np.nan
+            self._remove_elements(i)
+        else:
+            i = self.segment_index[name] = len(self.seg_flow)
+            self.seg_start.append(-1)
+            self.seg_end.append(-1)
+            self.seg_flow.append(np.nan)
+            self._segment_views.append(None)
+        self._lookups.clear()
+        return self.segment_view(i)
+
+    def add_node(self, name):
+        '''Returns view of node name, adding it if it doesn't exist.'''
+        if name not in self.node_index:
+            self.node_index[name] = len(self.node_head)
+            self.node_head.append(np.nan)
+            self.node_outflow.append(0.)
+            self._node_views.append(None)
+        return self.node_view(self.node_index[name])
+
+    def segment_view(self, i):
+        '''Returns the SegmentView of row i.'''
+        view = self._segment_views[i]
+        if view is None:
+            view = self._segment_views[i] = SegmentView(self, i)
+        return view
+
+    def node_view(self, i):
+        '''Returns the NodeView of row i, or None if i is -1.'''
+        if i < 0:
+            return None
+        view = self._node_views[i]
+        if view is None:
+            view = self._node_views[i] = NodeView(self, i)
+        return view
+
+    def connect(self, column, i, node):
+        '''Sets column (seg_start or seg_end) of segment i to node.'''
+        if node is not None and getattr(node, '_store', None) is not self:
+            raise ValueError('segments of a compact network can only join '
+                             'its own nodes')
+        column[i] = -1 if node is None else node._index
+        self._lookups.clear()
+
+    def add_element(self, i, element):
+        '''Adds element to the end of segment i.'''
+        kind = self._kinds.get(type(element))
+        if kind is None:
+            kind = self._kinds[type(element)] = len(self.tables)
+            self.tables.append(ElementTable(type(element)))
+        element.fluid = self.fluid
+        self.element_row.append(self.tables[kind].add(element))
+        self.element_segment.append(i)
+        self.element_kind.append(kind)
+        self.element_version += 1
+        self._lookups.clear()
+
+    def segment_elements(self, i):
+        '''Returns list of the elements of segment i.'''
+        return [self.tables[self.element_kind[e]].get(self.element_row[e],
+                                                      self.fluid)
+                for e in self._rows('elements', self.element_segment, i)]
+
+    def set_element(self, i, index, element):
+        '''Replaces element index of segment i with element.
+
+        element must be of the same class as the one it replaces.
+        '''
+        e = self._rows('elements', self.element_segment, i)[index]
+        table = self.tables[self.element_kind[e]]
+        if type(element) is not table.element_class:
+            raise TypeError('an element can only be replaced by one of the '
+                            'same class')
+        element.fluid = self.fluid
+        table.set(self.element_row[e], element)
+        self.element_version += 1
+
+    def _remove_elements(self, i):
+        '''Detaches every element from segment i.'''
+        for e in self._rows('elements', self.element_segment, i):
+            self.element_segment[e] = -1
+        self.element_version += 1
+
+    def node_segments(self, i, column):
+        '''Returns list of views of segments whose column holds node i.'''
+        key = 'inputs' if column is self.seg_end else 'outputs'
+        return [self.segment_view(s) for s in self._rows(key, column, i)]
+
+    def _rows(self, key, column, i):
+        '''Returns positions in column that hold i, in order.
+
+        The lookup is a sort of column, kept under key until something
+        changes.
+        '''
+        lookup = self._lookups.get(key)
+        if lookup is None:
+            values = np.array(column, dtype=np.int64)
+            order = np.argsort(values, kind = 'stable')
+            lookup = self._lookups[key] = (values[order], order)
+        values, order = lookup
+        return order[np.searchsorted(values, i, 'left'):
+                     np.searchsorted(values, i, 'right')].tolist()
+
+    def columns(self):
+        '''Returns dict of NumPy copies of every column.'''
+        as_array = lambda column, dtype: np.array(column, dtype=dtype)
+        return {'start': as_array(self.seg_start, np.intp),
+                'end': as_array(self.seg_end, np.intp),
+                'flow': as_array(self.seg_flow, float),
+                'head': as_array(self.node_head, float),
+                'outflow': as_array(self.node_outflow, float),
+                'element_segment': as_array(self.element_segment, np.intp),
+                'element_kind': as_array(self.element_kind, np.intp)}
+
+    def segment_list(self):
+        '''Returns ViewList of every segment's view, by row.'''
+        return ViewList(self.segment_view, len(self.seg_flow))
+
+    def node_list(self):
+        '''Returns ViewList of every node's view, by row.'''
+        return ViewList(self.node_view, len(self.node_head))
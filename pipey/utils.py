@@ -17,25 +17,236 @@
 # You should have received a copy of the GNU General Public License along
 # with Pipey.  If not, see <http://www.gnu.org/licenses/>.
 
-from math import sqrt, log
-from scipy import optimize
-import pint
+import functools
+import numpy as np
+from . import instrument
 from . import ureg
 
+# Reynolds number below which flow is treated as laminar
+LAMINAR_LIMIT = 2000
+# Reynolds number above which flow is treated as fully turbulent; in
+# between, friction factors are blended from one regime to the other
+TURBULENT_LIMIT = 4000
+
+# Number of Newton refinements applied to the Swamee-Jain estimate. Two
+# are already accurate to about 1e-10 over the whole Moody diagram.
+NEWTON_STEPS = 3
+
+class FormattingError(ValueError):
+    '''Raised when a line of a .pipey file can't be understood.
+
+    The 1-based line number is kept in the line_number attribute.
+    '''
+    def __init__(self, line_number, message):
+        self.line_number = line_number
+        super().__init__('line {}: {}'.format(line_number, message))
+
+# Properties that aren't elements and the number of tokens after them
+SEGMENT_PROPERTIES = {'start': 1, 'end': 1}
+NODE_PROPERTIES = {'head': 2, 'outflow': 2, 'inflow': 2, 'unknown': 1}
+
+def read_lines(f):
+    '''Yields each line of file object f as a list of tokens.'''
+    for line in f:
+        yield line.strip().split(sep=' ')
+
+# Largest error, in feet or gpm, at which a solve counts as converged even
+# if MINPACK reports that it stopped making progress. Warm starts often
+# land on the root before hybrd's step-size test is satisfied.
+RESIDUAL_TOLERANCE = 1e-6
+
+def converged(errors):
+    '''Returns True if every error in feet or gpm is within RESIDUAL_TOLERANCE.'''
+    return bool(np.all(np.abs(errors) <= RESIDUAL_TOLERANCE))
+
 def check_formatting(list_input):
-    pass
+    '''Yields each line of list_input after checking it follows the rules.
+
+    list_input is any iterable of token lists, such as read_lines(f).
+    Lines are checked one at a time as they are consumed, so a file can
+    be validated and parsed in a single pass without holding it in
+    memory. A FormattingError with the line number is raised for the
+    first bad line.
+    '''
+    block = None
+    for line_number, line_args in enumerate(list_input, 1):
+        keyword = line_args[0]
+        if not keyword:
+            block = None
+        elif keyword in ('segment', 'node'):
+            if len(line_args) != 2:
+                raise FormattingError(line_number,
+                                      '{} needs exactly one name'.format(keyword))
+            block = keyword
+        elif keyword == 'fluid':
+            block = keyword
+        elif block is None:
+            raise FormattingError(line_number,
+                                  '"{}" is outside of a segment, node or '
+                                  'fluid block'.format(keyword))
+        elif block == 'segment':
+            if keyword in SEGMENT_PROPERTIES:
+                _check_length(line_number, line_args,
+                              SEGMENT_PROPERTIES[keyword])
+            elif not keyword[0].isupper():
+                raise FormattingError(line_number,
+                                      'unknown segment property "{}"'.format(
+                                          keyword))
+        elif block == 'node':
+            if keyword not in NODE_PROPERTIES:
+                raise FormattingError(line_number,
+                                      'unknown node property "{}"'.format(
+                                          keyword))
+            _check_length(line_number, line_args, NODE_PROPERTIES[keyword])
+            if keyword == 'unknown' and line_args[1] != 'outflow':
+                raise FormattingError(line_number,
+                                      'only outflow may be unknown')
+            elif keyword != 'unknown':
+                _check_number(line_number, line_args[1])
+        yield line_args
+
+def _check_length(line_number, line_args, n_values):
+    if len(line_args) != n_values + 1:
+        raise FormattingError(line_number,
+                              '"{}" takes {} value(s)'.format(line_args[0],
+                                                              n_values))
+
+def _check_number(line_number, token):
+    try:
+        float(token)
+    except ValueError:
+        raise FormattingError(line_number,
+                              '"{}" is not a number'.format(token))
+
+@functools.lru_cache(maxsize = None)
+def parse_units(text):
+    '''Returns pint Unit for text, parsing each distinct string only once.'''
+    return ureg.parse_units(text)
 
 def colebrook(relative_roughness, reynolds):
     '''Returns colebrook approximation of friction factor'''
-    colebrook_zero = lambda f: 1 / sqrt(abs(f[0])) +
-                               2.0 * log(relative_roughness / 3.7 +
-                                         2.51 / reynolds / sqrt(abs(f[0])), 10)
+    instrument.count('friction_factors')
+    return float(colebrook_array(relative_roughness, reynolds))
 
-    f_result = optimize.root(colebrook_zero, [0.040], tol = 0.00001)
-    if f_result.success:
-        return abs(f_result.x[0])
-    else:
-        raise optimize.OptimizeWarning(f_result.message)
+def colebrook_array(relative_roughness, reynolds, derivative = False):
+    '''Returns colebrook friction factors for arrays of inputs.
+
+    relative_roughness and reynolds may be scalars or NumPy arrays of any
+    broadcastable shapes. The Swamee-Jain explicit approximation is used
+    as a starting point and refined with NEWTON_STEPS vectorized Newton
+    steps on the colebrook equation written in x = 1/sqrt(f):
+
+        x + 2 log10(relative_roughness/3.7 + 2.51 x/reynolds) = 0
+
+    If derivative is True, a tuple of (friction factor, d(friction
+    factor)/d(reynolds)) is returned instead.
+    '''
+    rr = np.asarray(relative_roughness, dtype=float)
+    re = np.asarray(reynolds, dtype=float)
+
+    x = -2.0 * np.log10(rr / 3.7 + 5.74 / re**0.9) # Swamee-Jain
+    for i in range(NEWTON_STEPS):
+        inner = rr / 3.7 + 2.51 * x / re
+        g = x + 2.0 * np.log10(inner)
+        dg_dx = 1.0 + 2.0 / np.log(10) * 2.51 / re / inner
+        x = x - g / dg_dx
+    f = 1.0 / x**2
+
+    if not derivative:
+        return f
+    # Implicit differentiation of g(x, reynolds) = 0
+    inner = rr / 3.7 + 2.51 * x / re
+    dg_dx = 1.0 + 2.0 / np.log(10) * 2.51 / re / inner
+    dg_dre = -2.0 / np.log(10) * 2.51 * x / re**2 / inner
+    df_dre = 2.0 / x**3 * dg_dre / dg_dx
+    return f, df_dre
+
+def laminar_ff(reynolds):
+    '''Returns laminar friction factor.'''
+    return np.asarray(reynolds, dtype=float) / 64
+
+def friction_factor(*args):
+    '''Returns friction factor for friction_factor([relative_roughness,] reynolds).
+
+    Laminar flow doesn't depend on relative roughness, so it may be
+    omitted, in which case a smooth pipe is assumed.
+    '''
+    relative_roughness = args[0] if len(args) > 1 else 0.0
+    return float(friction_factors(relative_roughness, args[-1]))
+
+def friction_factors(relative_roughness, reynolds, derivative = False):
+    '''Returns friction factors for arrays of relative roughness and reynolds.
+
+    Uses laminar_ff below LAMINAR_LIMIT and colebrook_array above
+    TURBULENT_LIMIT, blended by transition_blend in between, so that
+    every pipe in a network can be handled in one call regardless of its
+    flow regime. Reynolds numbers are treated by magnitude, so reversed
+    flows give the same friction factor as forward flows.
+
+    If derivative is True, a tuple of (friction factor, d(friction
+    factor)/d|reynolds|) is returned instead.
+    '''
+    rr, re = np.broadcast_arrays(np.asarray(relative_roughness, dtype=float),
+                                 np.abs(np.asarray(reynolds, dtype=float)))
+    instrument.count('friction_factors', re.size)
+    laminar = re < LAMINAR_LIMIT
+    f_blend, df_blend = transition_blend(
+        rr, re, laminar_ff(LAMINAR_LIMIT), 1 / 64)
+    f = np.where(laminar, laminar_ff(re), f_blend)
+    if not derivative:
+        return f
+    return f, np.where(laminar, 1 / 64, df_blend)
+
+def transition_blend(relative_roughness, reynolds, f_low, df_low):
+    '''Returns (friction factor, d/d(reynolds)) at and above LAMINAR_LIMIT.
+
+    f_low and df_low are the laminar friction factor and its derivative
+    at LAMINAR_LIMIT. Above TURBULENT_LIMIT the result is
+    colebrook_array; in between it is the cubic Hermite curve joining
+    the two regimes, so both the friction factor and its derivative are
+    continuous through the transition. reynolds must be positive.
+    '''
+    rr = np.asarray(relative_roughness, dtype=float)
+    re = np.asarray(reynolds, dtype=float)
+    turbulent = re >= TURBULENT_LIMIT
+    f_turb, df_turb = colebrook_array(rr, np.maximum(re, TURBULENT_LIMIT),
+                                      derivative = True)
+    f_high, df_high = colebrook_array(rr, TURBULENT_LIMIT, derivative = True)
+    width = TURBULENT_LIMIT - LAMINAR_LIMIT
+    t = np.clip((re - LAMINAR_LIMIT) / width, 0.0, 1.0)
+    h00, h10 = 2*t**3 - 3*t**2 + 1, t**3 - 2*t**2 + t
+    h01, h11 = -2*t**3 + 3*t**2, t**3 - t**2
+    f_trans = (h00 * f_low + h10 * width * df_low + h01 * f_high
+               + h11 * width * df_high)
+    df_trans = ((6*t**2 - 6*t) * (f_low - f_high) / width
+                + (3*t**2 - 4*t + 1) * df_low + (3*t**2 - 2*t) * df_high)
+    return (np.where(turbulent, f_turb, f_trans),
+            np.where(turbulent, df_turb, df_trans))
+
+def darcy_friction_factors(relative_roughness, reynolds, derivative = False):
+    '''Returns Darcy friction factors used for head loss in pipes.
+
+    Laminar flow follows Hagen-Poiseuille (64/reynolds) below
+    LAMINAR_LIMIT and turbulent flow follows colebrook_array above
+    TURBULENT_LIMIT, joined by transition_blend in between so that
+    losses and their derivatives stay continuous through the
+    transition. Reynolds numbers are treated by magnitude and floored
+    at 1 to keep the laminar branch finite at zero flow.
+
+    If derivative is True, a tuple of (friction factor, d(friction
+    factor)/d|reynolds|) is returned instead.
+    '''
+    rr, re = np.broadcast_arrays(np.asarray(relative_roughness, dtype=float),
+                                 np.abs(np.asarray(reynolds, dtype=float)))
+    instrument.count('friction_factors', re.size)
+    re = np.maximum(re, 1.0)
+    laminar = re < LAMINAR_LIMIT
+    f_blend, df_blend = transition_blend(
+        rr, re, 64 / LAMINAR_LIMIT, -64 / LAMINAR_LIMIT**2)
+    f = np.where(laminar, 64 / re, f_blend)
+    if not derivative:
+        return f
+    return f, np.where(laminar, -64 / re**2, df_blend)
 
 def reynolds(rho, d, v, mu):
     '''Returns reynolds number.'''
@@ -43,5 +254,6 @@ def reynolds(rho, d, v, mu):
     if reynolds.to_base_units().u == ureg.dimensionless:
         return reynolds.to_base_units()
     else:
+        import pint
         raise pint.errors.DimensionalityError("Dimensions don't cancel")
 
@@ -46,6 +46,7 @@ setup(
     package_dir = {'pipey': 'pipey'},
     package_data = {'pipey' : ['data/*.csv']},
     install_requires= ['pint>=0.7.2',
+                       'numpy>=1.7.0',
                        'scipy>=0.11.0',
                       ],
     entry_points= {
@@ -1,7 +1,29 @@
 import unittest
 from .test_core import suite as core_suite
 from .test_utils import suite as utils_suite
+from .test_compiled import suite as compiled_suite
+from .test_pipe_sizes import suite as pipe_sizes_suite
+from .test_element_classes import suite as element_classes_suite
+from .test_import import suite as import_suite
+from .test_cache import suite as cache_suite
+from .test_batch import suite as batch_suite
+from .test_extended import suite as extended_suite
+from .test_reduction import suite as reduction_suite
+from .test_engines import suite as engines_suite
+from .test_generate import suite as generate_suite
+from .test_instrument import suite as instrument_suite
+from .test_store import suite as store_suite
+from .test_fittings import suite as fittings_suite
+from .test_ensemble import suite as ensemble_suite
+from .test_registry import suite as registry_suite
+from .test_fluids import suite as fluids_suite
 
 super_suite = unittest.TestSuite()
 
-super_suite.addTests((core_suite, utils_suite,))
+super_suite.addTests((core_suite, utils_suite, compiled_suite,
+                      pipe_sizes_suite, element_classes_suite,
+                      import_suite, cache_suite, batch_suite,
+                      extended_suite, reduction_suite, engines_suite,
+                      generate_suite, instrument_suite, store_suite,
+                      fittings_suite, ensemble_suite, registry_suite,
+                      fluids_suite,))
@@ -18,6 +18,7 @@
 from .context import pipey
 from pipey import core
 from pipey import element_classes
+from pipey import ureg
 
 class PipeSegmentTest(core.PipeSegment):
     def __init__(self):
@@ -45,6 +46,9 @@ class DummyNetworkSolve(core.Network):
     def _attempt_solution(self, x):
         return [x[0] - 2*x[1],
                 2 - x[0]]
+    def _attempt_jacobian(self, x):
+        return [[1, -2],
+                [-1, 0]]
     def _set_unknowns(self, solution_input):
         self.segments = solution_input
     unknowns = [0]*2
@@ -53,3 +57,100 @@ class DummyElement(element_classes.Element):
     '''PipeSegment element whose calculate_loss method returns input flow'''
     def calculate_loss(self, input_flow):
         return input_flow
+    def calculate_derivative(self, input_flow):
+        return 1
+
+class DummyQuadraticElement(element_classes.Element):
+    '''PipeSegment element with head loss of 0.01 ft/gpm**2 * flow * |flow|'''
+    coefficient = 0.01 * ureg.feet / ureg.gpm**2
+    def calculate_loss(self, input_flow):
+        return self.coefficient * input_flow * abs(input_flow)
+    def calculate_derivative(self, input_flow):
+        return 2 * self.coefficient * abs(input_flow)
+
+class DummySlopelessElement(element_classes.Element):
+    '''DummyQuadraticElement without calculate_derivative'''
+    coefficient = DummyQuadraticElement.coefficient
+    def calculate_loss(self, input_flow):
+        return self.coefficient * input_flow * abs(input_flow)
+
+class DummyBatchQuadraticElement(DummyQuadraticElement):
+    '''DummyQuadraticElement that can also be evaluated in compiled mode'''
+    def batch_parameters(self):
+        return (self.coefficient.to('meter / (meter**3 / second)**2').m,)
+    @classmethod
+    def batch_loss(cls, params, flow, density, viscosity):
+        return params[:, 0] * flow * abs(flow)
+    @classmethod
+    def batch_derivative(cls, params, flow, density, viscosity):
+        return 2 * params[:, 0] * abs(flow)
+
+def build_loop_network(element_class):
+    '''Returns a looped core.Network whose segments hold element_class.
+
+    Node A is a reservoir at 100 ft feeding a square loop A-B-C-D with a
+    diagonal B-D and demands at C and D.
+    '''
+    network = core.Network()
+    for name in 'ABCD':
+        network.nodes[name] = core.Node()
+    network.nodes['A'].head = 100 * ureg.feet
+    network.nodes['A'].outflow = None
+    network.nodes['C'].outflow = 30 * ureg.gpm
+    network.nodes['D'].outflow = 20 * ureg.gpm
+    for name, start, end in (('1', 'A', 'B'), ('2', 'B', 'C'),
+                             ('3', 'C', 'D'), ('4', 'A', 'D'),
+                             ('5', 'B', 'D')):
+        seg = network.segments[name] = core.PipeSegment()
+        seg.start = network.nodes[start]
+        seg.end = network.nodes[end]
+        network.nodes[start].outputs.append(seg)
+        network.nodes[end].inputs.append(seg)
+        seg.elements = [element_class()]
+    return network
+
+PIPE = 'Pipe -s 40 -d {} in -l {} ft'
+
+def segment(name, start, end, diameter = 2, length = 50):
+    '''Returns lines of a segment holding one schedule 40 Pipe.'''
+    return ('segment ' + name, 'start ' + start, 'end ' + end,
+            PIPE.format(diameter, length), '')
+
+# Reservoir A feeding demands at C and D through B, with C and D also
+# joined to each other
+PIPE_LINES = (segment('1', 'A', 'B', 3, 100) + segment('2', 'B', 'C')
+              + segment('3', 'B', 'D', 2, 80) + segment('4', 'C', 'D', 2, 30)
+              + ('node A', 'head 100 ft', 'unknown outflow', '',
+                 'node C', 'outflow 60 gpm', '', 'node D', 'outflow 40 gpm'))
+
+# A loop B-C-D-F-B with a demand part way along each side, segments
+# pointing both ways around it, and a tree hanging off D
+LOOPED_LINES = (segment('1', 'A', 'B', 3, 100) + segment('2', 'B', 'C')
+                + segment('3', 'C', 'D') + segment('5', 'B', 'F', 2, 80)
+                + segment('6', 'D', 'F', 1) + segment('7', 'D', 'G')
+                + segment('8', 'G', 'H') + segment('9', 'I', 'G', 1)
+                + segment('10', 'J', 'C', 1, 20)
+                + ('node A', 'head 100 ft', 'unknown outflow', '',
+                   'node C', 'outflow 10 gpm', '', 'node F', 'outflow 5 gpm',
+                   '', 'node G', 'outflow 15 gpm', '',
+                   'node H', 'outflow 5 gpm', '', 'node I', 'outflow 5 gpm',
+                   '', 'node J', 'outflow 3 gpm'))
+
+def build_network(lines, compact = False):
+    '''Returns a core.Network parsed from lines of a .pipey file.
+
+    Lines that are None are left out.
+    '''
+    network = core.Network(compact = compact)
+    network.parse([line.split(' ') for line in lines if line is not None])
+    return network
+
+def build_reference(lines):
+    '''Returns the CompiledNetwork of lines solved with MINPACK's hybr.
+
+    hybr shares nothing with the structured engines, so its solution is
+    an independent reference for them.
+    '''
+    reference = build_network(lines).compile()
+    reference.solve('hybr')
+    return reference
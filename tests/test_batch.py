@@ -0,0 +1,90 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.batch as batch
+import numpy as np
+import unittest
+from pipey import ureg
+
+class BatchTestCase(unittest.TestCase):
+    '''Runs unit tests on batch.run_scenarios.'''
+    def setUp(self):
+        self.network = dummy_classes.build_network(dummy_classes.PIPE_LINES)
+        self.scenarios = [{'outflow': {'C': q * ureg.gpm}}
+                          for q in (10, 40, 80)]
+        self.scenarios.append({'head': {'A': 120 * ureg.feet},
+                               'inflow': {'D': 5 * ureg.gpm}})
+
+    def tearDown(self):
+        del self.network
+
+    def reference(self, scenario):
+        '''Returns (flows, heads) in SI from a single Network.solve.'''
+        network = dummy_classes.build_network(dummy_classes.PIPE_LINES)
+        for name, value in scenario.get('outflow', dict()).items():
+            network.nodes[name].outflow = value
+        for name, value in scenario.get('inflow', dict()).items():
+            network.nodes[name].outflow = -value
+        for name, value in scenario.get('head', dict()).items():
+            network.nodes[name].head = value
+        network.solve()
+        return (np.array([s.flow.to('m**3/s').m
+                          for s in network.segments.values()]),
+                np.array([n.head.to('m').m for n in network.nodes.values()]))
+
+    def check(self, results):
+        self.assertListEqual([r.index for r in results],
+                             list(range(len(self.scenarios))))
+        for result, scenario in zip(results, self.scenarios):
+            self.assertTrue(result.success)
+            flow, head = self.reference(scenario)
+            np.testing.assert_allclose(result.flow, flow, rtol = 1e-6)
+            np.testing.assert_allclose(result.head, head, rtol = 1e-6)
+
+    def test_in_process(self):
+        '''Tests scenarios solved in the calling process.'''
+        self.check(list(batch.run_scenarios(self.network, self.scenarios,
+                                            max_workers = 0)))
+
+    def test_process_pool(self):
+        '''Tests scenarios solved on a process pool, streamed in order.'''
+        self.check(list(batch.run_scenarios(self.network,
+                                            iter(self.scenarios),
+                                            max_workers = 2, window = 2)))
+
+    def test_failures(self):
+        '''Tests that bad scenarios give ScenarioFailure, not exceptions.'''
+        scenarios = [{'head': {'B': 50 * ureg.feet}},
+                     {'outflow': {'A': 1 * ureg.gpm}},
+                     {'outflow': {'Z': 1 * ureg.gpm}},
+                     {'outflow': {'C': 1 * ureg.feet}},
+                     {'demand': {}},
+                     {'outflow': {'C': 20 * ureg.gpm}}]
+        for workers in (0, 2):
+            results = list(batch.run_scenarios(self.network, scenarios,
+                                               max_workers = workers))
+            self.assertListEqual([r.success for r in results],
+                                 [False] * 5 + [True])
+            self.assertIn('unknown', results[0].message)
+            self.assertIsInstance(results[0], batch.ScenarioFailure)
+
+batch_suite = unittest.TestLoader().loadTestsFromTestCase(BatchTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((batch_suite,))
@@ -0,0 +1,160 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+import pipey.cache as cache
+import pipey.core as core
+import pipey.element_classes as element_classes
+import numpy as np
+import os
+import sys
+import tempfile
+import unittest
+
+class Unregistered(element_classes.Pipe):
+    '''Pipe that isn't in the element registry.'''
+    __slots__ = ()
+
+NETWORK = '''segment 1
+start A
+end B
+Pipe -s 40 -d 2 in -l 100 ft
+
+segment 2
+start B
+end C
+Pipe -s 40 -d 3 in -l 50 ft
+
+segment 3
+start B
+end D
+Pipe -s 40 -d 3 in -l 20 ft
+
+node A
+head 100 ft
+unknown outflow
+
+node C
+outflow 100 gpm
+
+node D
+outflow 50 gpm
+'''
+
+class CacheTestCase(unittest.TestCase):
+    '''Runs unit tests on binary network snapshots.'''
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'network.pipey')
+        with open(self.source, 'w') as f:
+            f.write(NETWORK)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cache_filename(self):
+        self.assertEqual(cache.cache_filename('a/b.pipey'), 'a/b.pipeyc')
+        self.assertEqual(cache.cache_filename('a/b.txt'), 'a/b.txt.pipeyc')
+
+    def test_round_trip(self):
+        '''Tests that a reopened snapshot matches the compiled Network.'''
+        network = core.Network()
+        compiled = network.load_compiled(self.source)
+        self.assertTrue(os.path.exists(cache.cache_filename(self.source)))
+
+        snapshot = core.Network().load_compiled(self.source)
+        self.assertIsInstance(snapshot.start, np.memmap)
+        self.assertIsNone(snapshot.segments)
+        self.assertListEqual(list(snapshot.segment_names), ['1', '2', '3'])
+        self.assertListEqual(list(snapshot.node_names), ['A', 'B', 'C', 'D'])
+        x = np.linspace(0.001, 0.01, compiled.n_unknowns)
+        np.testing.assert_array_equal(snapshot.residuals(x),
+                                      compiled.residuals(x))
+        np.testing.assert_array_equal(snapshot.jacobian(x).toarray(),
+                                      compiled.jacobian(x).toarray())
+
+    def test_solution_saved(self):
+        '''Tests that the last solution is kept and used as a start.'''
+        compiled = core.Network().load_compiled(self.source)
+        compiled.solve()
+        compiled.save(self.source)
+
+        snapshot = cache.load(self.source)
+        np.testing.assert_array_equal(snapshot.initial_guess(),
+                                      compiled.initial_guess())
+        self.assertLess(np.max(np.abs(snapshot.residuals(
+            snapshot.initial_guess()))), 1e-8)
+
+    def test_stale(self):
+        '''Tests that changing the source invalidates the snapshot.'''
+        core.Network().load_compiled(self.source)
+        self.assertIsNotNone(cache.load(self.source))
+
+        # Same size, different contents and modification time
+        with open(self.source, 'w') as f:
+            f.write(NETWORK.replace('100 gpm', '200 gpm'))
+        os.utime(self.source, ns = (0, 0))
+        self.assertIsNone(cache.load(self.source))
+
+        network = core.Network()
+        snapshot = network.load_compiled(self.source)
+        self.assertIn('1', network.segments) # parsed again
+        self.assertAlmostEqual(snapshot.outflow[2] / snapshot._gpm, 200,
+                               places = 6)
+
+    def test_touched(self):
+        '''Tests that a touched but unchanged source keeps its snapshot.'''
+        core.Network().load_compiled(self.source)
+        os.utime(self.source, ns = (0, 0))
+        self.assertIsNotNone(cache.load(self.source))
+
+    def test_scalar_elements(self):
+        '''Tests that networks with scalar-only elements aren't cached.'''
+        from . import dummy_classes
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyQuadraticElement)
+        self.assertRaises(ValueError, cache.save, network.compile(),
+                          self.source)
+
+    def test_class_names(self):
+        '''Tests that snapshots name classes only through the registry.'''
+        with open(self.source, 'a') as f:
+            f.write('\nsegment 4\nstart D\nend E\nPipe -d 1 in -l 9 ft\n'
+                    'Elbow -d 1 in -q 2\n')
+        compiled = core.Network().load_compiled(self.source)
+        header, _ = cache._read_header(cache.cache_filename(self.source))
+        self.assertListEqual(sorted(header['groups']), ['Pipe', 'Resistance'])
+        self.assertIsNotNone(cache.load(self.source))
+
+        # A snapshot naming a module instead of an element isn't loaded
+        # and the module isn't imported
+        compiled.groups[0].element_class = Unregistered
+        self.assertRaises(ValueError, compiled.save, self.source)
+        class_name = cache._class_name
+        cache._class_name = lambda element_class: 'this:s'
+        try:
+            compiled.save(self.source)
+        finally:
+            cache._class_name = class_name
+        self.assertNotIn('this', sys.modules)
+        self.assertIsNone(cache.load(self.source))
+        self.assertNotIn('this', sys.modules)
+
+cache_suite = unittest.TestLoader().loadTestsFromTestCase(CacheTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((cache_suite,))
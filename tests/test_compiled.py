@@ -0,0 +1,175 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.compiled as compiled
+import numpy as np
+import unittest
+from pipey import ureg
+
+class CompiledNetworkTestCase(unittest.TestCase):
+    '''Runs unit tests on compiled.CompiledNetwork.'''
+    def setUp(self):
+        self.network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        self.compiled = self.network.compile()
+        # Unknowns in the Network's own units (gpm and feet)
+        self.x = np.array([40, 25, 5, 15, -5, 90, 85, 80], dtype=float)
+        gpm = (1 * ureg.gpm).to(compiled.FLOW_UNITS).m
+        foot = (1 * ureg.feet).to(compiled.HEAD_UNITS).m
+        self.x_si = self.x * np.array([gpm]*5 + [foot]*3)
+
+    def tearDown(self):
+        del self.network
+        del self.compiled
+
+    def test_arrays(self):
+        '''Tests that topology and boundaries are converted to arrays.'''
+        c = self.compiled
+        self.assertEqual(c.n_unknowns, 8)
+        self.assertListEqual(c.start.tolist(), [0, 1, 2, 0, 1])
+        self.assertListEqual(c.end.tolist(), [1, 2, 3, 3, 3])
+        self.assertListEqual(c.continuity.tolist(), [False, True, True, True])
+        self.assertListEqual(c.incidence.toarray().tolist(),
+                             [[-1, 0, 0, -1, 0],
+                              [1, -1, 0, 0, -1],
+                              [0, 1, -1, 0, 0],
+                              [0, 0, 1, 1, 1]])
+        self.assertAlmostEqual(c.head[0], 30.48, places = 6)
+        self.assertAlmostEqual(c.outflow[2],
+                               (30 * ureg.gpm).to('m**3/s').m, places = 9)
+        self.assertEqual(len(c.groups), 1)
+        self.assertIsInstance(c.groups[0], compiled.BatchGroup)
+
+    def test_residuals_match_get_errors(self):
+        '''Tests that compiled residuals agree with Network.get_errors.'''
+        legacy = np.array(self.network._attempt_solution(self.x))
+        residuals = self.compiled.residuals(self.x_si)
+        n_segs = len(self.network.segments)
+        np.testing.assert_allclose(residuals[:n_segs],
+                                   legacy[:n_segs] * 0.3048, atol = 1e-9)
+        np.testing.assert_allclose(residuals[n_segs:],
+                                   (legacy[n_segs:] * ureg.gpm).to('m**3/s').m,
+                                   atol = 1e-12)
+
+    def test_jacobian(self):
+        '''Tests compiled jacobian against central differences of residuals.'''
+        jac = self.compiled.jacobian(self.x_si).toarray()
+        for j in range(len(self.x_si)):
+            step = np.zeros(len(self.x_si))
+            step[j] = 1e-6 * max(abs(self.x_si[j]), 1e-3)
+            diff = (self.compiled.residuals(self.x_si + step)
+                    - self.compiled.residuals(self.x_si - step)) / (2*step[j])
+            np.testing.assert_allclose(jac[:, j], diff, rtol = 1e-5,
+                                       atol = 1e-6)
+
+    def test_scalar_group(self):
+        '''Tests that elements without batch_loss are evaluated through pint.'''
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyQuadraticElement)
+        scalar = network.compile()
+        self.assertIsInstance(scalar.groups[0], compiled.ScalarGroup)
+        np.testing.assert_allclose(scalar.residuals(self.x_si),
+                                   self.compiled.residuals(self.x_si),
+                                   rtol = 1e-9, atol = 1e-12)
+        np.testing.assert_allclose(scalar.jacobian(self.x_si).toarray(),
+                                   self.compiled.jacobian(self.x_si).toarray(),
+                                   rtol = 1e-9, atol = 1e-12)
+
+    def test_solve_compiled(self):
+        '''Tests that a compiled solve matches the pint-based solve.'''
+        self.network.solve(compiled = True)
+        reference = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        reference.solve()
+
+        for name in self.network.segments:
+            self.assertAlmostEqual(self.network.segments[name].flow.m,
+                                   reference.segments[name].flow.m, places = 4)
+        for name in self.network.nodes:
+            self.assertAlmostEqual(self.network.nodes[name].head.m,
+                                   reference.nodes[name].head.m, places = 4)
+        # Continuity holds at the demand nodes
+        self.assertAlmostEqual(self.network.segments['2'].flow.m
+                               - self.network.segments['3'].flow.m, 30,
+                               places = 4)
+
+    def test_solve_from_solution(self):
+        '''Tests that solving again from a converged solution succeeds.'''
+        self.compiled.solve()
+        flow = self.compiled.flow.copy()
+        self.compiled.solve()
+        np.testing.assert_allclose(self.compiled.flow, flow, atol = 1e-12)
+
+# Two looped systems sharing reservoir A, plus one disconnected system
+SPLIT_LINES = (
+    'segment 1', 'start A', 'end B', 'Pipe -s 40 -d 3 in -l 100 ft', '',
+    'segment 2', 'start B', 'end C', 'Pipe -s 40 -d 2 in -l 50 ft', '',
+    'segment 3', 'start B', 'end C', 'Pipe -s 40 -d 1 in -l 50 ft', '',
+    'segment 4', 'start A', 'end D', 'Pipe -s 40 -d 2 in -l 80 ft', '',
+    'segment 5', 'start R', 'end S', 'Pipe -s 40 -d 2 in -l 30 ft', '',
+    'node A', 'head 100 ft', 'unknown outflow', '',
+    'node C', 'outflow 60 gpm', '', 'node D', 'outflow 40 gpm', '',
+    'node R', 'head 50 ft', 'unknown outflow', '',
+    'node S', 'outflow 20 gpm')
+
+class SplitTestCase(unittest.TestCase):
+    '''Runs unit tests on solving independent pieces separately.'''
+    def setUp(self):
+        self.network = dummy_classes.build_network(SPLIT_LINES)
+        self.compiled = self.network.compile()
+
+    def tearDown(self):
+        del self.network
+        del self.compiled
+
+    def test_components(self):
+        '''Tests that pieces are cut at reservoirs and between systems.'''
+        pieces = [c.tolist() for c in self.compiled.components()]
+        self.assertListEqual(sorted(pieces), [[0, 1, 2], [3], [4]])
+        piece, nodes = self.compiled.subnetwork([3])
+        self.assertListEqual(piece.node_names, ['A', 'D'])
+        self.assertListEqual(nodes.tolist(), [0, 3])
+        self.assertEqual(piece.n_unknowns, 2)
+        self.assertEqual(len(piece.residuals(piece.initial_guess())), 2)
+
+    def test_solve_split(self):
+        '''Tests that solving pieces matches solving the whole network.'''
+        reference = dummy_classes.build_reference(SPLIT_LINES)
+        for workers in (0, 2):
+            network = dummy_classes.build_network(SPLIT_LINES)
+            network.solve(split = True, max_workers = workers)
+            flow = [s.flow.to('m**3/s').m for s in network.segments.values()]
+            np.testing.assert_allclose(flow, reference.flow, rtol = 1e-6)
+
+    def test_process_pool(self):
+        '''Tests pieces solved on a process pool.'''
+        self.compiled.solve_split(max_workers = 2, processes = True)
+        reference = dummy_classes.build_reference(SPLIT_LINES)
+        np.testing.assert_allclose(self.compiled.head, reference.head,
+                                   rtol = 1e-6)
+        self.assertAlmostEqual(self.network.nodes['S'].head.m,
+                               self.compiled.head[-1] / 0.3048, places = 6)
+
+compiled_suite = unittest.TestLoader().loadTestsFromTestCase(
+    CompiledNetworkTestCase)
+
+split_suite = unittest.TestLoader().loadTestsFromTestCase(SplitTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((compiled_suite, split_suite))
@@ -18,8 +18,15 @@
 from .context import pipey
 from . import dummy_classes
 import pipey.core as core
+import pipey.instrument as instrument
 import unittest
 from pipey import ureg
+import pipey.utils as utils
+import os
+import tempfile
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, 'sample_data.pipey')
 
 class NetworkTestCase(unittest.TestCase):
     '''Runs units tests on all methods of Network class.'''
@@ -68,6 +75,39 @@ class NetworkTestCase(unittest.TestCase):
         self.assertIs(self.network.segments['2'].end,
                       self.network.nodes['A'])
 
+    def test_load(self):
+        '''Tests method of core.Network: load.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'network.pipey')
+            with open(filename, 'w') as f:
+                f.write('segment 1\nstart A\nend B\n'
+                        'Pipe -s 40 -d 2 in -l 100 ft\n\n'
+                        'node A\nhead 10 ft\nunknown outflow\n\n'
+                        'node B\noutflow 5 gpm\n')
+            self.network.load(filename)
+
+        seg = self.network.segments['1']
+        self.assertIs(seg.start, self.network.nodes['A'])
+        self.assertIs(seg.end, self.network.nodes['B'])
+        self.assertIsInstance(seg.elements[0], pipey.element_classes.Pipe)
+        self.assertAlmostEqual(self.network.nodes['B'].outflow.m, 5, places = 5)
+
+    def test_parse_error_line_number(self):
+        '''Tests that errors building objects report their line number.'''
+        with self.assertRaises(utils.FormattingError) as cm:
+            self.network.parse([['segment', '1'], ['start', 'A'],
+                                ['NoSuchElement', '-q', '1']])
+        self.assertEqual(cm.exception.line_number, 3)
+        # Elements are built together; the bad one is still found
+        with self.assertRaises(utils.FormattingError) as cm:
+            self.network.parse([line.split(' ') for line in (
+                'segment 2', 'Pipe -d 2 in -l 5 ft',
+                'Pipe -s 7 -d 2 in -l 5 ft', 'Pipe -d 3 in -l 5 ft')])
+        self.assertEqual(cm.exception.line_number, 3)
+        with self.assertRaises(utils.FormattingError) as cm:
+            self.network.parse([['node', 'A'], ['head', '3', 'blargs']])
+        self.assertEqual(cm.exception.line_number, 2)
+
     def test_add_seg(self):
         '''Tests method of core.Network: add_seg'''
         focus = self.network.add_seg(['segment', 'A'])
@@ -80,6 +120,13 @@ class NetworkTestCase(unittest.TestCase):
         self.assertIs(self.network.nodes['A'], focus)
         self.assertIsInstance(focus, core.Node)
 
+    def test_add_node_existing(self):
+        '''Tests that add_node keeps a node already referenced by a segment.'''
+        self.network.parse([['segment', '1'], ['start', 'A']])
+        focus = self.network.add_node(['node', 'A'])
+        self.assertIs(focus, self.network.segments['1'].start)
+        self.assertIs(focus.outputs[0], self.network.segments['1'])
+
     def test_add_details_seg_start_new(self):
         '''Tests method of core.Network: add_details.
 
@@ -182,6 +229,69 @@ class NetworkTestCase(unittest.TestCase):
 
         del self.solve_network
 
+    def test_solve_with_jacobian(self):
+        '''Tests that solve converges using analytic derivatives.'''
+        node_A = self.network.nodes['A'] = core.Node()
+        node_B = self.network.nodes['B'] = core.Node()
+        for name in ('1', '2'):
+            seg = self.network.segments[name] = core.PipeSegment()
+            seg.start = node_A
+            seg.end = node_B
+            node_A.outputs.append(seg)
+            node_B.inputs.append(seg)
+            seg.elements = [dummy_classes.DummyQuadraticElement()]
+        node_A.head = 10.0 * ureg.feet
+        node_A.outflow = None
+        node_B.outflow = 20 * ureg.gpm
+
+        self.assertTrue(self.network._has_derivatives())
+        self.network.solve()
+
+        self.assertAlmostEqual(self.network.segments['1'].flow.m, 10, places = 5)
+        self.assertAlmostEqual(self.network.segments['2'].flow.m, 10, places = 5)
+        self.assertAlmostEqual(node_B.head.m, 9, places = 5)
+
+    def test_solve_pipes(self):
+        '''Tests solving a parsed branching network of Pipe elements.'''
+        self.network.parse([line.split(' ') for line in (
+            'segment 1', 'start A', 'end B', 'Pipe -s 40 -d 2 in -l 100 ft', '',
+            'segment 2', 'start B', 'end C', 'Pipe -s 40 -d 3 in -l 50 ft', '',
+            'node A', 'head 100 ft', 'unknown outflow', '',
+            'node C', 'outflow 60 gpm')])
+
+        self.network.solve()
+
+        self.assertAlmostEqual(self.network.segments['1'].flow.m, 60, places = 5)
+        self.assertAlmostEqual(self.network.segments['2'].flow.m, 60, places = 5)
+        pipe = self.network.segments['1'].elements[0]
+        self.assertAlmostEqual(
+            self.network.nodes['B'].head.m,
+            100 - pipe.calculate_loss(60 * ureg.gpm).to('ft').m, places = 5)
+
+    def test_solve_default(self):
+        '''Tests that solve compiles the Network unless told not to.'''
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyQuadraticElement)
+        report = network.solve()
+        self.assertEqual(report.engine, 'gga')
+        legacy = dummy_classes.build_loop_network(
+            dummy_classes.DummyQuadraticElement)
+        self.assertEqual(legacy.solve(compiled = False).engine, 'hybr')
+        for name, seg in network.segments.items():
+            self.assertAlmostEqual(seg.flow.to('gpm').m,
+                                   legacy.segments[name].flow.to('gpm').m,
+                                   places = 5)
+
+    def test_sample_data(self):
+        '''Tests that the shipped sample_data.pipey loads and solves.'''
+        self.network.load(SAMPLE_DATA)
+        self.network.solve()
+        self.assertAlmostEqual(self.network.segments['1'].flow.to('gpm').m,
+                               70, places = 5)
+        self.assertAlmostEqual(self.network.segments['3'].flow.to('gpm').m,
+                               30, places = 5)
+        self.assertLess(self.network.nodes['D'].head.to('ft').m, 100)
+
     def test__find_unknowns(self):
         '''Tests method core.Network: _find_unknowns'''
         # Create network elements
@@ -240,6 +350,90 @@ class NetworkTestCase(unittest.TestCase):
         self.assertEqual(abs(errors[1]), 10)
         self.assertEqual(abs(errors[2]), 10)
 
+    def test_get_jacobian(self):
+        '''Tests method of core.Network: get_jacobian.'''
+        seg_1 = self.network.segments['1'] = core.PipeSegment()
+        seg_2 = self.network.segments['2'] = core.PipeSegment()
+        node_A = self.network.nodes['A'] = core.Node()
+        node_B = self.network.nodes['B'] = core.Node()
+        node_C = self.network.nodes['C'] = core.Node()
+
+        for seg, start, end in ((seg_1, node_A, node_B),
+                                (seg_2, node_B, node_C)):
+            seg.start = start
+            seg.end = end
+            start.outputs.append(seg)
+            end.inputs.append(seg)
+            seg.elements = [dummy_classes.DummyElement()] * 3
+
+        node_A.head = 10.0 * ureg.feet
+        node_C.head = 0.0 * ureg.feet
+        self.network._find_unknowns()
+        self.network._set_unknowns([1, 1, 5])
+
+        jac = self.network.get_jacobian().toarray()
+
+        # Columns are seg_1 flow, seg_2 flow, node_B head
+        self.assertListEqual(jac.tolist(), [[3, 0, 1],
+                                            [0, 3, -1],
+                                            [-1, 0, 0],
+                                            [1, -1, 0],
+                                            [0, 1, 0]])
+
+    def test_get_jacobian_matches_errors(self):
+        '''Tests that get_jacobian agrees with differences of get_errors.'''
+        seg = self.network.segments['1'] = core.PipeSegment()
+        node_A = self.network.nodes['A'] = core.Node()
+        node_B = self.network.nodes['B'] = core.Node()
+        seg.start = node_A
+        seg.end = node_B
+        node_A.outputs.append(seg)
+        node_B.inputs.append(seg)
+        seg.elements = [dummy_classes.DummyQuadraticElement()]
+        node_A.head = 10.0 * ureg.feet
+
+        self.network._find_unknowns()
+        x = [4.0, 2.0]
+        base = self.network._attempt_solution(x)
+        jac = self.network._attempt_jacobian(x)
+        for j in range(len(x)):
+            stepped = list(x)
+            stepped[j] += 1e-3
+            errors = self.network._attempt_solution(stepped)
+            for i in range(len(base)):
+                self.assertAlmostEqual((errors[i] - base[i]) / 1e-3,
+                                       jac[i][j], places = 3)
+
+    def test_coloured_jacobian(self):
+        '''Tests that coloured differences match get_jacobian.'''
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyQuadraticElement)
+        network._find_unknowns()
+        x = [40.0, 20.0, -5.0, 10.0, 3.0, 90.0, 80.0, 70.0]
+        colours, pattern = network._colouring()
+        self.assertLess(colours.max() + 1, len(x))
+        coloured = network.coloured_jacobian(x)
+        threaded = network.coloured_jacobian(x, max_workers = 3)
+        exact = network.get_jacobian()
+        for matrix in (coloured, threaded):
+            self.assertLess(abs(matrix - exact).max(), 1e-5)
+        self.assertEqual(coloured.nnz, exact.nnz)
+
+    def test_solve_coloured(self):
+        '''Tests that solve uses coloured differences without derivatives.'''
+        reference = dummy_classes.build_loop_network(
+            dummy_classes.DummyQuadraticElement)
+        reference.solve()
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummySlopelessElement)
+        with instrument.Recorder() as recorder:
+            network.solve(compiled = False, max_workers = 2)
+        self.assertGreater(recorder.counters['jacobians'], 0)
+        for name, seg in network.segments.items():
+            self.assertAlmostEqual(seg.flow.to('gpm').m,
+                                   reference.segments[name].flow.to('gpm').m,
+                                   places = 4)
+
     def test__attempt_solution(self):
         '''Tests method of core.Network: _attempt_solution
 
@@ -254,6 +448,76 @@ class NetworkTestCase(unittest.TestCase):
         self.assertAlmostEqual(6.3, test_list[0], places=3)
         self.assertEqual(test_errors, 5)
 
+class ResolveTestCase(unittest.TestCase):
+    '''Runs unit tests on warm-started and incremental solves.'''
+    def setUp(self):
+        self.network = dummy_classes.build_network(dummy_classes.PIPE_LINES)
+
+    def tearDown(self):
+        del self.network
+
+    def reference(self, edit):
+        '''Returns heads of a freshly built and solved copy after edit.'''
+        network = dummy_classes.build_network(dummy_classes.PIPE_LINES)
+        edit(network)
+        network.solve()
+        return {name: node.head.to('ft').m
+                for name, node in network.nodes.items()}
+
+    def assertHeads(self, expected):
+        for name, head in expected.items():
+            self.assertAlmostEqual(self.network.nodes[name].head.to('ft').m,
+                                   head, places = 5)
+
+    def test_warm_start(self):
+        '''Tests that solve starts from the previous solution.'''
+        self.network.solve()
+        self.assertNotEqual(self.network._initial_guess(),
+                            [0] * len(self.network.unknowns))
+        self.network.nodes['C'].outflow = 70 * ureg.gpm
+        self.network.solve()
+        self.assertHeads(self.reference(
+            lambda n: setattr(n.nodes['C'], 'outflow', 70 * ureg.gpm)))
+
+    def test_resolve_outflow(self):
+        '''Tests that resolve patches changed outflows in place.'''
+        self.network.resolve()
+        compiled = self.network._compiled
+        self.network.set_outflow('C', 90 * ureg.gpm)
+        self.network.resolve()
+        self.assertIs(self.network._compiled, compiled)
+        self.assertHeads(self.reference(
+            lambda n: setattr(n.nodes['C'], 'outflow', 90 * ureg.gpm)))
+
+    def test_resolve_element(self):
+        '''Tests that resolve patches changed element parameters in place.'''
+        self.network.resolve()
+        compiled = self.network._compiled
+        self.network.update_element('2', 0, diameter = 3.068 * ureg.inch)
+        self.network.resolve()
+        self.assertIs(self.network._compiled, compiled)
+        self.assertHeads(self.reference(
+            lambda n: setattr(n.segments['2'].elements[0], 'diameter',
+                              3.068 * ureg.inch)))
+
+    def test_resolve_head(self):
+        '''Tests fixing and freeing heads between solves.'''
+        self.network.resolve()
+        compiled = self.network._compiled
+        self.network.set_head('B', 95 * ureg.feet)
+        self.network.set_outflow('B', None)
+        self.network.resolve()
+        self.assertIsNot(self.network._compiled, compiled)
+        def edit(n):
+            n.nodes['B'].head = 95 * ureg.feet
+            n.nodes['B'].outflow = None
+        self.assertHeads(self.reference(edit))
+
+        self.network.set_head('B', None)
+        self.network.set_outflow('B', 0 * ureg.gpm)
+        self.network.resolve()
+        self.assertHeads(self.reference(lambda n: None))
+
 class PipeSegmentTestCase(unittest.TestCase):
     '''Runs unit tests on all methods of PipeSegment class'''
     def setUp(self):
@@ -299,6 +563,40 @@ class PipeSegmentTestCase(unittest.TestCase):
             losses = self.seg.calculate_loss()
             self.assertEqual(losses, elements_len * self.seg.flow)
 
+    def test_calculate_derivative(self):
+        '''Tests method of PipeSegment: calculate_derivative.'''
+        self.seg.flow = 2 * ureg.gallons / ureg.minutes
+
+        for elements_len in range(1,10):
+            self.seg.elements = [dummy_classes.DummyElement()] * elements_len
+            self.assertEqual(self.seg.calculate_derivative(), elements_len)
+
+    def test_fold(self):
+        '''Tests that constant-K elements are folded and kept up to date.'''
+        self.seg.fluid = core.Fluid()
+        self.seg.flow = 40 * ureg.gpm
+        self.seg.add_ele(['Pipe', '-d', '2', 'in', '-l', '50', 'ft'])
+        self.seg.add_ele(['Fitting', '-K', '0.5', '-q', '3', '-d', '2', 'in'])
+        self.seg.add_ele(['Fitting', '-K', '2', '-d', '2', 'in'])
+        def by_element():
+            return sum(e.calculate_loss(self.seg.flow)
+                       for e in self.seg.elements).to('ft').m
+        self.assertAlmostEqual(self.seg.calculate_loss().to('ft').m,
+                               by_element(), places = 9)
+        self.assertEqual(len(self.seg._fold()[1]), 1)
+        self.seg.add_ele(['Fitting', '-K', '1', '-d', '2', 'in'])
+        self.assertAlmostEqual(self.seg.calculate_loss().to('ft').m,
+                               by_element(), places = 9)
+        fitting = self.seg.elements[1]
+        fitting.quantity = 1
+        self.seg.set_element(1, fitting)
+        self.assertAlmostEqual(self.seg.calculate_loss().to('ft').m,
+                               by_element(), places = 9)
+        deriv = sum(e.calculate_derivative(self.seg.flow)
+                    for e in self.seg.elements)
+        self.assertAlmostEqual(self.seg.calculate_derivative().to('s/m**2').m,
+                               deriv.to('s/m**2').m, places = 6)
+
 class NodeTestCase(unittest.TestCase):
     '''Runs unit tests for Node class.'''
     def setUp(self):
@@ -333,11 +631,15 @@ class NodeTestCase(unittest.TestCase):
         self.assertAlmostEqual(self.node.outflow.m, -50, places = 5)
         self.assertEqual(self.node.outflow.to_base_units().u, ureg.m**3 / ureg.sec)
 
+        self.node.add_details(['unknown', 'outflow'])
+        self.assertIs(self.node.outflow, None)
+
 network_suite = unittest.TestLoader().loadTestsFromTestCase(NetworkTestCase)
+resolve_suite = unittest.TestLoader().loadTestsFromTestCase(ResolveTestCase)
 seg_suite = unittest.TestLoader().loadTestsFromTestCase(PipeSegmentTestCase)
 node_suite = unittest.TestLoader().loadTestsFromTestCase(NodeTestCase)
 
 # This is the test suite imported by __init__.py
 suite = unittest.TestSuite()
-suite.addTests((network_suite, seg_suite, node_suite,))
+suite.addTests((network_suite, resolve_suite, seg_suite, node_suite,))
 
@@ -0,0 +1,251 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+import pipey.core as core
+import pipey.element_classes as element_classes
+import pipey.fittings as fittings
+import pipey.pipe_sizes as pipe_sizes
+import numpy as np
+import unittest
+from pipey import ureg
+
+class ParseOptionsTestCase(unittest.TestCase):
+    '''Tests parsing of element tags.'''
+    def test_parse_options(self):
+        options = element_classes.parse_options(
+            ['-s', '40', '-d', '2', 'in', '-l', '100', 'ft'])
+        self.assertDictEqual(options, {'-s': ['40'], '-d': ['2', 'in'],
+                                       '-l': ['100', 'ft']})
+
+class PipeTestCase(unittest.TestCase):
+    '''Runs unit tests on element_classes.Pipe.'''
+    def setUp(self):
+        self.pipe = element_classes.Pipe(['-s', '40', '-d', '2', 'in',
+                                          '-l', '100', 'ft'])
+        self.pipe.fluid = core.Fluid()
+
+    def test_init(self):
+        '''Tests nominal and inner diameter tags.'''
+        self.assertAlmostEqual(self.pipe.diameter.to('inch').m, 2.067,
+                               places = 6)
+        self.assertAlmostEqual(self.pipe.length.to('ft').m, 100, places = 6)
+        pipe = element_classes.Pipe(['-D', '50', 'mm', '-l', '3', 'm'])
+        self.assertAlmostEqual(pipe.diameter.to('mm').m, 50, places = 6)
+        pipe = element_classes.Pipe(['-s', '80', '-d', '2', 'in',
+                                     '-l', '3', 'm'])
+        self.assertAlmostEqual(pipe.diameter.to('inch').m, 1.939, places = 6)
+
+    def test_build_many(self):
+        '''Tests that build_many looks every size up in one call.'''
+        tokens = [['-s', schedule, '-d', nps, 'in', '-l', '10', 'ft']
+                  for nps in ('1', '2', '3', '1.5')
+                  for schedule in ('40', '80')]
+        tokens.append(['-D', '50', 'mm', '-l', '3', 'm'])
+        calls = list()
+        lookup = pipe_sizes.inner_diameters
+        def counted(nps, schedules):
+            calls.append(len(nps))
+            return lookup(nps, schedules)
+        pipe_sizes.inner_diameters = counted
+        try:
+            pipes = element_classes.Pipe.build_many(tokens)
+        finally:
+            pipe_sizes.inner_diameters = lookup
+        self.assertListEqual(calls, [8])
+        for pipe, attributes in zip(pipes, tokens):
+            single = element_classes.Pipe(attributes)
+            self.assertEqual(pipe.batch_parameters(),
+                             single.batch_parameters())
+            self.assertEqual(pipe.schedule, single.schedule)
+        with self.assertRaises(KeyError):
+            element_classes.Pipe.build_many(
+                [['-s', 'XXS', '-d', '0.125', 'in', '-l', '1', 'ft']])
+
+    def test_calculate_loss(self):
+        '''Tests Darcy-Weisbach loss against a hand calculation.
+
+        50 gpm of water in 100 ft of 2 in schedule 40 pipe is about
+        4.7 ft of head loss.
+        '''
+        loss = self.pipe.calculate_loss(50 * ureg.gpm)
+        self.assertAlmostEqual(loss.to('ft').m, 4.68, delta = 0.05)
+        reverse = self.pipe.calculate_loss(-50 * ureg.gpm)
+        self.assertAlmostEqual(reverse.to('ft').m, -loss.to('ft').m,
+                               places = 9)
+
+    def test_calculate_derivative(self):
+        '''Tests derivative against central differences of calculate_loss.'''
+        for gpm in (-80, 0.5, 8, 50, 300):
+            step = 1e-4 * ureg.gpm
+            flow = gpm * ureg.gpm
+            diff = ((self.pipe.calculate_loss(flow + step)
+                     - self.pipe.calculate_loss(flow - step)) / (2 * step))
+            deriv = self.pipe.calculate_derivative(flow)
+            self.assertAlmostEqual(deriv.to('s/m**2').m,
+                                   diff.to('s/m**2').m,
+                                   delta = 1e-4 * abs(deriv.to('s/m**2').m))
+
+    def test_laminar(self):
+        '''Tests that laminar loss is Hagen-Poiseuille down to zero flow.'''
+        flow = 0.5 * ureg.gpm
+        diameter = self.pipe.diameter
+        velocity = flow / (np.pi * diameter**2 / 4)
+        expected = (32 * self.pipe.fluid.viscosity * self.pipe.length
+                    * velocity / (self.pipe.fluid.density * ureg.gravity
+                                  * diameter**2))
+        self.assertAlmostEqual(self.pipe.calculate_loss(flow).to('ft').m,
+                               expected.to('ft').m, places = 9)
+        self.assertEqual(self.pipe.calculate_loss(0 * ureg.gpm).m, 0)
+        self.assertAlmostEqual(
+            self.pipe.calculate_derivative(0 * ureg.gpm).to('ft/gpm').m,
+            (expected / flow).to('ft/gpm').m, places = 9)
+
+    def test_batch_loss(self):
+        '''Tests that batch_loss agrees with calculate_loss.'''
+        flows = np.linspace(-0.02, 0.02, 7)
+        params = np.array([self.pipe.batch_parameters()] * 7)
+        losses = element_classes.Pipe.batch_loss(params, flows,
+                                                 np.full(7, 999.0),
+                                                 np.full(7, 1.12e-3))
+        for flow, loss in zip(flows, losses):
+            self.assertAlmostEqual(
+                self.pipe.calculate_loss(flow * ureg('m**3/s')).to('m').m,
+                loss, places = 9)
+
+class FittingTestCase(unittest.TestCase):
+    '''Runs unit tests on element_classes.Fitting and Resistance.'''
+    def setUp(self):
+        self.fitting = element_classes.Fitting(['-K', '0.75', '-q', '2',
+                                                '-d', '2', 'in'])
+
+    def test_init(self):
+        '''Tests the K, quantity and diameter tags.'''
+        self.assertEqual(self.fitting.k_factor, 0.75)
+        self.assertEqual(self.fitting.quantity, 2)
+        self.assertAlmostEqual(self.fitting.diameter.to('inch').m, 2.067,
+                               places = 6)
+        fitting = element_classes.Fitting(['-K', '1', '-D', '50', 'mm'])
+        self.assertEqual(fitting.quantity, 1)
+
+    def test_calculate_loss(self):
+        '''Tests that loss is q K v**2 / 2g.
+
+        50 gpm in 2 in schedule 40 pipe is 4.78 ft/s, so two fittings
+        of K 0.75 lose 1.5 * 4.78**2 / 64.35 = 0.53 ft.
+        '''
+        loss = self.fitting.calculate_loss(50 * ureg.gpm)
+        self.assertAlmostEqual(loss.to('ft').m, 0.533, delta = 0.005)
+        reverse = self.fitting.calculate_loss(-50 * ureg.gpm)
+        self.assertAlmostEqual(reverse.to('ft').m, -loss.to('ft').m,
+                               places = 9)
+
+    def test_batch_loss(self):
+        '''Tests that batch_loss and batch_derivative agree with pint.'''
+        flows = np.linspace(-0.02, 0.02, 7)
+        params = np.array([self.fitting.batch_parameters()] * 7)
+        losses = element_classes.Fitting.batch_loss(params, flows, None, None)
+        derivs = element_classes.Fitting.batch_derivative(params, flows,
+                                                          None, None)
+        for flow, loss, deriv in zip(flows, losses, derivs):
+            flow = flow * ureg('m**3/s')
+            self.assertAlmostEqual(
+                self.fitting.calculate_loss(flow).to('m').m, loss, places = 9)
+            self.assertAlmostEqual(
+                self.fitting.calculate_derivative(flow).to('s/m**2').m,
+                deriv, places = 6)
+
+    def test_resistance(self):
+        '''Tests that a Resistance is the sum of its parts.'''
+        other = element_classes.Fitting(['-K', '0.3', '-d', '3', 'in'])
+        resistance = element_classes.Resistance([self.fitting, other])
+        flow = 30 * ureg.gpm
+        self.assertAlmostEqual(
+            resistance.calculate_loss(flow).to('ft').m,
+            (self.fitting.calculate_loss(flow)
+             + other.calculate_loss(flow)).to('ft').m, places = 9)
+        self.fitting.quantity = 3
+        self.assertAlmostEqual(resistance.loss_coefficient(),
+                               self.fitting.loss_coefficient()
+                               + other.loss_coefficient())
+
+class NamedFittingTestCase(unittest.TestCase):
+    '''Runs unit tests on the fittings with K from the fittings table.'''
+    def test_elbow(self):
+        '''Tests the Elbow tags used in sample_data.pipey.'''
+        elbow = element_classes.Elbow(['-d', '2', 'in', '-q', '3'])
+        self.assertAlmostEqual(elbow.k_factor, 0.57, places = 6)
+        self.assertEqual(elbow.quantity, 3)
+        self.assertAlmostEqual(elbow.diameter.to('inch').m, 2.067, places = 6)
+        self.assertLess(
+            element_classes.Elbow(['-d', '2', 'in', '-r', 'long']).k_factor,
+            elbow.k_factor)
+        self.assertLess(
+            element_classes.Elbow(['-d', '2', 'in', '-a', '45']).k_factor,
+            elbow.k_factor)
+
+    def test_kinds(self):
+        '''Tests that each fitting reads its column of the table.'''
+        for element_class, tags, kind in (
+                (element_classes.Tee, ['-f', 'branch'], 'tee_branch'),
+                (element_classes.Valve, ['-t', 'globe'], 'globe_valve'),
+                (element_classes.Entrance, [], 'entrance_sharp'),
+                (element_classes.Exit, [], 'exit')):
+            fitting = element_class(['-d', '3', 'in'] + tags)
+            self.assertEqual(fitting.k_factor,
+                             fittings.k_factor(kind, 3))
+        self.assertRaises(KeyError, element_classes.Valve,
+                          ['-t', 'sluice', '-d', '3', 'in'])
+
+    def test_build_many(self):
+        '''Tests that build_many looks every K-factor up in one call.'''
+        tokens = [['-d', nps, 'in', '-t', kind]
+                  for nps in ('1', '2', '3')
+                  for kind in ('gate', 'globe', 'ball')]
+        calls = list()
+        lookup = fittings.k_factors
+        def counted(kinds, nps):
+            calls.append(len(kinds))
+            return lookup(kinds, nps)
+        fittings.k_factors = counted
+        try:
+            valves = element_classes.Valve.build_many(tokens)
+        finally:
+            fittings.k_factors = lookup
+        self.assertListEqual(calls, [9])
+        for valve, attributes in zip(valves, tokens):
+            self.assertEqual(valve.k_factor,
+                             element_classes.Valve(attributes).k_factor)
+        with self.assertRaises(TypeError):
+            element_classes._TableFitting(['-d', '3', 'in'])
+
+    def test_reducer(self):
+        '''Tests that a Reducer takes K and diameter at its small end.'''
+        reducer = element_classes.Reducer(['-d', '3', 'in', '-o', '2', 'in'])
+        self.assertAlmostEqual(reducer.diameter.to('inch').m, 2.067,
+                               places = 6)
+        ratio = (2.067 / 3.068)**2
+        self.assertAlmostEqual(reducer.k_factor, 0.5 * (1 - ratio),
+                               places = 6)
+
+parse_suite = unittest.TestLoader().loadTestsFromTestCase(ParseOptionsTestCase)
+pipe_suite = unittest.TestLoader().loadTestsFromTestCase(PipeTestCase)
+fitting_suite = unittest.TestLoader().loadTestsFromTestCase(FittingTestCase)
+named_suite = unittest.TestLoader().loadTestsFromTestCase(NamedFittingTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((parse_suite, pipe_suite, fitting_suite, named_suite,))
@@ -0,0 +1,319 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.element_classes as element_classes
+import pipey.engines as engines
+import pipey.instrument as instrument
+import pipey.loops as loops
+import numpy as np
+import unittest
+from pipey import ureg
+
+class SlopelessElement(element_classes.Element):
+    '''Quadratic element with neither batch_loss nor calculate_derivative'''
+    coefficient = 0.01 * ureg.feet / ureg.gpm**2
+    def calculate_loss(self, input_flow):
+        return self.coefficient * input_flow * abs(input_flow)
+
+class GGATestCase(unittest.TestCase):
+    '''Runs unit tests on engines.gga.'''
+    def setUp(self):
+        self.network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        self.compiled = self.network.compile()
+
+    def tearDown(self):
+        del self.network
+        del self.compiled
+
+    def test_matches_hybr(self):
+        '''Tests that GGA finds the same solution as MINPACK.'''
+        np.testing.assert_allclose(engines.gga(self.compiled),
+                                   engines.hybr(self.compiled),
+                                   rtol = 1e-6, atol = 1e-9)
+
+    def test_pipes(self):
+        '''Tests GGA through Network.solve on a network of Pipes.'''
+        network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+        network.solve(engine = 'gga')
+        reference = dummy_classes.build_reference(dummy_classes.LOOPED_LINES)
+        head = [n.head.to('m').m for n in network.nodes.values()]
+        np.testing.assert_allclose(head, reference.head, rtol = 1e-6)
+
+    def test_without_derivatives(self):
+        '''Tests GGA with loss slopes taken by differences.'''
+        compiled = dummy_classes.build_loop_network(SlopelessElement).compile()
+        self.assertFalse(compiled.has_derivatives)
+        np.testing.assert_allclose(engines.gga(compiled),
+                                   engines.hybr(self.compiled),
+                                   rtol = 1e-5, atol = 1e-9)
+
+    def test_unsuitable(self):
+        '''Tests that GGA refuses nodes with both head and continuity.'''
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        network.nodes['B'].head = 90 * ureg.feet
+        with self.assertRaises(ValueError):
+            engines.gga(network.compile())
+
+class NewtonTestCase(unittest.TestCase):
+    '''Runs unit tests on engines.newton.'''
+    def setUp(self):
+        self.network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        self.compiled = self.network.compile()
+
+    def tearDown(self):
+        del self.network
+        del self.compiled
+
+    def test_pattern(self):
+        '''Tests that the assembled Jacobian matches jacobian.'''
+        x = np.linspace(1e-3, 5e-3, self.compiled.n_unknowns)
+        flow, _ = self.compiled.expand(x)
+        pattern = engines.JacobianPattern(self.compiled)
+        np.testing.assert_allclose(
+            pattern.assemble(self.compiled.loss_derivatives(flow)).toarray(),
+            self.compiled.jacobian(x).toarray())
+
+    def test_matches_hybr(self):
+        '''Tests that Newton finds the same solution as MINPACK.'''
+        np.testing.assert_allclose(engines.newton(self.compiled),
+                                   engines.hybr(self.compiled),
+                                   rtol = 1e-6, atol = 1e-9)
+
+    def test_reuse(self):
+        '''Tests that only the ordering is kept for re-solves and copies.'''
+        with instrument.Recorder() as recorder:
+            report = self.compiled.solve('newton')
+        pattern = self.compiled.solver_cache['newton']
+        order = pattern.solver.order
+        self.assertIsNotNone(order)
+        # Every linear pass and step factorizes, in node_ordering order
+        self.assertEqual(recorder.counters['factorizations'],
+                         engines.LINEAR_PASSES + report.iterations)
+        self.assertEqual(recorder.counters['orderings'], 0)
+        other = self.compiled.copy()
+        other.outflow[2] *= 2
+        with instrument.Recorder() as recorder:
+            report = other.solve('newton')
+        self.assertIs(other.solver_cache['newton'], pattern)
+        self.assertIs(pattern.solver.order, order)
+        # The copy starts from the solved flows, so it isn't seeded
+        self.assertEqual(recorder.counters['factorizations'],
+                         report.iterations)
+        self.assertEqual(recorder.counters['orderings'], 0)
+        np.testing.assert_allclose(other.residuals(other.initial_guess()),
+                                   0, atol = 1e-6)
+
+    def test_pattern_solver(self):
+        '''Tests that PatternSolver orders once and factorizes each time.'''
+        x = np.linspace(1e-3, 5e-3, self.compiled.n_unknowns)
+        matrix = self.compiled.jacobian(x).tocsc()
+        rhs = np.arange(1., self.compiled.n_unknowns + 1)
+        solver = engines.PatternSolver('MMD_AT_PLUS_A')
+        with instrument.Recorder() as recorder:
+            for scale in (1, 2, 3):
+                np.testing.assert_allclose(matrix @ solver.solve(
+                    scale * matrix, rhs), rhs / scale, rtol = 1e-9)
+        self.assertEqual(recorder.counters['orderings'], 1)
+        self.assertEqual(recorder.counters['factorizations'], 3)
+
+    def test_pipes(self):
+        '''Tests Newton through Network.solve on a network of Pipes.'''
+        network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+        network.solve(engine = 'newton')
+        reference = dummy_classes.build_reference(dummy_classes.LOOPED_LINES)
+        flow = [s.flow.to('m**3/s').m for s in network.segments.values()]
+        np.testing.assert_allclose(flow, reference.flow, rtol = 1e-6)
+
+# Two reservoirs at different heads joined through a loop
+TWO_RESERVOIRS = (dummy_classes.segment('1', 'A', 'B', 3, 100)
+                  + dummy_classes.segment('2', 'B', 'C')
+                  + dummy_classes.segment('3', 'C', 'E', 2, 80)
+                  + dummy_classes.segment('4', 'B', 'D', 1)
+                  + dummy_classes.segment('5', 'D', 'C', 1)
+                  + ('node A', 'head 100 ft', 'unknown outflow', '',
+                     'node E', 'head 90 ft', 'unknown outflow', '',
+                     'node C', 'outflow 50 gpm', '',
+                     'node D', 'outflow 5 gpm'))
+
+class LoopTestCase(unittest.TestCase):
+    '''Runs unit tests on loops.LoopBasis and engines.loop.'''
+    def setUp(self):
+        self.compiled = dummy_classes.build_network(TWO_RESERVOIRS).compile()
+
+    def tearDown(self):
+        del self.compiled
+
+    def test_basis(self):
+        '''Tests that loops are closed and tree flows meet the demands.'''
+        c = self.compiled
+        basis = loops.LoopBasis(c)
+        # One loop B-D-C-B and one path from A to E through B and C
+        self.assertEqual(basis.loops.shape, (2, 5))
+        np.testing.assert_array_equal(
+            (c.incidence @ basis.loops.T)[c.head_unknowns].toarray(), 0)
+        flow = basis.tree_flows(c.outflow)
+        np.testing.assert_allclose((c.incidence @ flow)[c.continuity],
+                                   c.outflow[c.continuity])
+        self.assertTrue(np.all(flow[basis.chords] == 0))
+
+    def test_matches_hybr(self):
+        '''Tests that the loop method finds the same solution as MINPACK.'''
+        np.testing.assert_allclose(engines.loop(self.compiled),
+                                   engines.hybr(self.compiled),
+                                   rtol = 1e-6, atol = 1e-9)
+
+    def test_loop_network(self):
+        '''Tests the loop method through Network.solve.'''
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        network.solve(engine = 'loop')
+        reference = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        reference.solve()
+        for name in network.segments:
+            self.assertAlmostEqual(network.segments[name].flow.m,
+                                   reference.segments[name].flow.m,
+                                   places = 4)
+
+    def test_unreachable(self):
+        '''Tests that nodes cut off from every known head are refused.'''
+        network = dummy_classes.build_network(TWO_RESERVOIRS)
+        network.parse([line.split(' ') for line in
+                       dummy_classes.segment('6', 'X', 'Y')
+                       + ('node Y', 'outflow 1 gpm')])
+        with self.assertRaises(ValueError):
+            loops.LoopBasis(network.compile())
+
+class SolveTestCase(unittest.TestCase):
+    '''Runs unit tests on engines.solve.'''
+    def test_fallback(self):
+        '''Tests that hybr takes over when another engine gives up.'''
+        compiled = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement).compile()
+        limit = engines.MAX_ITERATIONS
+        engines.MAX_ITERATIONS = 1
+        try:
+            with self.assertRaises(Warning):
+                engines.gga(compiled)
+            x = engines.solve(compiled, 'gga')
+        finally:
+            engines.MAX_ITERATIONS = limit
+        np.testing.assert_allclose(x, engines.hybr(compiled))
+
+    def test_linear_guess(self):
+        '''Tests that a seeded solve starts closer and takes fewer steps.'''
+        compiled = dummy_classes.build_network(
+            dummy_classes.LOOPED_LINES).compile()
+        cold = compiled.copy()
+        warm = compiled.copy()
+        self.assertTrue(engines.seed(warm))
+        self.assertFalse(engines.seed(warm))
+        self.assertLess(np.linalg.norm(warm.scaled_residuals(
+                            warm.initial_guess() / warm.x_scale)),
+                        0.1 * np.linalg.norm(cold.scaled_residuals(
+                            cold.initial_guess() / cold.x_scale)))
+        steps = list()
+        for network in (cold, warm):
+            report = instrument.SolveReport('newton')
+            x = engines.newton(network, report)
+            steps.append(report.iterations)
+        self.assertLess(steps[1], steps[0])
+        np.testing.assert_allclose(x, engines.hybr(compiled), atol = 1e-9)
+
+    def test_legacy_guess(self):
+        '''Tests that the pint-based solve starts from the linear guess.'''
+        network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+        network._find_unknowns()
+        compiled = network.compile()
+        np.testing.assert_allclose(
+            network._initial_guess(),
+            engines.linear_guess(compiled) / compiled.x_scale)
+
+    def test_continuation(self):
+        '''Tests that ramping the demands gives the same solution.'''
+        compiled = dummy_classes.build_network(
+            dummy_classes.LOOPED_LINES).compile()
+        outflow = compiled.outflow.copy()
+        x = engines.continuation(compiled, engines.gga,
+                                 instrument.SolveReport('gga'))
+        np.testing.assert_array_equal(compiled.outflow, outflow)
+        self.assertFalse(compiled.initial_guess().any())
+        np.testing.assert_allclose(x, engines.hybr(compiled), atol = 1e-9)
+
+    def test_hybr_without_derivatives(self):
+        '''Tests that hybr gets a differenced Jacobian without derivatives.'''
+        compiled = dummy_classes.build_loop_network(SlopelessElement).compile()
+        reference = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement).compile()
+        self.assertFalse(compiled.has_derivatives)
+        x = np.linspace(1e-3, 5e-3, compiled.n_unknowns)
+        np.testing.assert_allclose(compiled.jacobian(x).toarray(),
+                                   reference.jacobian(x).toarray(),
+                                   rtol = 1e-5)
+        with instrument.Recorder() as recorder:
+            report = instrument.SolveReport('hybr')
+            x = engines.hybr(compiled, report)
+        # One losses evaluation per residual and two per Jacobian
+        jacobians = recorder.counters['jacobians']
+        self.assertGreater(jacobians, 0)
+        self.assertEqual(recorder.counters['losses'],
+                         report.iterations + 2 * jacobians)
+        np.testing.assert_allclose(x, engines.hybr(reference),
+                                   rtol = 1e-6, atol = 1e-9)
+
+    def test_default_engine(self):
+        '''Tests that solves use a sparse engine unless told otherwise.'''
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        compiled = network.compile()
+        self.assertEqual(engines.default_engine(compiled), 'gga')
+        self.assertEqual(compiled.copy().solve().engine, 'gga')
+        self.assertEqual(compiled.copy().solve_split().engine, 'gga')
+        self.assertEqual(network.solve(compiled = True).engine, 'gga')
+        # Known heads at nodes with continuity equations rule out gga;
+        # an unknown outflow at D keeps the system square
+        network = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement)
+        network.nodes['B'].head = 90 * ureg.feet
+        network.nodes['D'].outflow = None
+        compiled = network.compile()
+        self.assertEqual(engines.default_engine(compiled), 'newton')
+        report = instrument.SolveReport('newton')
+        x = engines.solve(compiled, report = report)
+        self.assertIsNone(report.fallback)
+        np.testing.assert_allclose(x, engines.hybr(compiled),
+                                   rtol = 1e-6, atol = 1e-9)
+
+    def test_unknown_engine(self):
+        '''Tests that unknown engine names raise ValueError.'''
+        compiled = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement).compile()
+        with self.assertRaises(ValueError):
+            compiled.solve('newton-raphson-9000')
+
+gga_suite = unittest.TestLoader().loadTestsFromTestCase(GGATestCase)
+newton_suite = unittest.TestLoader().loadTestsFromTestCase(NewtonTestCase)
+loop_suite = unittest.TestLoader().loadTestsFromTestCase(LoopTestCase)
+solve_suite = unittest.TestLoader().loadTestsFromTestCase(SolveTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((gga_suite, newton_suite, loop_suite, solve_suite))
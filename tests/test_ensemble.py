@@ -0,0 +1,99 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.compiled as compiled
+import pipey.element_classes as element_classes
+import pipey.engines as engines
+import pipey.ensemble as ensemble
+import numpy as np
+import unittest
+from pipey import ureg
+
+SIZE = 20
+
+class EnsembleTestCase(unittest.TestCase):
+    '''Runs unit tests on ensemble.Ensemble.'''
+    def setUp(self):
+        self.network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+        self.ensemble = ensemble.Ensemble(self.network, SIZE)
+        rng = np.random.default_rng(0)
+        params = self.ensemble.parameters(element_classes.Pipe)
+        params[:, :, 2] *= rng.lognormal(0, 0.5, params.shape[:2])
+        params[:, :, 1] *= rng.uniform(0.9, 1.1, params.shape[:2])
+        self.ensemble.set_outflow('C', rng.uniform(0, 40, SIZE) * ureg.gpm)
+        self.ensemble.set_head('A', 100 * ureg.feet)
+
+    def test_solve(self):
+        '''Tests that every scenario matches solving it on its own.'''
+        report = self.ensemble.solve()
+        self.assertTrue(report.converged)
+        self.assertTrue(self.ensemble.converged.all())
+        self.assertEqual(report.iterations, self.ensemble.iterations.max())
+        base = self.network.compile()
+        for k in range(SIZE):
+            single = base.copy()
+            single.groups = [
+                compiled.BatchGroup(g.element_class, g.segment_index,
+                                    self.ensemble.params[i][k])
+                for i, g in enumerate(base.groups)]
+            single.outflow = self.ensemble.outflow[k].copy()
+            single.solve('newton')
+            np.testing.assert_allclose(self.ensemble.flow[k], single.flow,
+                                       rtol = 1e-6, atol = 1e-9)
+            np.testing.assert_allclose(self.ensemble.head[k], single.head,
+                                       rtol = 1e-6, atol = 1e-6)
+
+    def test_masking(self):
+        '''Tests that scenarios that are already solved take no steps.'''
+        self.ensemble.solve()
+        self.ensemble.set_outflow('C', np.r_[self.ensemble.outflow[:-1, 2],
+                                             0.002] * ureg('m**3/s'))
+        self.ensemble.solve()
+        self.assertListEqual(list(self.ensemble.iterations[:-1]),
+                             [0] * (SIZE - 1))
+        self.assertGreater(self.ensemble.iterations[-1], 0)
+
+    def test_failure(self):
+        '''Tests that unfinished scenarios are reported, not raised.'''
+        limit = engines.MAX_ITERATIONS
+        engines.MAX_ITERATIONS = 1
+        try:
+            report = self.ensemble.solve()
+        finally:
+            engines.MAX_ITERATIONS = limit
+        self.assertFalse(report.converged)
+        self.assertEqual(report.iterations, 1)
+        self.assertIn('of {} scenarios'.format(SIZE), report.message)
+        self.assertFalse(self.ensemble.converged.all())
+
+    def test_errors(self):
+        '''Tests that unknown values and classes can't be set.'''
+        with self.assertRaises(ValueError):
+            self.ensemble.set_outflow('A', 5 * ureg.gpm)
+        with self.assertRaises(ValueError):
+            self.ensemble.set_head('C', 5 * ureg.feet)
+        with self.assertRaises(KeyError):
+            self.ensemble.parameters(element_classes.Fitting)
+        self.assertEqual(len(self.ensemble.segments(element_classes.Pipe)),
+                         len(self.network.segments))
+
+ensemble_suite = unittest.TestLoader().loadTestsFromTestCase(EnsembleTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((ensemble_suite,))
@@ -0,0 +1,97 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.extended as extended
+import numpy as np
+import unittest
+from pipey import ureg
+
+# The first three segments of dummy_classes.PIPE_LINES, with a tank at
+# the end of the third
+LINES = (dummy_classes.segment('1', 'A', 'B', 3, 100)
+         + dummy_classes.segment('2', 'B', 'C')
+         + dummy_classes.segment('3', 'B', 'T', 2, 80)
+         + ('node A', 'head 100 ft', 'unknown outflow', '',
+            'node C', 'outflow 30 gpm', '',
+            'node T', 'head 40 ft', 'unknown outflow'))
+
+class SimulateTestCase(unittest.TestCase):
+    '''Runs unit tests on extended.simulate.'''
+    def setUp(self):
+        self.network = dummy_classes.build_network(LINES)
+        self.demand = np.array([10, 40, 80, 20]) * ureg.gpm
+        self.tank = extended.Tank(20 * ureg('ft**2'), 5 * ureg.ft,
+                                  35 * ureg.ft)
+
+    def tearDown(self):
+        del self.network
+
+    def test_demands(self):
+        '''Tests that each step matches a solve of that step alone.'''
+        result = extended.simulate(self.network, 4, 60 * ureg.s,
+                                   demands = {'C': self.demand})
+        self.assertEqual(result.flow.shape, (4, 3))
+        self.assertEqual(result.head.shape, (4, 4))
+        np.testing.assert_allclose(result.times, [0, 60, 120, 180])
+        for k, demand in enumerate(self.demand):
+            network = dummy_classes.build_network(LINES)
+            network.nodes['C'].outflow = demand
+            network.solve()
+            flow = [s.flow.to('m**3/s').m for s in network.segments.values()]
+            np.testing.assert_allclose(result.flow[k], flow, rtol = 1e-6)
+        # The Network itself is left as it was
+        self.assertEqual(self.network.nodes['C'].outflow, 30 * ureg.gpm)
+
+    def test_tank(self):
+        '''Tests that tank levels follow the flow into the tank.'''
+        result = extended.simulate(self.network, 5, 30 * ureg.s,
+                                   tanks = {'T': self.tank})
+        area = (20 * ureg('ft**2')).to('m**2').m
+        inflow = result.flow[:, 2]
+        self.assertTrue(np.all(inflow > 0))
+        np.testing.assert_allclose(np.diff(result.levels[:, 0]),
+                                   inflow * 30 / area)
+        t = list(result.node_names).index('T')
+        np.testing.assert_allclose(result.head[:, t],
+                                   (35 * ureg.ft).to('m').m
+                                   + result.levels[:-1, 0])
+        # Rising tank head means less and less flow into it
+        self.assertTrue(np.all(np.diff(inflow) < 0))
+
+    def test_dtype(self):
+        '''Tests that results can be stored at lower precision.'''
+        result = extended.simulate(self.network, 2, 60,
+                                   demands = {'C': [0.001, 0.002]},
+                                   dtype = np.float32)
+        self.assertEqual(result.flow.dtype, np.float32)
+
+    def test_bad_nodes(self):
+        '''Tests that demands and tanks must suit their nodes.'''
+        with self.assertRaises(ValueError):
+            extended.simulate(self.network, 2, 60, demands = {'A': [0, 0]})
+        with self.assertRaises(ValueError):
+            extended.simulate(self.network, 2, 60, demands = {'C': [0]})
+        with self.assertRaises(ValueError):
+            extended.simulate(self.network, 2, 60,
+                              tanks = {'C': self.tank})
+
+simulate_suite = unittest.TestLoader().loadTestsFromTestCase(SimulateTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((simulate_suite,))
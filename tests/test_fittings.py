@@ -0,0 +1,77 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+import pipey.fittings as fittings
+import numpy as np
+import unittest
+
+class FittingTableTestCase(unittest.TestCase):
+    '''Runs unit tests on fittings.FittingTable and its helpers.'''
+    def test_shared_table(self):
+        '''Tests that the table is only read once.'''
+        self.assertIs(fittings.get_table(), fittings.get_table())
+
+    def test_lookup(self):
+        '''Tests lookup by NPS name and by number of inches.
+
+        A standard 2 in elbow is 30 f_T with f_T = 0.019.
+        '''
+        table = fittings.get_table()
+        self.assertAlmostEqual(table.lookup('elbow_90', '2'), 0.57,
+                               places = 6)
+        self.assertEqual(table.lookup('gate_valve', 1.5),
+                         table.lookup('gate_valve', '1-1/2'))
+        self.assertEqual(table.lookup('exit', 24), 1)
+        # Butterfly valves get relatively better in larger sizes
+        self.assertGreater(table.lookup('butterfly_valve', 8)
+                           / table.friction[table._row(8)],
+                           table.lookup('butterfly_valve', 20)
+                           / table.friction[table._row(20)])
+
+    def test_lookup_missing(self):
+        '''Tests that unknown types or sizes raise KeyError.'''
+        table = fittings.get_table()
+        self.assertRaises(KeyError, table.lookup, 'elbow_30', '2')
+        self.assertRaises(KeyError, table.lookup, 'elbow_90', '2-3/4')
+        self.assertRaises(KeyError, table.lookup, 'elbow_90', '1/8')
+
+    def test_lookup_many(self):
+        '''Tests bulk lookup against single lookups.'''
+        kinds = ['elbow_90', 'tee_branch', 'globe_valve', 'exit'] * 1000
+        sizes = ['2', 3, '1-1/4', 12] * 1000
+        k = fittings.k_factors(kinds, sizes)
+        self.assertEqual(k.shape, (4000,))
+        for i in range(4):
+            self.assertEqual(k[i], fittings.k_factor(kinds[i], sizes[i]))
+
+    def test_reducers(self):
+        '''Tests sudden and gradual contractions and expansions.'''
+        k = fittings.reducer_k_factors([2, 1, 2, 1, 2], [1, 2, 2, 2, 1],
+                                       [180, 180, 180, 30, 30])
+        self.assertAlmostEqual(k[0], 0.5 * 0.75, places = 9)
+        self.assertAlmostEqual(k[1], 0.75**2, places = 9)
+        self.assertEqual(k[2], 0)
+        self.assertLess(k[3], k[1])
+        self.assertLess(k[4], k[0])
+        self.assertTrue(np.all(k >= 0))
+
+fitting_table_suite = unittest.TestLoader().loadTestsFromTestCase(
+    FittingTableTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((fitting_table_suite,))
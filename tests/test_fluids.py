@@ -0,0 +1,158 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.core as core
+import pipey.ensemble as ensemble
+import pipey.fluids as fluids
+import pipey.instrument as instrument
+import numpy as np
+import os
+import tempfile
+import unittest
+from pipey import ureg
+
+class FluidTableTestCase(unittest.TestCase):
+    '''Runs unit tests on fluids.FluidTable.'''
+    def setUp(self):
+        self.table = fluids.FluidTable(fluids.FLUID_FILE.format('water'))
+
+    def test_builtin(self):
+        '''Tests that every built-in table reads and is shared.'''
+        for name in fluids.FLUIDS:
+            table = fluids.get_table(name)
+            self.assertIs(fluids.get_table(name), table)
+            self.assertTrue(np.all(np.diff(table._log_viscosity) < 0))
+        with self.assertRaises(KeyError):
+            fluids.get_table('mercury')
+
+    def test_properties(self):
+        '''Tests interpolation at and between rows of the table.'''
+        density, viscosity = self.table.properties(
+            np.array([[293.15, 295.65], [373.15, 273.15]]))
+        self.assertEqual(density.shape, (2, 2))
+        np.testing.assert_allclose(density, [[998.21, 997.63],
+                                             [958.35, 999.84]])
+        # Viscosity is interpolated geometrically
+        np.testing.assert_allclose(viscosity, [[1.002e-3,
+                                                np.sqrt(1.002 * 0.890) * 1e-3],
+                                               [0.282e-3, 1.792e-3]])
+        self.assertEqual(self.table.properties(293.15)[0].shape, ())
+        with self.assertRaises(ValueError):
+            self.table.properties([300, 400])
+
+    def test_cache(self):
+        '''Tests that each temperature is only interpolated once.'''
+        temperature = np.repeat([280.0, 300.0, 320.0], 100)
+        with instrument.Recorder() as recorder:
+            first = self.table.properties(temperature)
+            second = self.table.properties(temperature[::-1])
+            self.table.properties([300.0, 330.0])
+        self.assertEqual(recorder.counters['fluid_properties'], 4)
+        np.testing.assert_array_equal(first[0], second[0][::-1])
+
+    def test_user_table(self):
+        '''Tests a CSV in other units with its columns out of order.'''
+        with tempfile.NamedTemporaryFile('w', suffix = '.csv',
+                                         delete = False) as f:
+            f.write('viscosity,temperature,density\n'
+                    'cP,degF,lb/ft**3\n'
+                    '1.5,40,62.4\n1.0,70,62.3\n')
+        try:
+            table = fluids.get_table(f.name)
+            self.assertIs(fluids.get_table(f.name), table)
+        finally:
+            os.remove(f.name)
+        density, viscosity = table.properties(
+            ureg.Quantity(70, ureg.degF).to('K').m)
+        self.assertAlmostEqual(float(density),
+                               (62.3 * ureg('lb/ft**3')).to('kg/m**3').m)
+        self.assertAlmostEqual(float(viscosity), 1e-3)
+
+class FluidTestCase(unittest.TestCase):
+    '''Runs unit tests on core.Fluid.'''
+    def test_add_details(self):
+        '''Tests the lines of a fluid block.'''
+        fluid = core.Fluid()
+        fluid.add_details(['type', 'ethylene_glycol_50'])
+        self.assertAlmostEqual(fluid.temperature.to('degF').m, 60)
+        fluid.add_details(['temperature', '20', 'degC'])
+        self.assertAlmostEqual(fluid.density.to('kg/m**3').m, 1069)
+        self.assertAlmostEqual(fluid.viscosity.to('cP').m, 3.4)
+        fluid.add_details(['density', '1', 'g/cm**3'])
+        self.assertAlmostEqual(fluid.density.to('kg/m**3').m, 1000)
+        with self.assertRaises(ValueError):
+            fluid.add_details(['colour', 'blue'])
+        # Without a type the default stands in for any temperature
+        density, viscosity = core.Fluid().properties(
+            ureg.Quantity(np.zeros(3), ureg.degC))
+        np.testing.assert_allclose(density, 999.0)
+        np.testing.assert_allclose(viscosity, 1.12e-3)
+
+    def test_parse(self):
+        '''Tests that a fluid block changes the solution.'''
+        warm = dummy_classes.build_network(dummy_classes.LOOPED_LINES + (
+            '', 'fluid', 'type propylene_glycol_50', 'temperature 80 degC'))
+        cold = dummy_classes.build_network(dummy_classes.LOOPED_LINES + (
+            '', 'fluid', 'type propylene_glycol_50', 'temperature 0 degC'))
+        warm.solve()
+        cold.solve()
+        # Thicker fluid loses more head on its way to H
+        self.assertGreater(warm.nodes['H'].head.to('ft').m,
+                           cold.nodes['H'].head.to('ft').m + 1)
+
+    def test_sweep(self):
+        '''Tests that resolve follows temperature without compiling again.'''
+        network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+        network.resolve()
+        compiled = network._compiled
+        for degrees in (5, 40, 90):
+            temperature = ureg.Quantity(degrees, ureg.degC)
+            network.set_temperature(temperature)
+            network.resolve()
+            self.assertIs(network._compiled, compiled)
+            reference = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+            reference.fluid.set_temperature(temperature)
+            reference.resolve()
+            np.testing.assert_allclose(compiled.flow,
+                                       reference._compiled.flow,
+                                       rtol = 1e-6, atol = 1e-9)
+
+    def test_ensemble(self):
+        '''Tests per scenario temperatures in an ensemble.Ensemble.'''
+        network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+        fluid = core.Fluid()
+        fluid.set_type('water')
+        scenarios = ensemble.Ensemble(network, 3)
+        temperature = ureg.Quantity([5.0, 40.0, 90.0], ureg.degC)
+        scenarios.set_temperature(fluid, temperature)
+        density, viscosity = fluid.properties(temperature)
+        np.testing.assert_array_equal(scenarios.density[:, 0], density)
+        np.testing.assert_array_equal(scenarios.viscosity[:, -1], viscosity)
+        self.assertTrue(scenarios.solve().converged)
+        compiled = network.compile()
+        compiled.set_fluid(fluid, temperature[2])
+        compiled.solve('newton')
+        np.testing.assert_allclose(scenarios.flow[2], compiled.flow,
+                                   rtol = 1e-6, atol = 1e-9)
+
+table_suite = unittest.TestLoader().loadTestsFromTestCase(FluidTableTestCase)
+fluid_suite = unittest.TestLoader().loadTestsFromTestCase(FluidTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((table_suite, fluid_suite))
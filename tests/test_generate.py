@@ -0,0 +1,140 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+import pipey.benchmark as benchmark
+import pipey.generate as generate
+import pipey.core as core
+import pipey.engines as engines
+import pipey.instrument as instrument
+import pipey.utils as utils
+import json
+import math
+import os
+import tempfile
+import unittest
+
+class GenerateTestCase(unittest.TestCase):
+    '''Runs unit tests on pipey.generate.'''
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'net.pipey')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, segments):
+        generate.write(self.filename, segments)
+        network = core.Network()
+        network.load(self.filename)
+        return network
+
+    def test_shapes(self):
+        '''Tests the number of segments and loops of each kind.'''
+        self.assertEqual(len(generate.grid(3, 4)), 1 + 3 * 3 + 2 * 4)
+        self.assertEqual(len(generate.tree(20)), 20)
+        segments = generate.looped(20, 4)
+        self.assertEqual(len(segments), 24)
+        self.assertEqual(segments, generate.looped(20, 4))
+        self.assertNotEqual(segments, generate.looped(20, 4, seed = 1))
+
+    def test_files_solve(self):
+        '''Tests that generated files load and solve.'''
+        for segments in (generate.grid(3, 3), generate.looped(30, 3)):
+            network = self.load(segments)
+            self.assertEqual(len(network.segments), len(segments))
+            self.assertIsNone(network.nodes[generate.RESERVOIR].outflow)
+            network.solve(engine = 'gga')
+            for node in network.nodes.values():
+                self.assertIsNotNone(node.head)
+
+    def test_turbulent(self):
+        '''Tests that pipes sized for their flows run turbulent.
+
+        Every segment of a tree carries its design flow. Segments that
+        close loops can carry little, so only most of them are checked
+        in looped networks.
+        '''
+        for segments, share in ((generate.tree(50), 1),
+                                (generate.grid(6, 6), 0.9),
+                                (generate.looped(100, 5), 0.9)):
+            network = self.load(segments)
+            network.solve(engine = 'gga')
+            reynolds = list()
+            for segment in network.segments.values():
+                diameter = segment.elements[0].diameter
+                velocity = abs(segment.flow) / (math.pi / 4 * diameter**2)
+                reynolds.append((segment.fluid.density * velocity * diameter
+                                 / segment.fluid.viscosity).to('').m)
+            turbulent = sum(r > utils.LAMINAR_LIMIT for r in reynolds)
+            self.assertGreaterEqual(turbulent, share * len(reynolds))
+
+    def test_design_sizes(self):
+        '''Tests that each flow gets the smallest size fast enough.'''
+        # 2 in schedule 40 carries 104.6 gpm at 10 ft/s
+        self.assertListEqual(generate.design_sizes([104, 105, 1e6], 10),
+                             ['2', '3', generate.NOMINAL_SIZES[-1]])
+        flows = generate.design_flows(
+            [('R', 'A'), ('A', 'B'), ('A', 'C'), ('B', 'C')],
+            {'A': 1., 'B': 2., 'C': 4.})
+        self.assertListEqual(flows, [7., 2., 4., 4.])
+
+class BenchmarkTestCase(unittest.TestCase):
+    '''Runs unit tests on pipey.benchmark.'''
+    def test_main(self):
+        '''Tests that main writes records for every kind and engine.'''
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            benchmark.main(['--sizes', '16', '--engines', 'gga', 'hybr',
+                            '--pint-limit', '0', '--directory', directory,
+                            '-o', output])
+            with open(output) as f:
+                results = json.load(f)
+            cold = dict()
+            for kind in benchmark.KINDS:
+                network = core.Network()
+                network.load(os.path.join(directory,
+                                          '{}_16.pipey'.format(kind)))
+                report = instrument.SolveReport('gga')
+                engines.gga(network.compile(), report)
+                cold[kind] = report.iterations
+        records = results['records']
+        self.assertEqual(sorted(r['kind'] for r in records),
+                         sorted(benchmark.KINDS))
+        for record in records:
+            self.assertGreater(record['parse_seconds'], 0)
+            self.assertGreater(record['parse_peak_bytes'], 0)
+            self.assertNotIn('pint_solve_seconds', record)
+            self.assertEqual([s['engine'] for s in record['solves']],
+                             ['gga', 'hybr'])
+            for solve in record['solves']:
+                self.assertGreater(solve['iterations'], 0)
+                self.assertIsNone(solve['fallback'])
+                self.assertGreater(solve['counters']['losses'], 0)
+                self.assertGreater(solve['peak_bytes'], 0)
+            # The linear guess every solve is seeded with saves GGA steps
+            gga = record['solves'][0]
+            self.assertLessEqual(gga['residual_norm'],
+                                 utils.RESIDUAL_TOLERANCE)
+            self.assertLess(gga['iterations'], cold[record['kind']])
+
+generate_suite = unittest.TestLoader().loadTestsFromTestCase(GenerateTestCase)
+benchmark_suite = unittest.TestLoader().loadTestsFromTestCase(
+    BenchmarkTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((generate_suite, benchmark_suite))
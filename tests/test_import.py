@@ -0,0 +1,62 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+import os
+import subprocess
+import sys
+import unittest
+
+# Cold import budget in seconds for "import pipey.core". Importing numpy
+# accounts for nearly all of it; pint and scipy used to add ~1 second.
+IMPORT_BUDGET = 0.5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_fresh(code):
+    '''Runs code in a new interpreter and returns its stripped stdout.'''
+    return subprocess.check_output([sys.executable, '-c', code],
+                                   cwd = ROOT).decode().strip()
+
+class ImportTestCase(unittest.TestCase):
+    '''Checks that importing pipey stays cheap.'''
+    def test_lazy_modules(self):
+        '''Tests that pint and scipy aren't imported until used.'''
+        loaded = run_fresh('import sys, pipey.core; '
+                           'print(sorted(m for m in ("pint", "scipy") '
+                           'if m in sys.modules))')
+        self.assertEqual(loaded, '[]')
+
+    def test_ureg(self):
+        '''Tests that the lazy ureg works like a pint.UnitRegistry.'''
+        from pipey import ureg
+        self.assertAlmostEqual((1 * ureg.gpm).to(ureg('gallon / hour')).m,
+                               60, places = 9)
+        self.assertIsInstance(3 * ureg.feet, ureg.Quantity)
+
+    def test_import_time(self):
+        '''Tests that cold import of pipey.core is within IMPORT_BUDGET.'''
+        elapsed = min(float(run_fresh('import time; t = time.perf_counter(); '
+                                      'import pipey.core; '
+                                      'print(time.perf_counter() - t)'))
+                      for i in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+import_suite = unittest.TestLoader().loadTestsFromTestCase(ImportTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((import_suite,))
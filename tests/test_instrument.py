@@ -0,0 +1,123 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+from . import test_compiled
+import pipey.engines as engines
+import pipey.instrument as instrument
+import pipey.utils as utils
+import json
+import unittest
+
+class ReportTestCase(unittest.TestCase):
+    '''Runs unit tests on the reports returned by solves.'''
+    def test_report(self):
+        '''Tests that solve returns a report of every step it took.'''
+        steps = list()
+        report = dummy_classes.build_network(dummy_classes.LOOPED_LINES).solve(
+            engine = 'newton', callback = lambda *args: steps.append(args))
+        self.assertTrue(report.converged)
+        self.assertEqual(report.engine, 'newton')
+        self.assertGreater(report.iterations, 0)
+        self.assertEqual(len(report.history), report.iterations)
+        self.assertEqual([s[1:] for s in steps], report.history)
+        self.assertIs(steps[0][0], report)
+        self.assertTrue(utils.converged([report.residual_norm]))
+        # Nothing was recording, so nothing was counted
+        self.assertEqual(report.counters, dict())
+        json.dumps(report.as_dict())
+
+    def test_legacy_report(self):
+        '''Tests that the pint-based solve reports each evaluation.'''
+        report = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement).solve(compiled = False)
+        self.assertTrue(report.converged)
+        self.assertEqual(report.engine, 'hybr')
+        self.assertGreater(report.iterations, 1)
+
+    def test_split_report(self):
+        '''Tests that split solves report every piece.'''
+        report = dummy_classes.build_network(test_compiled.SPLIT_LINES).solve(
+            split = True, engine = 'gga')
+        self.assertTrue(report.converged)
+        self.assertGreater(len(report.pieces), 1)
+        self.assertEqual(report.iterations,
+                         sum(p.iterations for p in report.pieces))
+
+    def test_failure(self):
+        '''Tests that a failed solve raises its report.'''
+        compiled = dummy_classes.build_loop_network(
+            dummy_classes.DummyBatchQuadraticElement).compile()
+        calls = list()
+        def give_up(network, report = None):
+            calls.append(network)
+            raise Warning('gave up')
+        limit, hybr = engines.MAX_ITERATIONS, engines.hybr
+        engines.MAX_ITERATIONS = 1
+        engines.hybr = give_up
+        try:
+            with self.assertRaises(instrument.ConvergenceWarning) as cm:
+                compiled.solve('gga')
+        finally:
+            engines.MAX_ITERATIONS, engines.hybr = limit, hybr
+        report = cm.exception.report
+        self.assertFalse(report.converged)
+        # gga gave up, then hybr, then gga again on the lowest demands
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(report.fallback, 'continuation')
+        self.assertEqual(report.iterations, 2)
+        self.assertIn('GGA did not converge', report.message)
+
+class RecorderTestCase(unittest.TestCase):
+    '''Runs unit tests on instrument.Recorder.'''
+    def test_counters(self):
+        '''Tests that counters and phase times are kept while recording.'''
+        with instrument.Recorder() as recorder:
+            network = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+            report = network.solve(engine = 'gga')
+        self.assertIsNone(instrument.active)
+        for phase in ('parse', 'setup', 'losses', 'linear_solve'):
+            self.assertGreater(recorder.timings[phase], 0)
+        # One residual evaluation per step and one to start, at least
+        self.assertGreater(report.counters['residuals'], report.iterations)
+        self.assertEqual(report.counters['jacobians'], report.iterations)
+        self.assertGreater(report.counters['friction_factors'],
+                           len(network.segments))
+        self.assertNotIn('parse', report.timings)
+
+    def test_nesting(self):
+        '''Tests that the innermost Recorder collects.'''
+        with instrument.Recorder() as outer:
+            with instrument.Recorder() as inner:
+                instrument.count('residuals')
+            instrument.count('residuals', 2)
+            self.assertIs(instrument.active, outer)
+        self.assertEqual(inner.counters['residuals'], 1)
+        self.assertEqual(outer.counters['residuals'], 2)
+
+    def test_disabled(self):
+        '''Tests that hooks do nothing while nothing is recording.'''
+        self.assertIsNone(instrument.start())
+        instrument.stop('losses', None)
+        instrument.count('residuals')
+
+report_suite = unittest.TestLoader().loadTestsFromTestCase(ReportTestCase)
+recorder_suite = unittest.TestLoader().loadTestsFromTestCase(RecorderTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((report_suite, recorder_suite))
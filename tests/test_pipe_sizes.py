@@ -0,0 +1,62 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+import pipey.pipe_sizes as pipe_sizes
+import unittest
+
+class PipeSizeTableTestCase(unittest.TestCase):
+    '''Runs unit tests on pipe_sizes.PipeSizeTable and its helpers.'''
+    def test_shared_table(self):
+        '''Tests that the table is only read once.'''
+        self.assertIs(pipe_sizes.get_table(), pipe_sizes.get_table())
+
+    def test_lookup(self):
+        '''Tests lookup by NPS name and by number of inches.'''
+        table = pipe_sizes.get_table()
+        od, wall, inner = table.lookup('2', '40')
+        self.assertAlmostEqual(od, 2.375, places = 6)
+        self.assertAlmostEqual(wall, 0.154, places = 6)
+        self.assertAlmostEqual(inner, 2.067, places = 6)
+        self.assertEqual(table.lookup(1.5, 'STD'), table.lookup('1-1/2', 'STD'))
+        self.assertEqual(table.lookup(0.5, 80), table.lookup('1/2', 'XS'))
+
+    def test_lookup_missing(self):
+        '''Tests that unknown or unmade sizes raise KeyError.'''
+        table = pipe_sizes.get_table()
+        self.assertRaises(KeyError, table.lookup, '2-3/4', '40')
+        self.assertRaises(KeyError, table.lookup, '2', '45')
+        self.assertRaises(KeyError, table.lookup, '1/8', '160')
+
+    def test_lookup_many(self):
+        '''Tests bulk lookup against single lookups.'''
+        sizes = ['2', 3, '1-1/4', 12, '1/8'] * 100
+        schedules = ['40', '80', '160', 'STD', '160'] * 100
+        od, wall, inner = pipe_sizes.get_table().lookup_many(sizes, schedules)
+        self.assertEqual(inner.shape, (500,))
+        for i in range(4):
+            self.assertAlmostEqual(inner[i],
+                                   pipe_sizes.inner_diameter(sizes[i],
+                                                             schedules[i]),
+                                   places = 9)
+        self.assertNotEqual(inner[4], inner[4]) # NaN where not made
+
+pipe_sizes_suite = unittest.TestLoader().loadTestsFromTestCase(
+    PipeSizeTableTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((pipe_sizes_suite,))
@@ -0,0 +1,71 @@
+# Copyright 2016 Adam Beckmeyer
+# 
+# This file is part of Pipey.
+# 
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.reduction as reduction
+import numpy as np
+import unittest
+
+TREE_LINES = (dummy_classes.segment('1', 'A', 'B', 3, 100)
+              + dummy_classes.segment('2', 'C', 'B')
+              + dummy_classes.segment('3', 'B', 'D')
+              + ('node A', 'head 100 ft', 'unknown outflow', '',
+                 'node C', 'outflow 10 gpm', '', 'node D', 'outflow 20 gpm'))
+
+class ReducedNetworkTestCase(unittest.TestCase):
+    '''Runs unit tests on reduction.ReducedNetwork.'''
+    def check(self, lines, **kwargs):
+        network = dummy_classes.build_network(lines)
+        network.solve(reduce = True, **kwargs)
+        reference = dummy_classes.build_reference(lines)
+        flow = [s.flow.to('m**3/s').m for s in network.segments.values()]
+        head = [n.head.to('m').m for n in network.nodes.values()]
+        np.testing.assert_allclose(flow, reference.flow, rtol = 1e-6,
+                                   atol = 1e-12)
+        np.testing.assert_allclose(head, reference.head, rtol = 1e-6)
+
+    def test_core(self):
+        '''Tests that only the loop is left in the core.'''
+        reduced = reduction.ReducedNetwork(
+            dummy_classes.build_network(dummy_classes.LOOPED_LINES).compile())
+        # Once the tree off D is gone, the loop is a single chain from B
+        # back round to B, leaving its flow, segment 1's flow and the
+        # head of B
+        self.assertEqual(reduced.core.n_segs, 2)
+        self.assertEqual(reduced.core.n_unknowns, 3)
+        self.assertListEqual(sorted(reduced.core.node_names), ['A', 'B'])
+        self.assertEqual(len(reduced.tree), 4)
+
+    def test_solve(self):
+        '''Tests that reduced solves match solving the whole network.'''
+        self.check(dummy_classes.LOOPED_LINES)
+        self.check(dummy_classes.LOOPED_LINES, split = True, max_workers = 0)
+
+    def test_tree(self):
+        '''Tests a network with no loops at all.'''
+        reduced = reduction.ReducedNetwork(
+            dummy_classes.build_network(TREE_LINES).compile())
+        self.assertIsNone(reduced.core)
+        self.assertEqual(reduced.n_removed, 6)
+        self.check(TREE_LINES)
+
+reduced_suite = unittest.TestLoader().loadTestsFromTestCase(
+    ReducedNetworkTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((reduced_suite,))
@@ -0,0 +1,120 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.compiled as compiled
+import pipey.core as core
+import pipey.element_classes as element_classes
+import pipey.registry as registry
+import pipey.utils as utils
+from importlib import metadata
+import numpy as np
+import unittest
+from pipey import ureg
+
+class Strainer(element_classes.BatchElement):
+    '''Third-party style element losing "-K" velocity heads at "-d"'''
+    __slots__ = ('fluid', 'k_factor', 'diameter')
+
+    def __init__(self, attributes):
+        self.fluid = None
+        options = element_classes.parse_options(attributes)
+        self.k_factor = float(options['-K'][0])
+        self.diameter = element_classes.parse_quantity(options['-d'])
+
+    def batch_parameters(self):
+        return (self.k_factor, self.diameter.to('m').m)
+
+    @classmethod
+    def batch_loss(cls, params, flow, density, viscosity):
+        k_factor, diameter = params.T
+        area = np.pi * diameter**2 / 4
+        return k_factor * flow * np.abs(flow) / (2 * 9.80665 * area**2)
+
+STRAINER = 'Strainer -K 2 -d 2 in'
+
+class RegistryTestCase(unittest.TestCase):
+    '''Runs unit tests on pipey.registry.'''
+    def tearDown(self):
+        for name in ('Strainer', 'Screen'):
+            if name in registry._registered:
+                registry.unregister(name)
+
+    def test_builtin(self):
+        '''Tests that built-in elements are found and others aren't.'''
+        self.assertIs(registry.element_class('Pipe'), element_classes.Pipe)
+        self.assertIn('Elbow', registry.names())
+        with self.assertRaises(KeyError):
+            registry.element_class('Resistance')
+        network = core.Network()
+        with self.assertRaises(utils.FormattingError):
+            network.parse([line.split(' ') for line in
+                           ('segment 1', 'Sprocket -d 2 in')])
+
+    def test_register(self):
+        '''Tests that registered elements take the compiled fast path.'''
+        registry.register('Strainer', Strainer)
+        self.assertFalse(hasattr(Strainer, 'calculate_derivative'))
+        lines = list(dummy_classes.LOOPED_LINES)
+        lines.insert(lines.index('segment 2') + 4, STRAINER)
+        network = dummy_classes.build_network(lines)
+        strainer = network.segments['2'].elements[1]
+        self.assertIsInstance(strainer, Strainer)
+        groups = network.compile().groups
+        self.assertIn(Strainer, [g.element_class for g in groups
+                                 if isinstance(g, compiled.BatchGroup)])
+        # calculate_loss comes from batch_loss
+        flow = 30 * ureg.gpm
+        velocity = flow / (np.pi * (2 * ureg.inch)**2 / 4)
+        expected = 2 * velocity**2 / (2 * ureg.gravity)
+        self.assertAlmostEqual(strainer.calculate_loss(flow).to('ft').m,
+                               expected.to('ft').m, places = 6)
+        reference = dummy_classes.build_network(lines)
+        network.solve(engine = 'gga')
+        reference.solve()
+        self.assertAlmostEqual(network.segments['2'].flow.to('gpm').m,
+                               reference.segments['2'].flow.to('gpm').m,
+                               places = 4)
+
+    def test_decorator(self):
+        '''Tests register as a decorator and its check of the class.'''
+        decorated = registry.register('Screen')(Strainer)
+        self.assertIs(decorated, Strainer)
+        self.assertIs(registry.element_class('Screen'), Strainer)
+        with self.assertRaises(TypeError):
+            registry.register('Screen', object)
+
+    def test_entry_point(self):
+        '''Tests that entry points are loaded when their name is used.'''
+        entry_point = metadata.EntryPoint(
+            'Strainer', 'tests.test_registry:Strainer',
+            registry.ENTRY_POINT_GROUP)
+        found = registry._entry_points
+        registry._entry_points = {'Strainer': entry_point}
+        try:
+            self.assertIn('Strainer', registry.names())
+            element = registry.build(STRAINER.split(' '))
+        finally:
+            registry._entry_points = found
+        self.assertIsInstance(element, Strainer)
+        self.assertEqual(element.k_factor, 2)
+
+registry_suite = unittest.TestLoader().loadTestsFromTestCase(RegistryTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((registry_suite,))
@@ -0,0 +1,156 @@
+# Copyright 2016 Adam Beckmeyer
+#
+# This file is part of Pipey.
+#
+# Pipey is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Pipey is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with Pipey.  If not, see <http://www.gnu.org/licenses/>.
+
+from .context import pipey
+from . import dummy_classes
+import pipey.core as core
+import pipey.element_classes as element_classes
+import pipey.generate as generate
+import os
+import tempfile
+import tracemalloc
+import unittest
+from pipey import ureg
+
+class CompactTestCase(unittest.TestCase):
+    '''Runs unit tests on Networks backed by a store.NetworkStore.'''
+    def setUp(self):
+        self.network = dummy_classes.build_network(
+            dummy_classes.LOOPED_LINES, compact = True)
+        self.reference = dummy_classes.build_network(
+            dummy_classes.LOOPED_LINES)
+
+    def test_attributes(self):
+        '''Tests that views answer like PipeSegment and Node objects.'''
+        self.assertListEqual(list(self.network.segments),
+                             list(self.reference.segments))
+        self.assertListEqual(list(self.network.nodes),
+                             list(self.reference.nodes))
+        for name, seg in self.network.segments.items():
+            reference = self.reference.segments[name]
+            self.assertIs(seg, self.network.segments[name])
+            self.assertIs(seg.start, self.network.nodes[
+                [n for n, node in self.reference.nodes.items()
+                 if node is reference.start][0]])
+            self.assertIsNone(seg.flow)
+            self.assertAlmostEqual(seg.elements[0].diameter.to('inch').m,
+                                   reference.elements[0].diameter.to('inch').m)
+        for name, node in self.network.nodes.items():
+            reference = self.reference.nodes[name]
+            self.assertEqual(node.outflow, reference.outflow)
+            self.assertEqual(node.head, reference.head)
+            for attribute in ('inputs', 'outputs'):
+                self.assertListEqual(
+                    [s._index for s in getattr(node, attribute)],
+                    [list(self.reference.segments.values()).index(s)
+                     for s in getattr(reference, attribute)])
+
+    def test_solve(self):
+        '''Tests that compact and ordinary Networks solve the same.'''
+        for kwargs in (dict(compiled = False), dict()):
+            network = dummy_classes.build_network(
+                dummy_classes.LOOPED_LINES, compact = True)
+            reference = dummy_classes.build_network(dummy_classes.LOOPED_LINES)
+            network.solve(**kwargs)
+            reference.solve(**kwargs)
+            for name, seg in network.segments.items():
+                self.assertAlmostEqual(
+                    seg.flow.to('gpm').m,
+                    reference.segments[name].flow.to('gpm').m, places = 4)
+            for name, node in network.nodes.items():
+                self.assertAlmostEqual(
+                    node.head.to('ft').m,
+                    reference.nodes[name].head.to('ft').m, places = 4)
+
+    def test_update_element(self):
+        '''Tests that update_element reaches the stored parameters.'''
+        for network in (self.network, self.reference):
+            network.resolve()
+            network.update_element('6', 0, diameter = 3 * ureg.inch)
+            network.resolve()
+        self.assertAlmostEqual(
+            self.network.segments['6'].elements[0].diameter.to('inch').m, 3)
+        self.assertAlmostEqual(self.network.segments['6'].flow.to('gpm').m,
+                               self.reference.segments['6'].flow.to('gpm').m,
+                               places = 4)
+
+    def test_fittings(self):
+        '''Tests that folded fittings solve the same in every mode.'''
+        lines = list(dummy_classes.LOOPED_LINES)
+        for name in ('2', '6'):
+            at = lines.index('segment ' + name) + 4
+            lines[at:at] = ['Fitting -K 0.75 -q 2 -d 2 in',
+                            'Fitting -K 4 -d 2 in']
+        networks = [dummy_classes.build_network(lines, compact = True),
+                    dummy_classes.build_network(lines),
+                    dummy_classes.build_network(lines)]
+        networks[0].solve(engine = 'gga')
+        networks[1].solve(engine = 'gga')
+        networks[2].solve()
+        for network in networks[1:]:
+            for name, seg in networks[0].segments.items():
+                self.assertAlmostEqual(
+                    seg.flow.to('gpm').m,
+                    network.segments[name].flow.to('gpm').m, places = 3)
+        # Editing a fitting reaches the folded coefficient
+        for network in networks[:2]:
+            network.resolve()
+            network.update_element('6', 1, k_factor = 40)
+            network.resolve()
+        self.assertAlmostEqual(networks[0].segments['6'].flow.to('gpm').m,
+                               networks[1].segments['6'].flow.to('gpm').m,
+                               places = 4)
+        self.assertNotAlmostEqual(networks[1].segments['6'].flow.to('gpm').m,
+                                  networks[2].segments['6'].flow.to('gpm').m,
+                                  places = 2)
+
+    def test_foreign_node(self):
+        '''Tests that segments can only join nodes of their own store.'''
+        with self.assertRaises(ValueError):
+            self.network.segments['1'].start = core.Node()
+
+    def test_memory(self):
+        '''Tests that a compact Network takes a fraction of the memory.'''
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'tree.pipey')
+            generate.write(filename, generate.tree(300))
+            core.Network().load(filename) # pint's caches fill up first
+            used = list()
+            for compact in (False, True):
+                tracemalloc.start()
+                network = core.Network(compact = compact)
+                network.load(filename)
+                used.append(tracemalloc.get_traced_memory()[0])
+                tracemalloc.stop()
+                del network
+        self.assertLess(3 * used[1], used[0])
+
+class SlotsTestCase(unittest.TestCase):
+    '''Runs unit tests on the __slots__ of the core classes.'''
+    def test_no_dict(self):
+        '''Tests that segments, nodes, fluids and Pipes have no __dict__.'''
+        pipe = element_classes.Pipe(['-d', '2', 'in', '-l', '10', 'ft'])
+        for obj in (core.PipeSegment(), core.Node(), core.Fluid(), pipe):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(pipe.schedule, '40')
+        self.assertIsNone(pipe.fluid)
+
+compact_suite = unittest.TestLoader().loadTestsFromTestCase(CompactTestCase)
+slots_suite = unittest.TestLoader().loadTestsFromTestCase(SlotsTestCase)
+
+suite = unittest.TestSuite()
+suite.addTests((compact_suite, slots_suite))
@@ -17,6 +17,7 @@
 
 from .context import pipey
 import pipey.utils as utils
+import numpy as np
 import unittest
 from pipey import ureg
 
@@ -58,6 +59,113 @@ class FrictionFactorTests(unittest.TestCase):
         self.assertAlmostEqual(utils.friction_factor(1999), 31.234375,
                                delta = 0.0006)
 
+    def test_friction_factors(self):
+        '''Tests vectorized friction_factors against scalar friction_factor.'''
+        roughness = np.array([0.020, 0.070, 0.004, 0.001, 0.0, 0.0])
+        reynolds = np.array([2e5, 3e4, 6e3, 1e6, 1500, -1999])
+        factors = utils.friction_factors(roughness, reynolds)
+        self.assertEqual(factors.shape, (6,))
+        for f, rr, re in zip(factors, roughness, reynolds):
+            self.assertAlmostEqual(f, utils.friction_factor(rr, abs(re)),
+                                   places = 12)
+
+    def test_transition(self):
+        '''Tests that friction_factors is smooth through the transition.'''
+        for rr in (0.0, 0.001, 0.05):
+            for limit in (utils.LAMINAR_LIMIT, utils.TURBULENT_LIMIT):
+                below, above = limit - 1e-6, limit + 1e-6
+                f, df = utils.friction_factors(rr, np.array([below, above]),
+                                               derivative = True)
+                self.assertAlmostEqual(f[0], f[1], places = 6)
+                self.assertAlmostEqual(df[0], df[1], places = 6)
+        f = utils.friction_factors(0.0, np.linspace(2000, 4000, 101))
+        self.assertTrue(np.all(f > 0))
+
+    def test_colebrook_array_converged(self):
+        '''Tests that colebrook_array satisfies the colebrook equation.'''
+        rng = np.random.RandomState(0)
+        roughness = rng.uniform(0, 0.05, 10000)
+        reynolds = 10**rng.uniform(3.4, 8.5, 10000)
+        x = 1 / np.sqrt(utils.colebrook_array(roughness, reynolds))
+        errors = x + 2 * np.log10(roughness / 3.7 + 2.51 * x / reynolds)
+        self.assertLess(np.max(np.abs(errors)), 1e-9)
+
+    def test_friction_factors_derivative(self):
+        '''Tests derivative of friction_factors against finite differences.'''
+        roughness = np.array([0.020, 0.001, 0.0, 0.0, 0.0, 0.01])
+        reynolds = np.array([2e5, 1e6, 5e3, 1000, 2500, 3500])
+        f, df = utils.friction_factors(roughness, reynolds, derivative = True)
+        step = reynolds * 1e-6
+        diff = (utils.friction_factors(roughness, reynolds + step)
+                - utils.friction_factors(roughness, reynolds - step)) / (2*step)
+        np.testing.assert_allclose(df, diff, rtol = 1e-4)
+
+    def test_darcy_friction_factors(self):
+        '''Tests physical friction factors through all three regimes.'''
+        reynolds = np.array([0, 640, 1999.999, 2000, 3000, 3999.999, 4000, 2e5])
+        f = utils.darcy_friction_factors(0.020, reynolds)
+        self.assertAlmostEqual(f[1], 0.1, places = 12)
+        self.assertAlmostEqual(f[2], f[3], places = 6) # continuous
+        self.assertAlmostEqual(f[5], f[6], places = 6)
+        self.assertAlmostEqual(f[7], utils.colebrook(0.020, 2e5), places = 12)
+        self.assertTrue(np.all(np.isfinite(f)))
+
+        f, df = utils.darcy_friction_factors(
+            0.020, [1999.999, 2000, 3999.999, 4000], derivative = True)
+        self.assertAlmostEqual(df[0], df[1], places = 6)
+        self.assertAlmostEqual(df[2], df[3], places = 6)
+
+        reynolds = np.array([500, 3000, 1e5])
+        f, df = utils.darcy_friction_factors(0.001, reynolds, derivative = True)
+        step = 1e-3
+        diff = (utils.darcy_friction_factors(0.001, reynolds + step)
+                - utils.darcy_friction_factors(0.001, reynolds - step)) / (2*step)
+        np.testing.assert_allclose(df, diff, rtol = 1e-5)
+
+class FormattingTests(unittest.TestCase):
+    '''Runs unit tests on check_formatting and related functions.'''
+    def lines(self, text):
+        return list(utils.read_lines(text.split('\n')))
+
+    def test_valid(self):
+        '''Tests that valid input is passed through unchanged.'''
+        lines = self.lines('segment 1\nstart A\nend B\n'
+                           'Pipe -s 40 -d 2 in -l 100 ft\n\n'
+                           'node A\nhead 10 ft\nunknown outflow\n\n'
+                           'node B\ninflow 5 gpm\n\nfluid\n')
+        self.assertListEqual(list(utils.check_formatting(lines)), lines)
+
+    def test_errors(self):
+        '''Tests that bad lines raise FormattingError with line numbers.'''
+        bad = (('start A', 1),
+               ('segment 1\nstart A B', 2),
+               ('segment 1\nstart A\nflow 3', 3),
+               ('segment 1 2', 1),
+               ('node A\nhead ten ft', 2),
+               ('node A\noutflow 5', 2),
+               ('node A\nunknown head', 2),
+               ('segment 1\nstart A\n\nend B', 4))
+        for text, line_number in bad:
+            with self.assertRaises(utils.FormattingError) as cm:
+                list(utils.check_formatting(self.lines(text)))
+            self.assertEqual(cm.exception.line_number, line_number)
+
+    def test_streaming(self):
+        '''Tests that check_formatting consumes its input lazily.'''
+        consumed = list()
+        def source():
+            for line in (['node', 'A'], ['head', '1', 'ft'], ['bogus']):
+                consumed.append(line)
+                yield line
+        checked = utils.check_formatting(source())
+        self.assertEqual(next(checked), ['node', 'A'])
+        self.assertEqual(len(consumed), 1)
+
+    def test_parse_units(self):
+        '''Tests that parse_units caches unit objects.'''
+        self.assertIs(utils.parse_units('gpm'), utils.parse_units('gpm'))
+        self.assertEqual(utils.parse_units('feet'), ureg.feet)
+
 class TestReynolds(unittest.TestCase):
     '''Tests calculation of reynolds number.'''
     def runTest(self):
@@ -69,8 +177,9 @@ class TestReynolds(unittest.TestCase):
                                1932471.397, places = 3)
 
 ff_suite = unittest.TestLoader().loadTestsFromTestCase(FrictionFactorTests)
+format_suite = unittest.TestLoader().loadTestsFromTestCase(FormattingTests)
 r_suite = unittest.TestLoader().loadTestsFromTestCase(TestReynolds)
 
 suite = unittest.TestSuite()
-suite.addTests((ff_suite, r_suite,))
+suite.addTests((ff_suite, format_suite, r_suite,))
 